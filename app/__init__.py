@@ -2,22 +2,52 @@
 
 import os
 
+import click
 from flask import Flask, render_template
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_migrate import Migrate
 from flask_bootstrap import Bootstrap
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from config import app_config
+from .assets import Assets
+from .audit import AuditLog
+from .database import SQLAlchemy
+from .health import Health
+from .jobs import JobQueue
+from .ratelimit import LoginLimiter
+from .sessions import SessionStore
+from .slow_queries import SlowQueryLog
+from .tenancy import Tenancy
+from .templating import init_templates
+from .tokens import AccessTokens
+from .webhooks import WebhookDispatcher
 
 db = SQLAlchemy()
 login_manager = LoginManager()
+login_limiter = LoginLimiter()
+session_store = SessionStore()
+audit_log = AuditLog()
+assets = Assets()
+job_queue = JobQueue()
+tenancy = Tenancy()
+webhook_dispatcher = WebhookDispatcher()
+health = Health()
+slow_query_log = SlowQueryLog()
+access_tokens = AccessTokens()
+
+
+def trust_proxies(app):
+    """Take the client's address and scheme from PROXY_FIX_HOPS proxies."""
+    hops = app.config['PROXY_FIX_HOPS']
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
 
 
 def create_app(config_name):
     """Create the app based on a supplied config."""
     if os.environ.get('FLASK_CONFIG') == 'production':
         app = Flask(__name__)
+        app.config.from_object(app_config['production'])
         app.config.update(
             SECRET_KEY=os.environ.get('SECRET_KEY'),
             SQLALCHEMY_DATABASE_URI=os.environ.get('SQLALCHEMY_DATABASE_URI')
@@ -27,14 +57,35 @@ def create_app(config_name):
         app.config.from_object(app_config[config_name])
         app.config.from_pyfile('config.py')
 
+    trust_proxies(app)
     Bootstrap(app)
+    assets.init_app(app)
     db.init_app(app)
+    slow_query_log.init_app(app)
+    tenancy.init_app(app)
+    health.init_app(app)
+    # Load balancers probe by address rather than by a tenant's host name.
+    tenancy.exempt(app, 'healthz', 'readyz')
     login_manager.init_app(app)
     login_manager.login_message = "You must be logged in to access this page."
     login_manager.login_view = "auth.login"
-    migrate = Migrate(app, db)
+    login_limiter.init_app(app)
+    session_store.init_app(app)
+    access_tokens.init_app(app)
+    audit_log.init_app(app)
+    job_queue.init_app(app)
+    webhook_dispatcher.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # Alembic is slow to import and only the `flask db` commands use it.
+        from flask_migrate import Migrate
+        Migrate(app, db)
 
-    from app import models
+    from app import backup, directory
+    # Imported for their side effects: they register the session listeners
+    # and the job tasks.
+    from app import hierarchy, history, models, outbox, tasks  # noqa: F401
+    app.cli.add_command(backup.backup_cli)
+    app.cli.add_command(directory.directory_cli)
 
     from .admin import admin as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
@@ -57,4 +108,10 @@ def create_app(config_name):
     def internal_server_error(error):
         return render_template('errors/500.html', title='Server Error'), 500
 
+    init_templates(app)
+    # CLI commands such as `flask db upgrade` may run before the schema
+    # exists and serve no requests.
+    if app.config['WARMUP'] and click.get_current_context(silent=True) is None:
+        health.warm_up(app)
+
     return app
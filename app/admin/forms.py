@@ -1,9 +1,14 @@
+from urllib.parse import urlsplit
+
+from flask import current_app
 from flask_wtf import FlaskForm
-from wtforms import StringField, SubmitField
+from wtforms import SelectMultipleField, StringField, SubmitField
 from wtforms_alchemy import QuerySelectField
-from wtforms.validators import DataRequired
+from wtforms.validators import URL, DataRequired, ValidationError
 
 from ..models import Department, Role
+from ..queries import active_employee_by_email
+from ..webhooks import ENTITIES, checked_address
 
 
 class DepartmentForm(FlaskForm):
@@ -22,6 +27,28 @@ class RoleForm(FlaskForm):
     submit = SubmitField('Submit')
 
 
+class EmployeeEmailField(StringField):
+    """Field for an active employee, entered by their email.
+
+    The employee is looked up when the form is validated, instead of every
+    employee being loaded as an option.
+    """
+
+    def _value(self):
+        return getattr(self.data, 'email', self.data) or ''
+
+    def pre_validate(self, form):
+        if not isinstance(self.data, str):
+            return
+        if not self.data.strip():
+            self.data = None
+            return
+        employee = active_employee_by_email(self.data.strip())
+        if employee is None or employee.is_admin:
+            raise ValidationError('No active employee has that email.')
+        self.data = employee
+
+
 class EmployeeAssignForm(FlaskForm):
     """Form for admin to assign departments and roles to employees."""
 
@@ -29,4 +56,45 @@ class EmployeeAssignForm(FlaskForm):
                                   get_label="name")
     role = QuerySelectField(query_factory=lambda: Role.query.all(),
                             get_label="name")
-    submit = SubmitField('Submit')
\ No newline at end of file
+    manager = EmployeeEmailField(
+        "Manager's email", description='Leave empty for no manager.')
+    submit = SubmitField('Submit')
+
+
+class ActionForm(FlaskForm):
+    """Form for admin to confirm a one-click action."""
+
+    submit = SubmitField('Submit')
+
+
+class ReassignDepartmentForm(FlaskForm):
+    """Form for admin to move every employee of a department to another."""
+
+    source = QuerySelectField(query_factory=lambda: Department.query.all(),
+                              get_label="name")
+    target = QuerySelectField(query_factory=lambda: Department.query.all(),
+                              get_label="name")
+    submit = SubmitField('Move Employees')
+
+
+class WebhookForm(FlaskForm):
+    """Form for admin to add a webhook."""
+
+    url = StringField('URL', validators=[DataRequired(),
+                                         URL(require_tld=False)])
+    entities = SelectMultipleField(
+        'Changes', choices=[(entity, entity.capitalize())
+                            for entity in ENTITIES],
+        description='Leave empty to send every change.')
+    submit = SubmitField('Add Webhook')
+
+    def validate_url(self, field):
+        if not field.data.lower().startswith(('http://', 'https://')):
+            raise ValidationError('Use an http or https URL.')
+        parts = urlsplit(field.data)
+        try:
+            checked_address(parts.hostname, parts.port or (
+                443 if parts.scheme.lower() == 'https' else 80),
+                current_app.config['WEBHOOK_ALLOWED_NETWORKS'])
+        except ValueError as exc:
+            raise ValidationError(str(exc))
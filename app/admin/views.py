@@ -1,10 +1,33 @@
-from flask import abort, flash, redirect, render_template, url_for
+from datetime import datetime, time
+
+from flask import (abort, current_app, flash, jsonify, redirect,
+                   render_template, request, url_for)
 from flask_login import current_user, login_required
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from . import admin
-from .forms import DepartmentForm, EmployeeAssignForm, RoleForm
-from .. import db
-from ..models import Department, Employee, Role
+from .. import audit_log, db, job_queue, webhook_dispatcher
+from ..archive import deactivate, reactivate, restore
+from ..batch import BatchError, run as run_batch
+from ..audit import snapshot
+from ..history import (END_OF_TIME, assignment_history, assignments_as_of,
+                       headcount_as_of)
+from ..hierarchy import (HierarchyError, headcount_under, reporting_chain,
+                         set_manager, subordinates)
+from ..jobs import describe
+from ..models import (ArchivedEmployee, Department, Employee, Job, Role,
+                      SlowQuery, Webhook, WebhookDelivery)
+from ..outbox import changes_since
+from ..streaming import RowStream, stream_template, url_template
+
+# The forms are imported inside the views that use them: wtforms_alchemy
+# is slow to import and most admin requests never build a form.
+
+# Members shown per page of a department or role.
+MEMBERS_PER_PAGE = 50
 
 
 def check_admin():
@@ -13,6 +36,65 @@ def check_admin():
         abort(403)
 
 
+def page_limit(default=500, maximum=1000):
+    """Return the request's limit argument, clamped to 1..maximum."""
+    return max(1, min(request.args.get('limit', default, type=int), maximum))
+
+
+def employee_counts(column):
+    """Return a subquery counting employees grouped by a foreign key."""
+    return db.session.query(
+        column.label('group_id'),
+        func.count(Employee.id).label('employee_count')).filter(
+        Employee.is_active.is_(True)).group_by(column).subquery()
+
+
+def list_members(group, after=0, limit=MEMBERS_PER_PAGE):
+    """Return a department's or role's active employees after an id.
+
+    Returns (employee count, employees, has more). Both queries go through
+    the dynamic employees relationship and are served by the
+    (foreign key, is_active, id) indexes, so a page costs the same however
+    large the group is.
+    """
+    # = rather than IS, which MySQL cannot match against an index.
+    active = group.employees.filter(Employee.is_active == db.true())
+    count = active.with_entities(func.count(Employee.id)).scalar()
+    members = active.options(
+        joinedload(Employee.department), joinedload(Employee.role)).filter(
+        Employee.id > after).order_by(Employee.id).limit(limit + 1).all()
+    return count, members[:limit], len(members) > limit
+
+
+def render_members(group, endpoint, title):
+    """Render a page of a department's or role's members."""
+    after = request.args.get('after', 0, type=int)
+    count, members, has_more = list_members(group, after)
+    return render_template('admin/members.html', group=group,
+                           endpoint=endpoint, employee_count=count,
+                           members=members, after=after,
+                           has_more=has_more, title=title)
+
+
+def members_json(group):
+    """Return a page of a department's or role's members as JSON."""
+    after = request.args.get('after', 0, type=int)
+    limit = page_limit()
+    count, members, has_more = list_members(group, after, limit)
+    return jsonify(id=group.id, name=group.name, employee_count=count,
+                   employees=[{
+                       'id': employee.id,
+                       'username': employee.username,
+                       'first_name': employee.first_name,
+                       'last_name': employee.last_name,
+                       'department_id': employee.department_id,
+                       'role_id': employee.role_id,
+                       'manager_id': employee.manager_id
+                   } for employee in members],
+                   cursor=members[-1].id if members else after,
+                   has_more=has_more)
+
+
 # Department Views
 
 @admin.route('/departments', methods=['GET', 'POST'])
@@ -21,10 +103,17 @@ def list_departments():
     """List all departments."""
     check_admin()
 
-    departments = Department.query.all()
-
-    return render_template('admin/departments/departments.html',
-                           departments=departments,
+    counts = employee_counts(Employee.department_id)
+    departments = db.session.query(
+        Department, func.coalesce(counts.c.employee_count, 0)).outerjoin(
+        counts, counts.c.group_id == Department.id).order_by(
+        Department.id).yield_per(500)
+
+    return stream_template('admin/departments/departments.html',
+                           departments=RowStream(departments),
+                           detail_url=url_template('admin.department_detail'),
+                           edit_url=url_template('admin.edit_department'),
+                           delete_url=url_template('admin.delete_department'),
                            title='Departments')
 
 
@@ -33,6 +122,7 @@ def list_departments():
 def add_department():
     """Add a department to the database."""
     check_admin()
+    from .forms import DepartmentForm
 
     add_department = True
 
@@ -42,7 +132,10 @@ def add_department():
                                 description=form.description.data)
         try:
             db.session.add(department)
+            db.session.flush()
+            after = snapshot(department)
             db.session.commit()
+            audit_log.record('add', department, after=after)
             flash('You have successfully added a new department.')
         except:
             db.session.rollback()
@@ -62,15 +155,19 @@ def add_department():
 def edit_department(id):
     """Edit a department."""
     check_admin()
+    from .forms import DepartmentForm
 
     add_department = False
 
     department = Department.query.get_or_404(id)
     form = DepartmentForm(obj=department)
     if form.validate_on_submit():
+        before = snapshot(department)
         department.name = form.name.data
         department.description = form.description.data
+        after = snapshot(department)
         db.session.commit()
+        audit_log.record('edit', department, before=before, after=after)
         flash('You have successfully edited the department.')
 
         return redirect(url_for('admin.list_departments'))
@@ -92,8 +189,10 @@ def delete_department(id):
     check_admin()
 
     department = Department.query.get_or_404(id)
+    before = snapshot(department)
     db.session.delete(department)
     db.session.commit()
+    audit_log.record('delete', department, before=before)
     flash('You have successfully deleted the department.')
 
     return redirect(url_for('admin.list_departments'))
@@ -101,15 +200,41 @@ def delete_department(id):
     return render_template(title='Delete Department')
 
 
+@admin.route('/departments/<int:id>')
+@login_required
+def department_detail(id):
+    """Show a department and a page of its members."""
+    check_admin()
+
+    return render_members(Department.query.get_or_404(id),
+                          'admin.department_detail', 'Department')
+
+
+@admin.route('/api/departments/<int:id>/employees')
+@login_required
+def list_department_employees(id):
+    """Return a page of a department's members as JSON, by employee id."""
+    check_admin()
+
+    return members_json(Department.query.get_or_404(id))
+
+
 @admin.route('/roles')
 @login_required
 def list_roles():
     """List all roles."""
     check_admin()
 
-    roles = Role.query.all()
-    return render_template('admin/roles/roles.html',
-                           roles=roles,
+    counts = employee_counts(Employee.role_id)
+    roles = db.session.query(
+        Role, func.coalesce(counts.c.employee_count, 0)).outerjoin(
+        counts, counts.c.group_id == Role.id).order_by(
+        Role.id).yield_per(500)
+    return stream_template('admin/roles/roles.html',
+                           roles=RowStream(roles),
+                           detail_url=url_template('admin.role_detail'),
+                           edit_url=url_template('admin.edit_role'),
+                           delete_url=url_template('admin.delete_role'),
                            title='Roles')
 
 
@@ -118,6 +243,7 @@ def list_roles():
 def add_role():
     """Add a role to the database."""
     check_admin()
+    from .forms import RoleForm
 
     add_role = True
 
@@ -127,7 +253,10 @@ def add_role():
 
         try:
             db.session.add(role)
+            db.session.flush()
+            after = snapshot(role)
             db.session.commit()
+            audit_log.record('add', role, after=after)
             flash('You have successfully added a new role.')
         except:
             db.session.rollback()
@@ -146,16 +275,20 @@ def add_role():
 def edit_role(id):
     """Edit a role."""
     check_admin()
+    from .forms import RoleForm
 
     add_role = False
 
     role = Role.query.get_or_404(id)
     form = RoleForm(obj=role)
     if form.validate_on_submit():
+        before = snapshot(role)
         role.name = form.name.data
         role.description = form.description.data
         db.session.add(role)
+        after = snapshot(role)
         db.session.commit()
+        audit_log.record('edit', role, before=before, after=after)
         flash('You have successfully edited the role.')
 
         return redirect(url_for('admin.list_roles'))
@@ -175,8 +308,10 @@ def delete_role(id):
     check_admin()
 
     role = Role.query.get_or_404(id)
+    before = snapshot(role)
     db.session.delete(role)
     db.session.commit()
+    audit_log.record('delete', role, before=before)
     flash('You have successfully deleted the role.')
 
     return redirect(url_for('admin.list_roles'))
@@ -185,16 +320,42 @@ def delete_role(id):
     return render_template(title='Delete Role')
 
 
+@admin.route('/roles/<int:id>')
+@login_required
+def role_detail(id):
+    """Show a role and a page of the employees who hold it."""
+    check_admin()
+
+    return render_members(Role.query.get_or_404(id), 'admin.role_detail',
+                          'Role')
+
+
+@admin.route('/api/roles/<int:id>/employees')
+@login_required
+def list_role_employees(id):
+    """Return a page of a role's employees as JSON, by employee id."""
+    check_admin()
+
+    return members_json(Role.query.get_or_404(id))
+
+
 @admin.route('/employees')
 @login_required
 def list_employees():
     """List all employees."""
     check_admin()
 
-    employees = Employee.query.all()
-    return render_template('admin/employees/employees.html',
-                           employees=employees,
-                           title='Employees')
+    employees = Employee.query.options(
+        joinedload(Employee.department), joinedload(Employee.role)).filter(
+        Employee.is_active.is_(True)).order_by(Employee.id).yield_per(500)
+    return stream_template(
+        'admin/employees/employees.html',
+        employees=RowStream(employees),
+        org_chart_url=url_template('admin.org_chart'),
+        assign_url=url_template('admin.assign_employee'),
+        deactivate_url=url_template('admin.deactivate_employee'),
+        csrf_token=generate_csrf(),
+        title='Employees')
 
 
 @admin.route('/employees/assign/<int:id>', methods=['GET', 'POST'])
@@ -202,6 +363,7 @@ def list_employees():
 def assign_employee(id):
     """Assign a department and a role to an employee."""
     check_admin()
+    from .forms import EmployeeAssignForm
 
     employee = Employee.query.get_or_404(id)
 
@@ -210,10 +372,20 @@ def assign_employee(id):
 
     form = EmployeeAssignForm(obj=employee)
     if form.validate_on_submit():
+        before = snapshot(employee)
         employee.department = form.department.data
         employee.role = form.role.data
+        try:
+            set_manager(employee, form.manager.data)
+        except HierarchyError as error:
+            db.session.rollback()
+            flash(str(error))
+            return redirect(url_for('admin.assign_employee', id=id))
         db.session.add(employee)
+        db.session.flush()
+        after = snapshot(employee)
         db.session.commit()
+        audit_log.record('assign', employee, before=before, after=after)
         flash('You have successfully assigned a department and role.')
 
         return redirect(url_for('admin.list_employees'))
@@ -222,3 +394,416 @@ def assign_employee(id):
                            employee=employee,
                            form=form,
                            title='Assign Employee')
+
+
+@admin.route('/employees/<int:id>/org-chart')
+@login_required
+def org_chart(id):
+    """Show an employee's managers and the people under them."""
+    check_admin()
+
+    employee = Employee.query.get_or_404(id)
+    max_depth = request.args.get('depth', 3, type=int)
+
+    nodes = {employee.id: {'employee': employee, 'children': []}}
+    for report, depth in subordinates(employee, max_depth):
+        nodes[report.id] = {'employee': report, 'children': []}
+        nodes[report.manager_id]['children'].append(nodes[report.id])
+
+    return render_template('admin/employees/org_chart.html',
+                           employee=employee,
+                           chain=reporting_chain(employee),
+                           tree=nodes[employee.id]['children'],
+                           headcount=headcount_under(employee),
+                           shown=len(nodes) - 1,
+                           max_depth=max_depth,
+                           title='Org Chart')
+
+
+@admin.route('/employees/<int:id>/deactivate', methods=['POST'])
+@login_required
+def deactivate_employee(id):
+    """Deactivate a departed employee."""
+    check_admin()
+    from .forms import ActionForm
+
+    employee = Employee.query.get_or_404(id)
+    if employee.is_admin or not employee.is_active:
+        abort(403)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    before = snapshot(employee)
+    deactivate(employee)
+    db.session.flush()
+    after = snapshot(employee)
+    db.session.commit()
+    audit_log.record('deactivate', employee, before=before, after=after)
+    flash('You have successfully deactivated the employee.')
+
+    return redirect(url_for('admin.list_employees'))
+
+
+@admin.route('/employees/inactive')
+@login_required
+def list_inactive_employees():
+    """List deactivated and archived employees."""
+    check_admin()
+    from .forms import ActionForm
+
+    inactive = Employee.query.filter(Employee.is_active.is_(False)).order_by(
+        Employee.deactivated_at.desc()).all()
+    archived = ArchivedEmployee.query.order_by(
+        ArchivedEmployee.archived_at.desc()).limit(100).all()
+    return render_template('admin/employees/inactive.html',
+                           inactive=inactive, archived=archived,
+                           form=ActionForm(), title='Inactive Employees')
+
+
+@admin.route('/employees/<int:id>/reactivate', methods=['POST'])
+@login_required
+def reactivate_employee(id):
+    """Reactivate a deactivated employee."""
+    check_admin()
+    from .forms import ActionForm
+
+    employee = Employee.query.get_or_404(id)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    before = snapshot(employee)
+    reactivate(employee)
+    after = snapshot(employee)
+    db.session.commit()
+    audit_log.record('reactivate', employee, before=before, after=after)
+    flash('You have successfully reactivated the employee.')
+
+    return redirect(url_for('admin.list_inactive_employees'))
+
+
+@admin.route('/employees/archive/<int:id>/restore', methods=['POST'])
+@login_required
+def restore_employee(id):
+    """Move an archived employee back to the active employees."""
+    check_admin()
+    from .forms import ActionForm
+
+    archived = ArchivedEmployee.query.get_or_404(id)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+
+    try:
+        employee = restore(archived)
+        db.session.flush()
+        after = snapshot(employee)
+        db.session.commit()
+        audit_log.record('restore', employee, after=after)
+        flash('You have successfully restored the employee.')
+    except IntegrityError:
+        db.session.rollback()
+        flash('Error: The email or username is now used by someone else.')
+
+    return redirect(url_for('admin.list_inactive_employees'))
+
+
+@admin.route('/employees/archive', methods=['POST'])
+@login_required
+def archive_employees():
+    """Queue archiving employees that have been inactive for long."""
+    check_admin()
+    from .forms import ActionForm
+
+    if not ActionForm().validate_on_submit():
+        abort(400)
+    return start_job('archive_employees')
+
+
+# Assignment History Views
+
+def parse_as_of(value):
+    """Parse an as_of argument; a bare date means the end of that day."""
+    if not value:
+        return datetime.utcnow()
+    for fmt in ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M'):
+        try:
+            moment = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return datetime.combine(moment.date(), time.max) \
+            if fmt == '%Y-%m-%d' else moment
+    abort(400)
+
+
+@admin.route('/org')
+@login_required
+def org_as_of():
+    """Show headcounts, and one department's members, as of a date."""
+    check_admin()
+
+    as_of = parse_as_of(request.args.get('as_of'))
+    department_id = request.args.get('department_id', type=int)
+    headcounts = headcount_as_of(as_of)
+    departments = Department.query.filter(
+        Department.id.in_([id for id in headcounts if id is not None])).all()
+    members = []
+    if department_id is not None:
+        members = assignments_as_of(as_of, department_id=department_id,
+                                    limit=1000)
+    return render_template('admin/org/as_of.html', as_of=as_of,
+                           headcounts=headcounts, departments=departments,
+                           department_id=department_id, members=members,
+                           title='Org As Of')
+
+
+@admin.route('/api/org')
+@login_required
+def list_assignments():
+    """Return the assignments in effect at as_of as JSON, by employee id."""
+    check_admin()
+
+    as_of = parse_as_of(request.args.get('as_of'))
+    after = request.args.get('after', 0, type=int)
+    limit = page_limit()
+    rows = assignments_as_of(as_of,
+                             department_id=request.args.get(
+                                 'department_id', type=int),
+                             role_id=request.args.get('role_id', type=int),
+                             after=after, limit=limit)
+    return jsonify(as_of=as_of, assignments=rows,
+                   cursor=rows[-1]['employee_id'] if rows else after,
+                   has_more=len(rows) == limit)
+
+
+@admin.route('/api/employees/<int:id>/assignments')
+@login_required
+def list_employee_assignments(id):
+    """Return an employee's assignment history as JSON."""
+    check_admin()
+
+    return jsonify(assignments=[{
+        'department_id': assignment.department_id,
+        'role_id': assignment.role_id,
+        'manager_id': assignment.manager_id,
+        'valid_from': assignment.valid_from,
+        'valid_to': (assignment.valid_to
+                     if assignment.valid_to != END_OF_TIME else None)
+    } for assignment in assignment_history(id)])
+
+
+# Change Stream Views
+
+@admin.route('/api/changes')
+@login_required
+def list_changes():
+    """Return the changes made after a cursor as JSON."""
+    check_admin()
+
+    cursor = request.args.get('since', 0, type=int)
+    limit = page_limit()
+    changes = changes_since(cursor, limit, request.args.get('entity'))
+    return jsonify(changes=changes,
+                   cursor=changes[-1]['seq'] if changes else cursor,
+                   has_more=len(changes) == limit)
+
+
+# Job Views
+
+@admin.route('/jobs')
+@login_required
+def list_jobs():
+    """List recent background jobs."""
+    check_admin()
+    from .forms import ActionForm, ReassignDepartmentForm
+
+    jobs = Job.query.order_by(Job.id.desc()).limit(50).all()
+    return render_template('admin/jobs/jobs.html', jobs=jobs,
+                           form=ActionForm(),
+                           reassign_form=ReassignDepartmentForm(),
+                           status_url=url_template('admin.job_status'),
+                           title='Jobs')
+
+
+def start_job(name, **args):
+    """Queue a job for a task and report it to the admin."""
+    job = job_queue.enqueue(name, created_by=current_user.id, **args)
+    db.session.commit()
+    flash('Job {} has been queued.'.format(job.id))
+    return redirect(url_for('admin.list_jobs'))
+
+
+@admin.route('/jobs/rebuild-org-chart', methods=['POST'])
+@login_required
+def rebuild_org_chart():
+    """Queue a rebuild of the reporting lines."""
+    check_admin()
+    from .forms import ActionForm
+
+    if not ActionForm().validate_on_submit():
+        abort(400)
+    return start_job('rebuild_org_chart')
+
+
+@admin.route('/jobs/reassign-department', methods=['POST'])
+@login_required
+def reassign_department():
+    """Queue moving every employee of a department to another."""
+    check_admin()
+    from .forms import ReassignDepartmentForm
+
+    form = ReassignDepartmentForm()
+    if not form.validate_on_submit():
+        abort(400)
+    if form.source.data.id == form.target.data.id:
+        flash('Error: Choose two different departments.')
+        return redirect(url_for('admin.list_jobs'))
+    return start_job('reassign_department', from_id=form.source.data.id,
+                     to_id=form.target.data.id)
+
+
+@admin.route('/jobs/<int:id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(id):
+    """Cancel a queued or running job."""
+    check_admin()
+    from .forms import ActionForm
+
+    job = Job.query.get_or_404(id)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+    if job_queue.cancel(job):
+        flash('Job {} has been cancelled.'.format(id))
+    else:
+        flash('Error: Job {} has already finished.'.format(id))
+    return redirect(url_for('admin.list_jobs'))
+
+
+@admin.route('/jobs/<int:id>/retry', methods=['POST'])
+@login_required
+def retry_job(id):
+    """Queue a failed or cancelled job again."""
+    check_admin()
+    from .forms import ActionForm
+
+    job = Job.query.get_or_404(id)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+    if job_queue.retry(job):
+        flash('Job {} has been queued again.'.format(id))
+    else:
+        flash('Error: Only failed or cancelled jobs can be retried.')
+    return redirect(url_for('admin.list_jobs'))
+
+
+@admin.route('/api/jobs/<int:id>')
+@login_required
+def job_status(id):
+    """Return the status and progress of a job as JSON."""
+    check_admin()
+
+    return jsonify(describe(Job.query.get_or_404(id)))
+
+
+# Webhook Views
+
+@admin.route('/webhooks', methods=['GET', 'POST'])
+@login_required
+def list_webhooks():
+    """List the webhooks and add new ones."""
+    check_admin()
+    from .forms import ActionForm, WebhookForm
+
+    form = WebhookForm()
+    if form.validate_on_submit():
+        webhook = webhook_dispatcher.add(form.url.data, form.entities.data)
+        db.session.commit()
+        audit_log.record('create', webhook, after=snapshot(webhook))
+        flash('The webhook has been added. Its changes are signed with '
+              'the secret shown below.')
+        return redirect(url_for('admin.list_webhooks'))
+
+    webhooks = Webhook.query.order_by(Webhook.id).all()
+    return render_template('admin/webhooks/webhooks.html',
+                           webhooks=webhooks, form=form,
+                           action_form=ActionForm(), title='Webhooks')
+
+
+@admin.route('/webhooks/<int:id>')
+@login_required
+def webhook_detail(id):
+    """Show a webhook's recent deliveries."""
+    check_admin()
+    from .forms import ActionForm
+
+    webhook = Webhook.query.get_or_404(id)
+    deliveries = webhook.deliveries.order_by(
+        WebhookDelivery.id.desc()).limit(50).all()
+    return render_template('admin/webhooks/webhook.html', webhook=webhook,
+                           deliveries=deliveries, form=ActionForm(),
+                           title='Webhook')
+
+
+@admin.route('/webhooks/<int:id>/retry', methods=['POST'])
+@login_required
+def retry_webhook(id):
+    """Send a failing webhook's pending changes without waiting."""
+    check_admin()
+    from .forms import ActionForm
+
+    webhook = Webhook.query.get_or_404(id)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+    webhook.next_attempt_at = None
+    webhook.is_active = True
+    db.session.commit()
+    flash('The webhook will be retried shortly.')
+    return redirect(url_for('admin.webhook_detail', id=id))
+
+
+@admin.route('/webhooks/<int:id>/delete', methods=['POST'])
+@login_required
+def delete_webhook(id):
+    """Delete a webhook and its deliveries."""
+    check_admin()
+    from .forms import ActionForm
+
+    webhook = Webhook.query.get_or_404(id)
+    if not ActionForm().validate_on_submit():
+        abort(400)
+    before = snapshot(webhook)
+    db.session.delete(webhook)
+    db.session.commit()
+    audit_log.record('delete', webhook, before=before)
+    flash('The webhook has been deleted.')
+    return redirect(url_for('admin.list_webhooks'))
+
+
+# Slow Query Views
+
+@admin.route('/slow-queries')
+@login_required
+def list_slow_queries():
+    """List the statements that took the most time above the threshold."""
+    check_admin()
+
+    queries = SlowQuery.query.order_by(SlowQuery.total_ms.desc()).limit(
+        50).all()
+    return render_template('admin/slow_queries.html', queries=queries,
+                           threshold=current_app.config.get(
+                               'SLOW_QUERY_THRESHOLD'),
+                           title='Slow Queries')
+
+
+@admin.route('/api/batch', methods=['POST'])
+@login_required
+def batch():
+    """Apply a list of operations in one transaction."""
+    check_admin()
+
+    data = request.get_json(silent=True)
+    try:
+        results = run_batch(
+            data.get('operations') if isinstance(data, dict) else None,
+            current_app.config['BATCH_MAX_OPERATIONS'])
+    except BatchError as error:
+        return jsonify(error=str(error), index=error.index), 422
+    return jsonify(results=results)
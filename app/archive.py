@@ -0,0 +1,81 @@
+"""Deactivation of departed employees and archival of long-inactive ones."""
+
+from datetime import datetime
+
+from sqlalchemy import literal, or_, select
+
+from . import db
+from .hierarchy import hierarchy, set_manager
+from .models import ArchivedEmployee, Employee
+
+employees = Employee.__table__
+archive = ArchivedEmployee.__table__
+
+# Columns copied between employees and employees_archive.
+COLUMNS = [column.key for column in employees.columns]
+
+# Employees moved per transaction by archive_inactive.
+CHUNK_SIZE = 500
+
+
+def deactivate(employee):
+    """Mark an employee inactive and hand their reports to their manager."""
+    for report in employee.reports.all():
+        set_manager(report, employee.manager)
+    set_manager(employee, None)
+    employee.is_active = False
+    employee.deactivated_at = datetime.utcnow()
+
+
+def reactivate(employee):
+    """Mark a deactivated employee active again."""
+    employee.is_active = True
+    employee.deactivated_at = None
+
+
+def archive_inactive(before, chunk_size=CHUNK_SIZE, progress=None):
+    """Move employees deactivated before a date to employees_archive.
+
+    Each chunk of ids is copied and deleted in its own short transaction,
+    so the employees table is never locked for long. progress, if given,
+    is called with (done, total) after each chunk. Returns the number of
+    employees archived.
+    """
+    ids = [row[0] for row in db.session.query(Employee.id).filter(
+        Employee.is_active.is_(False),
+        Employee.deactivated_at < before).order_by(Employee.id)]
+    db.session.commit()
+
+    archived = 0
+    for start in range(0, len(ids), chunk_size):
+        # Skip anyone reactivated since the ids were read.
+        chunk = [row[0] for row in db.session.query(Employee.id).filter(
+            Employee.id.in_(ids[start:start + chunk_size]),
+            Employee.is_active.is_(False)).with_for_update()]
+        if chunk:
+            db.session.execute(archive.insert().from_select(
+                COLUMNS + ['archived_at'],
+                select([employees.c[key] for key in COLUMNS] +
+                       [literal(datetime.utcnow())])
+                .where(employees.c.id.in_(chunk))))
+            db.session.execute(hierarchy.delete().where(or_(
+                hierarchy.c.ancestor_id.in_(chunk),
+                hierarchy.c.descendant_id.in_(chunk))))
+            db.session.execute(employees.delete().where(
+                employees.c.id.in_(chunk)))
+        db.session.commit()
+        archived += len(chunk)
+        if progress is not None:
+            progress(min(start + chunk_size, len(ids)), len(ids))
+    return archived
+
+
+def restore(archived):
+    """Move an archived employee back to employees as an active employee."""
+    employee = Employee(**dict((key, getattr(archived, key))
+                               for key in COLUMNS))
+    employee.manager_id = None
+    reactivate(employee)
+    db.session.delete(archived)
+    db.session.add(employee)
+    return employee
@@ -0,0 +1,267 @@
+"""Fingerprinted, precompressed static assets for the Dream Team app."""
+
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from urllib.request import urlopen
+
+import click
+from flask import abort, current_app, request, safe_join, send_file, url_for
+from flask.cli import AppGroup
+
+# Third-party assets fetched once by `flask assets vendor` so the app does
+# not depend on CDNs at runtime.
+VENDOR_ASSETS = {
+    'vendor/bootstrap/css/bootstrap.min.css':
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.2.1/css/'
+        'bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.min.js':
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.2.1/js/'
+        'bootstrap.min.js',
+    'vendor/jquery/jquery.min.js':
+        'https://code.jquery.com/jquery-3.3.1.min.js',
+    'vendor/font-awesome/css/font-awesome.min.css':
+        'https://stackpath.bootstrapcdn.com/font-awesome/4.7.0/css/'
+        'font-awesome.min.css',
+}
+for _font in ('fontawesome-webfont.eot', 'fontawesome-webfont.svg',
+              'fontawesome-webfont.ttf', 'fontawesome-webfont.woff',
+              'fontawesome-webfont.woff2', 'FontAwesome.otf'):
+    VENDOR_ASSETS['vendor/font-awesome/fonts/' + _font] = (
+        'https://stackpath.bootstrapcdn.com/font-awesome/4.7.0/fonts/' +
+        _font)
+
+# Resized and WebP variants of hero images: source -> [(width, output)].
+IMAGE_VARIANTS = {
+    'img/intro-bg.jpg': [
+        (None, 'img/intro-bg.webp'),
+        (768, 'img/intro-bg-768.jpg'),
+        (768, 'img/intro-bg-768.webp'),
+    ],
+}
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.eot', '.otf', '.json')
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")?#]+)([^'")]*)\1\s*\)''')
+
+
+def _fingerprint(path, content):
+    digest = hashlib.md5(content).hexdigest()[:10]
+    root, ext = posixpath.splitext(path)
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def _rewrite_css(path, css, manifest):
+    """Point relative url() references in a stylesheet at hashed files."""
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        quote, target, suffix = match.groups()
+        if ':' in target or target.startswith('/'):
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(base, target))
+        hashed = manifest.get(resolved)
+        if hashed is None:
+            return match.group(0)
+        relative = posixpath.relpath(hashed, base)
+        return 'url({0}{1}{2}{0})'.format(quote, relative, suffix)
+
+    return CSS_URL.sub(replace, css)
+
+
+def _write(dist, path, content):
+    target = os.path.join(dist, *path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as asset:
+        asset.write(content)
+
+    if not path.endswith(COMPRESSIBLE):
+        return
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                       mtime=0) as gzip_file:
+        gzip_file.write(content)
+    compressed = buffer.getvalue()
+    if len(compressed) < len(content):
+        with open(target + '.gz', 'wb') as asset:
+            asset.write(compressed)
+    try:
+        import brotli
+    except ImportError:
+        return
+    compressed = brotli.compress(content)
+    if len(compressed) < len(content):
+        with open(target + '.br', 'wb') as asset:
+            asset.write(compressed)
+
+
+def vendor(static_folder, force=False):
+    """Download the third-party assets into the static folder."""
+    for path, url in sorted(VENDOR_ASSETS.items()):
+        target = os.path.join(static_folder, *path.split('/'))
+        if os.path.exists(target) and not force:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with urlopen(url) as response, open(target, 'wb') as asset:
+            shutil.copyfileobj(response, asset)
+        click.echo('Vendored {}'.format(path))
+
+
+def make_image_variants(static_folder):
+    """Write resized and WebP copies of the hero images if Pillow exists."""
+    try:
+        from PIL import Image
+    except ImportError:
+        click.echo('Pillow is not installed; skipping image variants.')
+        return
+    for source, variants in IMAGE_VARIANTS.items():
+        source_path = os.path.join(static_folder, *source.split('/'))
+        for width, output in variants:
+            output_path = os.path.join(static_folder, *output.split('/'))
+            if os.path.exists(output_path) and \
+                    os.path.getmtime(output_path) >= \
+                    os.path.getmtime(source_path):
+                continue
+            image = Image.open(source_path)
+            if width and image.width > width:
+                height = round(image.height * width / image.width)
+                image = image.resize((width, height), Image.LANCZOS)
+            if output.endswith('.webp'):
+                image.save(output_path, 'WEBP', quality=80, method=6)
+            else:
+                image.save(output_path, 'JPEG', quality=80, optimize=True,
+                           progressive=True)
+            click.echo('Wrote {}'.format(output))
+
+
+def build(static_folder):
+    """Copy every static file into dist/ under a content-hashed name.
+
+    Stylesheets are processed last so their url() references can be
+    rewritten to the hashed names. Returns the manifest of original to
+    hashed paths, which is also written to dist/manifest.json.
+    """
+    dist = os.path.join(static_folder, DIST)
+    if os.path.isdir(dist):
+        shutil.rmtree(dist)
+
+    sources = []
+    for root, dirs, files in os.walk(static_folder):
+        if root == static_folder and DIST in dirs:
+            dirs.remove(DIST)
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), static_folder)
+            sources.append(path.replace(os.sep, '/'))
+    sources.sort(key=lambda path: (path.endswith('.css'), path))
+
+    manifest = {}
+    for path in sources:
+        with open(os.path.join(static_folder, *path.split('/')), 'rb') as f:
+            content = f.read()
+        if path.endswith('.css'):
+            content = _rewrite_css(path, content.decode('utf-8'),
+                                   manifest).encode('utf-8')
+        manifest[path] = _fingerprint(path, content)
+        _write(dist, manifest[path], content)
+
+    with open(os.path.join(dist, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
+
+
+assets_cli = AppGroup('assets', help='Build the static assets.')
+
+
+@assets_cli.command('vendor')
+@click.option('--force', is_flag=True, help='Download files again.')
+def vendor_command(force):
+    """Download Bootstrap, jQuery and Font Awesome for offline use."""
+    vendor(current_app.static_folder, force)
+
+
+@assets_cli.command('build')
+@click.option('--vendor/--no-vendor', 'fetch', default=True,
+              help='Download missing third-party assets first.')
+def build_command(fetch):
+    """Vendor, fingerprint and precompress the static assets."""
+    if fetch:
+        vendor(current_app.static_folder)
+    make_image_variants(current_app.static_folder)
+    manifest = build(current_app.static_folder)
+    click.echo('Built {} assets.'.format(len(manifest)))
+
+
+class Assets(object):
+    """Serve built assets and resolve their hashed URLs in templates."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Load the manifest and register the assets route and CLI."""
+        dist = os.path.join(app.static_folder, DIST)
+        manifest = {}
+        if app.config.get('ASSETS_USE_MANIFEST', True):
+            try:
+                with open(os.path.join(dist, MANIFEST)) as manifest_file:
+                    manifest = json.load(manifest_file)
+            except (IOError, ValueError):
+                pass
+        app.extensions['assets'] = {'dist': dist, 'manifest': manifest,
+                                    'exists': {}}
+        app.add_url_rule('/assets/<path:filename>', 'assets', send_asset)
+        app.add_template_global(asset_url)
+        app.cli.add_command(assets_cli)
+
+
+def asset_url(filename, cdn=None):
+    """Return the URL of a static file, preferring its built copy.
+
+    Falls back to the plain static URL, or to cdn for vendored files that
+    have not been downloaded yet.
+    """
+    state = current_app.extensions['assets']
+    hashed = state['manifest'].get(filename)
+    if hashed is not None:
+        return url_for('assets', filename=hashed)
+    if cdn is not None:
+        exists = state['exists'].get(filename)
+        if exists is None:
+            exists = state['exists'][filename] = os.path.isfile(
+                os.path.join(current_app.static_folder,
+                             *filename.split('/')))
+        if not exists:
+            return cdn
+    return url_for('static', filename=filename)
+
+
+def send_asset(filename):
+    """Serve a built asset, precompressed when the client accepts it."""
+    path = safe_join(current_app.extensions['assets']['dist'], filename)
+    if not os.path.isfile(path):
+        abort(404)
+
+    encoding = None
+    for accepted, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[accepted] and \
+                os.path.isfile(path + suffix):
+            encoding, path = accepted, path + suffix
+            break
+
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                         conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
@@ -0,0 +1,166 @@
+"""Write-behind audit log of admin changes."""
+
+import atexit
+import json
+import queue
+import threading
+import weakref
+from datetime import datetime
+
+from flask import current_app, has_request_context
+from flask_login import current_user
+
+_writers = weakref.WeakSet()
+
+SNAPSHOT_EXCLUDE = ('password_hash', 'secret')
+
+
+def snapshot(obj):
+    """Return the column values of a model instance as a dict."""
+    if obj is None:
+        return None
+    return dict((column.key, getattr(obj, column.key))
+                for column in obj.__table__.columns
+                if column.key not in SNAPSHOT_EXCLUDE)
+
+
+class AuditWriter(object):
+    """Queue audit entries and write them in batches from a daemon thread."""
+
+    def __init__(self, app, batch_size, interval, path=None):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.path = path
+        self._queue = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        _writers.add(self)
+
+    def enqueue(self, entry):
+        """Queue an entry and make sure the flushing thread is running."""
+        self._queue.put(entry)
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='audit-writer')
+                    self._thread.daemon = True
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                return batch
+
+    def _write(self, batch):
+        with self._write_lock:
+            try:
+                if self.path:
+                    with open(self.path, 'a') as log_file:
+                        for entry in batch:
+                            log_file.write(json.dumps(entry, default=str))
+                            log_file.write('\n')
+                else:
+                    from .models import AuditEntry
+                    from . import db
+                    rows = [dict(entry,
+                                 before=json.dumps(entry['before'],
+                                                   default=str),
+                                 after=json.dumps(entry['after'],
+                                                  default=str))
+                            for entry in batch]
+                    with self.app.app_context():
+                        db.engine.execute(AuditEntry.__table__.insert(),
+                                          rows)
+            except Exception:
+                self.app.logger.exception(
+                    'Failed to write %d audit entries', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Write every queued entry before returning."""
+        batch = self._drain()
+        for start in range(0, len(batch), self.batch_size):
+            self._write(batch[start:start + self.batch_size])
+        # Wait for a batch the background thread may be writing.
+        self._queue.join()
+
+    def stop(self):
+        """Stop the flushing thread and write what is left."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.interval * 2)
+        self.flush()
+
+
+@atexit.register
+def _flush_on_exit():
+    for writer in list(_writers):
+        writer.stop()
+
+
+class AuditLog(object):
+    """Record who changed what in the admin views."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the audit writer for an app."""
+        app.extensions['audit_log'] = AuditWriter(
+            app,
+            batch_size=app.config.get('AUDIT_LOG_BATCH_SIZE', 100),
+            interval=app.config.get('AUDIT_LOG_FLUSH_INTERVAL', 1.0),
+            path=app.config.get('AUDIT_LOG_FILE'))
+
+    @property
+    def _writer(self):
+        return current_app.extensions['audit_log']
+
+    def record(self, action, target, before=None, after=None):
+        """Queue an audit entry for an action on a model instance.
+
+        Snapshots are taken by the caller so that recording the entry after
+        the commit does not need to reload the expired instance.
+        """
+        actor_id = actor_name = None
+        if has_request_context() and current_user.is_authenticated:
+            actor_id = current_user.id
+            actor_name = current_user.username
+        self._writer.enqueue({
+            'tenant_id': (after or before).get('tenant_id'),
+            'created_at': datetime.utcnow(),
+            'actor_id': actor_id,
+            'actor_name': actor_name,
+            'action': action,
+            'target_type': target.__tablename__,
+            'target_id': (after or before)['id'],
+            'before': before,
+            'after': after
+        })
+
+    def flush(self):
+        """Write all queued entries now."""
+        self._writer.flush()
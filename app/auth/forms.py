@@ -5,7 +5,7 @@ from flask_wtf import FlaskForm
 from wtforms import PasswordField, StringField, SubmitField, ValidationError
 from wtforms.validators import DataRequired, Email, EqualTo
 
-from ..models import Employee
+from ..queries import email_taken, username_taken
 
 
 class RegistrationForm(FlaskForm):
@@ -21,11 +21,11 @@ class RegistrationForm(FlaskForm):
     submit = SubmitField('Register')
 
     def validate_email(self, field):
-        if Employee.query.filter_by(email=field.data).first():
+        if email_taken(field.data):
             raise ValidationError('Email is already in use.')
 
     def validate_username(self, field):
-        if Employee.query.filter_by(username=field.data).first():
+        if username_taken(field.data):
             raise ValidationError('Username is already in use.')
 
 
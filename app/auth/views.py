@@ -1,13 +1,17 @@
 """Views for the Auth blueprint."""
 
+import time
 
-from flask import flash, redirect, render_template, url_for
+from flask import (current_app, flash, jsonify, redirect, render_template,
+                   request, session, url_for)
 from flask_login import login_required, login_user, logout_user
 
 from . import auth
 from .forms import LoginForm, RegistrationForm
-from .. import db
+from .. import access_tokens, db, login_limiter, session_store
 from ..models import Employee
+from ..queries import active_employee_by_email
+from ..tokens import bearer_token
 
 
 @auth.route('/register', methods=['GET', 'POST'])
@@ -35,10 +39,19 @@ def login():
     """Handle requests to the /login route."""
     form = LoginForm()
     if form.validate_on_submit():
-        employee = Employee.query.filter_by(email=form.email.data).first()
+        throttled = login_limiter.check(request.remote_addr, form.email.data)
+        if throttled:
+            flash('Too many login attempts. Please try again later.')
+            return (render_template('auth/login.html', form=form,
+                                    title='Login'), 429,
+                    {'Retry-After': str(login_limiter.retry_after(throttled))})
+
+        employee = active_employee_by_email(form.email.data)
         if employee is not None and employee.verify_password(
                 form.password.data):
             login_user(employee)
+            session['signed_in_at'] = time.time()
+            session_store.put(employee)
 
             if employee.is_admin:
                 return redirect(url_for('home.admin_dashboard'))
@@ -59,3 +72,35 @@ def logout():
     flash('You have been successfully logged out.')
 
     return redirect(url_for('auth.login'))
+
+
+@auth.route('/token', methods=['POST'])
+def issue_token():
+    """Exchange an email and password for a bearer token."""
+    data = request.get_json(silent=True) or request.form
+    if not isinstance(data, dict):
+        return jsonify(error='the body must be an object'), 400
+    email, password = data.get('email'), data.get('password')
+    if not email or not password or not isinstance(email, str) or \
+            not isinstance(password, str):
+        return jsonify(error='email and password are required'), 400
+    throttled = login_limiter.check(request.remote_addr, email)
+    if throttled:
+        return (jsonify(error='too many attempts'), 429,
+                {'Retry-After': str(login_limiter.retry_after(throttled))})
+
+    employee = active_employee_by_email(email)
+    if employee is None or not employee.verify_password(password):
+        return jsonify(error='invalid email or password'), 401
+    return jsonify(access_token=access_tokens.issue(employee),
+                   token_type='Bearer',
+                   expires_in=current_app.config['ACCESS_TOKEN_TTL'])
+
+
+@auth.route('/token/revoke', methods=['POST'])
+def revoke_token():
+    """Revoke the bearer token the request is made with."""
+    token = bearer_token(request)
+    if token is None or not access_tokens.revoke(token):
+        return jsonify(error='invalid token'), 401
+    return '', 204
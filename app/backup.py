@@ -0,0 +1,269 @@
+"""Compressed, streamed backups of the org data and bulk restores of them."""
+
+import gzip
+import json
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import Date, DateTime, func, literal, select
+
+from . import access_tokens, db
+from .hierarchy import hierarchy, rebuild_hierarchy
+from .history import END_OF_TIME, assignments
+from .models import ArchivedEmployee, Department, Employee, Role, Tenant
+
+FORMAT = 'dream-team-backup'
+# Version 2 added the assignment history, version 3 the archived employees.
+VERSION = 3
+
+# In restore order: every table after the tables it references.
+TABLES = [Tenant.__table__, Department.__table__, Role.__table__,
+          Employee.__table__, ArchivedEmployee.__table__, assignments]
+
+employees = Employee.__table__
+
+
+class BackupError(Exception):
+    """Raised when a backup cannot be read or restored."""
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _line(value):
+    return json.dumps(value, default=_encode, separators=(',', ':')) + '\n'
+
+
+def dump(path, chunk_size=None, level=6):
+    """Write the org data, with its assignment history, to a backup.
+
+    The backup is gzipped NDJSON: a header naming the format and version,
+    then for each table a line with its columns, its rows as JSON arrays in
+    that column order, and a line with the row count. Rows are read by id a
+    chunk at a time in one transaction, so memory stays flat and the tables
+    are consistent with each other. Returns the row count of each table.
+    """
+    chunk_size = chunk_size or current_app.config['BACKUP_CHUNK']
+    counts = {}
+    with gzip.open(path, 'wt', encoding='utf-8',
+                   compresslevel=level) as backup, \
+            db.engine.connect() as connection, connection.begin():
+        backup.write(_line({'format': FORMAT, 'version': VERSION,
+                            'created_at': datetime.utcnow(),
+                            'tables': [table.name for table in TABLES]}))
+        for table in TABLES:
+            columns = list(table.columns)
+            backup.write(_line({'table': table.name,
+                                'columns': [column.name
+                                            for column in columns]}))
+            count = last = 0
+            while True:
+                rows = connection.execute(select(columns).where(
+                    table.c.id > last).order_by(table.c.id).limit(
+                    chunk_size)).fetchall()
+                if not rows:
+                    break
+                backup.writelines(_line(list(row)) for row in rows)
+                count += len(rows)
+                last = rows[-1].id
+            backup.write(_line({'end': table.name, 'rows': count}))
+            counts[table.name] = count
+        backup.write(_line({'end': 'backup'}))
+    return counts
+
+
+def _records(path):
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as backup:
+            for line in backup:
+                yield json.loads(line)
+    except (OSError, EOFError, ValueError) as error:
+        raise BackupError('{} is not a readable backup: {}'.format(
+            path, error))
+
+
+def _parser(column):
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, Date):
+        return date.fromisoformat
+    return None
+
+
+@contextmanager
+def _foreign_keys_deferred(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        # Checked once at commit rather than per row. The pragma only lasts
+        # for the transaction, which pysqlite may not have begun yet.
+        if not connection.connection.in_transaction:
+            connection.execute('BEGIN')
+        connection.execute('PRAGMA defer_foreign_keys=ON')
+        yield
+    elif dialect == 'mysql':
+        # MySQL cannot defer them, so they are off for this connection.
+        connection.execute('SET FOREIGN_KEY_CHECKS=0')
+        try:
+            yield
+        finally:
+            connection.execute('SET FOREIGN_KEY_CHECKS=1')
+    else:
+        yield
+
+
+def _delete_org_data():
+    # Whoever is signed in as a replaced id may be someone else afterwards,
+    # in this worker and every other.
+    db.session.info.setdefault('revoked_principals', set()).update(
+        row[0] for row in db.session.execute(select([employees.c.id])))
+    access_tokens.revoke_everyone()
+    db.session.execute(hierarchy.delete())
+    for table in reversed(TABLES[1:]):
+        db.session.execute(table.delete())
+
+
+def restore(path, replace=False, chunk_size=None):
+    """Load a backup written by dump() into the database.
+
+    Rows are inserted a chunk at a time with one executemany each, with
+    foreign keys checked at commit on SQLite and not at all on MySQL, in a
+    single transaction, so a truncated or conflicting backup leaves the
+    database as it was. Tenants are added if their id is missing; the other
+    tables must be empty unless replace is set, in which case their rows,
+    including the archived employees and assignment history of every
+    tenant, and the reporting lines are deleted first, and every access
+    token and signed-in session is revoked. Reporting lines are then rebuilt, and a
+    version 1 backup, which has no assignment history, gets each active
+    employee's current assignment opened. No change events are recorded, so
+    webhooks are not sent the restored rows. Returns the row count of each
+    table.
+    """
+    chunk_size = chunk_size or current_app.config['BACKUP_CHUNK']
+    records = _records(path)
+    header = next(records, None)
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise BackupError('{} is not a Dream Team backup.'.format(path))
+    if header.get('version', 0) > VERSION:
+        raise BackupError('{} is a version {} backup; this release reads up '
+                          'to version {}.'.format(path, header['version'],
+                                                  VERSION))
+    tables = dict((table.name, table) for table in TABLES)
+
+    try:
+        if not replace:
+            for table in TABLES[1:]:
+                if db.session.execute(select([func.count()]).select_from(
+                        table)).scalar():
+                    raise BackupError('{} is not empty; restore with '
+                                      '--replace to overwrite it.'.format(
+                                          table.name))
+        existing_tenants = set(row[0] for row in db.session.execute(
+            select([Tenant.__table__.c.id])))
+
+        counts = {}
+        table = None
+        read = 0
+        columns = []
+        rows = []
+        finished = False
+
+        def insert():
+            if table.name == 'tenants':
+                rows[:] = [row for row in rows
+                           if row['id'] not in existing_tenants]
+            if rows:
+                db.session.execute(table.insert(), rows)
+            counts[table.name] += len(rows)
+            del rows[:]
+
+        with _foreign_keys_deferred(db.session.connection()):
+            if replace:
+                _delete_org_data()
+            for record in records:
+                if not isinstance(record, (list, dict)):
+                    raise BackupError('{} has a line that is neither a row '
+                                      'nor a table.'.format(path))
+                if isinstance(record, list):
+                    if table is None:
+                        raise BackupError('A row is outside of a table.')
+                    read += 1
+                    rows.append(dict(
+                        (name, value if parse is None or value is None
+                         else parse(value))
+                        for (name, parse), value in zip(columns, record)
+                        if name is not None))
+                    if len(rows) >= chunk_size:
+                        insert()
+                elif 'table' in record:
+                    if record['table'] not in tables:
+                        raise BackupError('Unknown table {}.'.format(
+                            record['table']))
+                    table = tables[record['table']]
+                    counts[table.name] = read = 0
+                    # Columns this schema no longer has are dropped.
+                    columns = [(name, _parser(table.c[name]))
+                               if name in table.c else (None, None)
+                               for name in record['columns']]
+                elif table is not None and record.get('end') == table.name:
+                    insert()
+                    if read != record['rows']:
+                        raise BackupError('{} has {} of its {} rows.'.format(
+                            table.name, read, record['rows']))
+                    table = None
+                elif record.get('end') == 'backup':
+                    finished = True
+            if not finished:
+                raise BackupError('{} is truncated.'.format(path))
+
+            rebuild_hierarchy()
+            if assignments.name not in counts:
+                db.session.execute(assignments.insert().from_select(
+                    ['tenant_id', 'employee_id', 'department_id', 'role_id',
+                     'manager_id', 'valid_from', 'valid_to'],
+                    select([employees.c.tenant_id, employees.c.id,
+                            employees.c.department_id, employees.c.role_id,
+                            employees.c.manager_id,
+                            literal(datetime.utcnow()),
+                            literal(END_OF_TIME)]).where(
+                        employees.c.is_active == db.true())))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counts
+
+
+backup_cli = AppGroup('backup', help='Back up and restore the org data.')
+
+
+@backup_cli.command('dump')
+@click.argument('path')
+@click.option('--level', type=click.IntRange(1, 9), default=6,
+              help='gzip compression level.')
+def dump_command(path, level):
+    """Write the org data, archive and history to PATH."""
+    counts = dump(path, level=level)
+    click.echo('Backed up {}.'.format(', '.join(
+        '{} {}'.format(count, name) for name, count in counts.items())))
+
+
+@backup_cli.command('restore')
+@click.argument('path')
+@click.option('--replace', is_flag=True,
+              help='Delete the departments, roles, employees, archived '
+              'employees and assignment history of every tenant first, and '
+              'sign everyone out.')
+def restore_command(path, replace):
+    """Load the backup at PATH into the database."""
+    try:
+        counts = restore(path, replace=replace)
+    except BackupError as error:
+        raise click.ClickException(str(error))
+    click.echo('Restored {}.'.format(', '.join(
+        '{} {}'.format(count, name) for name, count in counts.items())))
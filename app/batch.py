@@ -0,0 +1,319 @@
+"""Many department, role and employee changes applied in one transaction."""
+
+from collections import namedtuple
+
+from sqlalchemy.exc import IntegrityError
+
+from . import audit_log, db
+from .archive import deactivate
+from .audit import snapshot
+from .hierarchy import HierarchyError, set_manager
+from .models import Department, Employee, Role
+
+ENTITIES = {'departments': Department, 'roles': Role,
+            'employees': Employee}
+
+# The fields each operation accepts, by entity and operation.
+FIELDS = {
+    ('departments', 'create'): ('name', 'description'),
+    ('departments', 'update'): ('name', 'description'),
+    ('departments', 'delete'): (),
+    ('roles', 'create'): ('name', 'description'),
+    ('roles', 'update'): ('name', 'description'),
+    ('roles', 'delete'): (),
+    ('employees', 'create'): ('email', 'username', 'first_name',
+                              'last_name', 'password', 'department_id',
+                              'role_id', 'manager_id'),
+    ('employees', 'update'): ('email', 'username', 'first_name',
+                              'last_name'),
+    ('employees', 'assign'): ('department_id', 'role_id', 'manager_id'),
+    ('employees', 'delete'): (),
+}
+
+REQUIRED = {
+    ('departments', 'create'): ('name',),
+    ('roles', 'create'): ('name',),
+    ('employees', 'create'): ('email', 'username'),
+}
+
+# Fields naming a row of another entity, by id or by the ref of a create.
+REFERENCES = {'department_id': 'departments', 'role_id': 'roles',
+              'manager_id': 'employees'}
+
+# Columns unique within a tenant, checked before anything is written.
+UNIQUE = {'departments': ('name',), 'roles': ('name',),
+          'employees': ('email', 'username')}
+
+# The audit log action of each operation, as the admin pages name them.
+ACTIONS = {'create': 'add', 'update': 'edit', 'assign': 'assign',
+           'delete': 'delete'}
+
+STATUSES = {'create': 'created', 'update': 'updated', 'assign': 'assigned',
+            'delete': 'deleted'}
+
+Operation = namedtuple('Operation', 'index op entity target ref values')
+
+
+class BatchError(ValueError):
+    """Raised when an operation of a batch is invalid or cannot be applied.
+
+    index is the position of the operation in the batch, or None if the
+    batch as a whole failed.
+    """
+
+    def __init__(self, message, index=None):
+        super(BatchError, self).__init__(message)
+        self.index = index
+
+
+def _reference(value, entity, refs, index):
+    """Check a target or field value: an id, {'ref': name} or None."""
+    if value is None or (isinstance(value, int) and
+                         not isinstance(value, bool)):
+        return value
+    if isinstance(value, dict) and set(value) == {'ref'}:
+        if not isinstance(value['ref'], str) or \
+                refs.get(value['ref']) != entity:
+            raise BatchError('No earlier create of {} has ref {!r}.'.format(
+                entity, value['ref']), index)
+        return value
+    raise BatchError('{!r} is not an id or a ref.'.format(value), index)
+
+
+def parse(operations, max_operations):
+    """Check the shape of a list of operations and return Operations.
+
+    Nothing is read from the database, so a malformed batch is rejected
+    before any work is done.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise BatchError('operations must be a non-empty list.')
+    if len(operations) > max_operations:
+        raise BatchError('A batch holds at most {} operations.'.format(
+            max_operations))
+    refs = {}
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            raise BatchError('An operation must be an object.', index)
+        op, entity = operation.get('op'), operation.get('entity')
+        if not isinstance(op, str) or not isinstance(entity, str) or \
+                (entity, op) not in FIELDS:
+            raise BatchError('{} cannot {}.'.format(entity, op), index)
+        values = operation.get('values') or {}
+        if not isinstance(values, dict):
+            raise BatchError('values must be an object.', index)
+        unknown = set(values) - set(FIELDS[entity, op])
+        if unknown:
+            raise BatchError('{} cannot set {}.'.format(
+                entity, ', '.join(sorted(unknown))), index)
+        missing = [field for field in REQUIRED.get((entity, op), ())
+                   if not values.get(field)]
+        if missing:
+            raise BatchError('{} is required.'.format(', '.join(missing)),
+                             index)
+        # What a create requires, an update cannot clear.
+        cleared = [field for field in REQUIRED.get((entity, 'create'), ())
+                   if op == 'update' and field in values and
+                   not values[field]]
+        if cleared:
+            raise BatchError('{} cannot be empty.'.format(
+                ', '.join(cleared)), index)
+        for field, value in values.items():
+            if field in REFERENCES:
+                _reference(value, REFERENCES[field], refs, index)
+            elif value is not None and not isinstance(value, str):
+                raise BatchError('{} must be a string.'.format(field), index)
+
+        target = ref = None
+        if op == 'create':
+            ref = operation.get('ref')
+            if ref is not None:
+                if not isinstance(ref, str) or ref in refs:
+                    raise BatchError('ref must be a new string.', index)
+                refs[ref] = entity
+        else:
+            target = operation.get('id')
+            if target is None:
+                raise BatchError('id is required.', index)
+            _reference(target, entity, refs, index)
+        parsed.append(Operation(index, op, entity, target, ref, values))
+    return parsed
+
+
+class Batch(object):
+    """Apply parsed operations in order within the session's transaction.
+
+    Every row the batch names by id is read with one query per entity, and
+    changes are flushed together at the end, so the UPDATEs of a batch go
+    out as a few executemany statements. Only a manager change flushes
+    early, since the reporting lines are rewritten with SQL.
+    """
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.rows = dict((entity, {}) for entity in ENTITIES)
+        self.created = {}
+        self.deleted = set()
+
+    def load(self):
+        """Read the rows the operations name by id."""
+        ids = dict((entity, set()) for entity in ENTITIES)
+        for operation in self.operations:
+            if isinstance(operation.target, int):
+                ids[operation.entity].add(operation.target)
+            for field, value in operation.values.items():
+                if field in REFERENCES and isinstance(value, int):
+                    ids[REFERENCES[field]].add(value)
+        for entity, model in ENTITIES.items():
+            if ids[entity]:
+                self.rows[entity] = dict(
+                    (row.id, row) for row in model.query.filter(
+                        model.id.in_(sorted(ids[entity]))))
+
+    def check_unique(self):
+        """Reject values of unique fields that are already taken.
+
+        A value may be reused if the row holding it is itself updated or
+        deleted by the batch; the database has the last word on those.
+        """
+        for entity, fields in UNIQUE.items():
+            model = ENTITIES[entity]
+            changed = set(operation.target for operation in self.operations
+                          if operation.entity == entity and
+                          operation.op in ('update', 'delete') and
+                          isinstance(operation.target, int))
+            for field in fields:
+                claimed = {}
+                for operation in self.operations:
+                    value = operation.values.get(field)
+                    if operation.entity != entity or not value:
+                        continue
+                    if value.lower() in claimed:
+                        raise BatchError('{} {} is used twice.'.format(
+                            field, value), operation.index)
+                    claimed[value.lower()] = operation
+                if not claimed:
+                    continue
+                values = [operation.values[field]
+                          for operation in claimed.values()]
+                for row in model.query.filter(
+                        getattr(model, field).in_(values)):
+                    operation = claimed.get(getattr(row, field).lower())
+                    if operation is not None and row.id not in changed:
+                        raise BatchError('{} {} already exists.'.format(
+                            field, getattr(row, field)), operation.index)
+
+    def resolve(self, entity, value, index):
+        """Return the row an id or ref names, or None for None."""
+        if value is None:
+            return None
+        row = (self.created.get(value['ref']) if isinstance(value, dict)
+               else self.rows[entity].get(value))
+        if row is None:
+            raise BatchError('{} {} does not exist.'.format(entity, value),
+                             index)
+        if row in self.deleted:
+            raise BatchError('{} {} was deleted earlier in the batch.'.format(
+                entity, value), index)
+        return row
+
+    def assign(self, employee, values, index):
+        """Set the department, role and manager present in values."""
+        if 'department_id' in values:
+            employee.department = self.resolve(
+                'departments', values['department_id'], index)
+        if 'role_id' in values:
+            employee.role = self.resolve('roles', values['role_id'], index)
+        if 'manager_id' in values:
+            manager = self.resolve('employees', values['manager_id'], index)
+            if manager is not None and manager.is_active is False:
+                raise BatchError('employees {} is inactive.'.format(
+                    values['manager_id']), index)
+            if employee.id is None or \
+                    manager is not None and manager.id is None:
+                db.session.flush()
+            try:
+                set_manager(employee, manager)
+            except HierarchyError as error:
+                raise BatchError(str(error), index)
+
+    def apply(self, operation):
+        """Apply one operation; returns (row, snapshot before)."""
+        index, op, entity = operation.index, operation.op, operation.entity
+        values = operation.values
+        if op == 'create':
+            fields = dict((field, value) for field, value in values.items()
+                          if field not in REFERENCES)
+            row = ENTITIES[entity](**fields)
+            db.session.add(row)
+            if operation.ref is not None:
+                self.created[operation.ref] = row
+            if entity == 'employees':
+                self.assign(row, values, index)
+            return row, None
+
+        row = self.resolve(entity, operation.target, index)
+        before = snapshot(row) if row.id is not None else None
+        if entity == 'employees' and row.is_admin and op != 'update':
+            raise BatchError('Admins cannot be assigned or deactivated.',
+                             index)
+        if op == 'update':
+            for field, value in values.items():
+                setattr(row, field, value)
+        elif op == 'assign':
+            self.assign(row, values, index)
+        elif entity == 'employees':
+            if row.is_active is False:
+                raise BatchError('employees {} is already inactive.'.format(
+                    operation.target), index)
+            # As on the admin pages, employees are deactivated, not deleted.
+            deactivate(row)
+        else:
+            db.session.delete(row)
+            self.deleted.add(row)
+        return row, before
+
+    def run(self):
+        """Apply every operation, commit, and return the results."""
+        try:
+            self.load()
+            self.check_unique()
+            applied = [(operation,) + self.apply(operation)
+                       for operation in self.operations]
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            raise BatchError('The batch conflicts with existing rows.')
+        except Exception:
+            db.session.rollback()
+            raise
+        entries = []
+        results = []
+        for operation, row, before in applied:
+            deactivated = operation.entity == 'employees' and \
+                operation.op == 'delete'
+            if deactivated:
+                entries.append(('deactivate', row, before, snapshot(row)))
+            else:
+                entries.append((ACTIONS[operation.op], row, before,
+                                None if operation.op == 'delete'
+                                else snapshot(row)))
+            result = {'status': 'deactivated' if deactivated
+                      else STATUSES[operation.op], 'id': row.id}
+            if operation.ref is not None:
+                result['ref'] = operation.ref
+            results.append(result)
+        db.session.commit()
+        for action, row, before, after in entries:
+            audit_log.record(action, row, before=before, after=after)
+        return results
+
+
+def run(operations, max_operations):
+    """Apply a batch of operations in one transaction.
+
+    Returns one {'status', 'id'} result per operation, in order. Raises
+    BatchError, with nothing written, if any operation fails.
+    """
+    return Batch(parse(operations, max_operations)).run()
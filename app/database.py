@@ -0,0 +1,41 @@
+"""The SQLAlchemy extension, with SQLite tuned for single-node deployments."""
+
+import sqlite3
+
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy
+from sqlalchemy.pool import QueuePool
+
+
+def sqlite_connector(path, pragmas, timeout):
+    """Return a function opening tuned connections to a SQLite file."""
+    statements = ['PRAGMA {}={}'.format(name, value)
+                  for name, value in pragmas]
+
+    def connect():
+        # timeout is the busy timeout: a writer waits that long for the
+        # lock held by another process's transaction before failing.
+        connection = sqlite3.connect(path, timeout=timeout,
+                                     check_same_thread=False)
+        for statement in statements:
+            connection.execute(statement)
+        return connection
+    return connect
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """Flask-SQLAlchemy with pooled, tuned connections to SQLite files.
+
+    Flask-SQLAlchemy opens a new connection for every checkout from a
+    SQLite file, which throws away its page cache each time. Here they are
+    pooled like MySQL connections and set up with SQLITE_PRAGMAS. The pool
+    only hands a connection to one thread at a time, so it may be shared.
+    """
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername == 'sqlite' and \
+                info.database not in (None, '', ':memory:'):
+            options['poolclass'] = QueuePool
+            options['creator'] = sqlite_connector(
+                info.database, app.config['SQLITE_PRAGMAS'],
+                app.config['SQLITE_BUSY_TIMEOUT'])
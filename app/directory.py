@@ -0,0 +1,396 @@
+"""Incremental sync of employees from an external identity directory."""
+
+import csv
+import json
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, bindparam, select
+
+from . import db
+from .archive import deactivate
+from .audit import SNAPSHOT_EXCLUDE
+from .hierarchy import hierarchy
+from .history import END_OF_TIME, assignments
+from .models import ChangeEvent, Employee, Tenant
+from .tenancy import current_tenant_id, tenant_scope
+
+employees = Employee.__table__
+change_events = ChangeEvent.__table__
+
+Identity = namedtuple('Identity', 'email username first_name last_name')
+
+# Longest value the identity columns of employees hold.
+MAX_LENGTH = 60
+
+
+class DirectorySyncError(Exception):
+    """Raised when a sync would deactivate too many employees."""
+
+
+class CsvSource(object):
+    """Identities read from a CSV export with a header row."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, newline='') as export:
+            for row in csv.DictReader(export):
+                yield Identity(*(row.get(field) for field in Identity._fields))
+
+
+class SqliteSource(object):
+    """Identities read from a table of a SQLite database."""
+
+    def __init__(self, path, table='identities'):
+        self.path = path
+        self.table = table
+
+    def __iter__(self):
+        with closing(sqlite3.connect(self.path)) as connection:
+            rows = connection.execute('SELECT {} FROM "{}"'.format(
+                ', '.join(Identity._fields), self.table.replace('"', '""')))
+            for row in rows:
+                yield Identity(*row)
+
+
+class LdapSource(object):
+    """Identities read with a paged search of an LDAP directory.
+
+    Needs the ldap3 package. attributes maps each Identity field to the
+    LDAP attribute it is read from.
+    """
+
+    def __init__(self, url, base_dn, search_filter, attributes,
+                 bind_dn=None, password=None, page_size=1000):
+        self.url = url
+        self.base_dn = base_dn
+        self.search_filter = search_filter
+        self.attributes = attributes
+        self.bind_dn = bind_dn
+        self.password = password
+        self.page_size = page_size
+
+    def __iter__(self):
+        import ldap3
+        connection = ldap3.Connection(
+            ldap3.Server(self.url), user=self.bind_dn,
+            password=self.password, auto_bind=True, read_only=True)
+        try:
+            entries = connection.extend.standard.paged_search(
+                self.base_dn, self.search_filter,
+                attributes=[self.attributes[field]
+                            for field in Identity._fields],
+                paged_size=self.page_size, generator=True)
+            for entry in entries:
+                if entry.get('type') != 'searchResEntry':
+                    continue
+                values = entry['attributes']
+                yield Identity(*(_first(values.get(self.attributes[field]))
+                                 for field in Identity._fields))
+        finally:
+            connection.unbind()
+
+
+def _first(value):
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+def open_source(url=None):
+    """Return the identity source for a URL, DIRECTORY_SOURCE by default."""
+    config = current_app.config
+    url = url or config['DIRECTORY_SOURCE']
+    if not url:
+        raise DirectorySyncError('No directory source is configured; set '
+                                 'DIRECTORY_SOURCE.')
+    if url.startswith(('ldap://', 'ldaps://')):
+        return LdapSource(url, config['DIRECTORY_LDAP_BASE_DN'],
+                          config['DIRECTORY_LDAP_FILTER'],
+                          config['DIRECTORY_LDAP_ATTRIBUTES'],
+                          bind_dn=config['DIRECTORY_LDAP_BIND_DN'],
+                          password=config['DIRECTORY_LDAP_PASSWORD'])
+    if url.startswith('sqlite:///'):
+        return SqliteSource(url[len('sqlite:///'):])
+    return CsvSource(url)
+
+
+Existing = namedtuple('Existing', 'key id digest is_active managed')
+
+
+def _clean(identity):
+    values = [(value or '').strip() or None for value in identity]
+    if values[0] is None or values[1] is None or any(
+            len(value) > MAX_LENGTH for value in values if value):
+        return None
+    return Identity(*values)
+
+
+def _identities(source):
+    """Return the valid identities as (key, identity) sorted by key."""
+    identities = []
+    skipped = 0
+    for identity in source:
+        cleaned = _clean(identity)
+        if cleaned is None:
+            current_app.logger.warning('Skipping invalid identity %r',
+                                       identity)
+            skipped += 1
+        else:
+            identities.append((cleaned.email.lower(), cleaned))
+    identities.sort(key=lambda item: item[0])
+
+    unique = []
+    for key, identity in identities:
+        if unique and unique[-1][0] == key:
+            current_app.logger.warning('Skipping duplicate identity %r',
+                                       identity)
+            skipped += 1
+        else:
+            unique.append((key, identity))
+    return unique, skipped
+
+
+def _existing(chunk_size):
+    """Return an Existing tuple per employee with an email, sorted by key.
+
+    Employees are read by id in chunks and only a digest of their identity
+    fields is kept, so memory stays small with hundreds of thousands.
+    """
+    columns = [employees.c.id, employees.c.is_active,
+               employees.c.directory_managed] + [
+        employees.c[field] for field in Identity._fields]
+    existing = []
+    last = 0
+    tenant_id = current_tenant_id()
+    while True:
+        rows = db.session.execute(select(columns).where(and_(
+            employees.c.tenant_id == tenant_id,
+            employees.c.id > last)).order_by(employees.c.id).limit(
+            chunk_size)).fetchall()
+        if not rows:
+            break
+        last = rows[-1].id
+        existing.extend(
+            Existing(row.email.lower(), row.id,
+                     hash(Identity(*(row[field]
+                                     for field in Identity._fields))),
+                     bool(row.is_active), bool(row.directory_managed))
+            for row in rows if row.email)
+    existing.sort(key=lambda row: row.key)
+    return existing
+
+
+def diff(identities, existing):
+    """Merge identities and employees, both sorted by key, into changes.
+
+    Returns (inserts, updates, deactivations): identities with no employee,
+    (employee id, identity) pairs whose fields differ or that are not yet
+    managed by the directory, and the ids of active directory-managed
+    employees that are no longer in the directory.
+    """
+    inserts, updates, deactivations = [], [], []
+    i = j = 0
+    while i < len(identities) and j < len(existing):
+        key, identity = identities[i]
+        employee = existing[j]
+        if key < employee.key:
+            inserts.append(identity)
+            i += 1
+        elif key > employee.key:
+            if employee.managed and employee.is_active:
+                deactivations.append(employee.id)
+            j += 1
+        else:
+            if hash(identity) != employee.digest or not employee.managed:
+                updates.append((employee.id, identity))
+            i += 1
+            j += 1
+    inserts.extend(identity for key, identity in identities[i:])
+    deactivations.extend(employee.id for employee in existing[j:]
+                         if employee.managed and employee.is_active)
+    return inserts, updates, deactivations
+
+
+def _without_taken_usernames(changes):
+    """Drop (employee id, identity) changes whose username is taken.
+
+    Inserts have None for the employee id.
+    """
+    owners = dict(
+        (username.lower(), employee_id)
+        for employee_id, username in db.session.execute(
+            select([employees.c.id, employees.c.username]).where(and_(
+                employees.c.tenant_id == current_tenant_id(),
+                employees.c.username.in_([identity.username for _, identity
+                                          in changes])))))
+    kept = []
+    for employee_id, identity in changes:
+        username = identity.username.lower()
+        if owners.get(username, employee_id) != employee_id or (
+                employee_id is None and username in owners):
+            current_app.logger.warning('Skipping %s: username %s is taken',
+                                       identity.email, identity.username)
+        else:
+            owners[username] = employee_id
+            kept.append((employee_id, identity))
+    return kept
+
+
+def _record_changes(ids, operation, now):
+    # Bulk statements skip the outbox's mapper events, so the change
+    # events are written here, in the same transaction.
+    rows = db.session.execute(employees.select().where(
+        employees.c.id.in_(ids))).fetchall()
+    db.session.execute(change_events.insert(), [{
+        'tenant_id': row.tenant_id,
+        'created_at': now,
+        'entity': employees.name,
+        'entity_id': row.id,
+        'operation': operation,
+        'payload': json.dumps(dict((key, row[key]) for key in row.keys()
+                                   if key not in SNAPSHOT_EXCLUDE),
+                              default=str)
+    } for row in rows])
+
+
+def _insert(identities, now):
+    tenant_id = current_tenant_id()
+    db.session.execute(employees.insert(), [
+        dict(identity._asdict(), tenant_id=tenant_id, is_admin=False,
+             is_active=True, directory_managed=True)
+        for identity in identities])
+    ids = [row[0] for row in db.session.execute(
+        select([employees.c.id]).where(and_(
+            employees.c.tenant_id == tenant_id,
+            employees.c.email.in_([identity.email
+                                   for identity in identities]))))]
+    # What the hierarchy and history events do for ORM inserts.
+    db.session.execute(hierarchy.insert(), [
+        dict(ancestor_id=employee_id, descendant_id=employee_id, depth=0)
+        for employee_id in ids])
+    db.session.execute(assignments.insert(), [
+        dict(tenant_id=tenant_id, employee_id=employee_id,
+             department_id=None, role_id=None, manager_id=None,
+             valid_from=now, valid_to=END_OF_TIME)
+        for employee_id in ids])
+    _record_changes(ids, 'insert', now)
+
+
+_update = employees.update().where(
+    employees.c.id == bindparam('_id')).values(dict(
+        [(field, bindparam('_' + field)) for field in Identity._fields] +
+        [('directory_managed', True)]))
+
+
+def _update_identities(changes, now):
+    db.session.execute(_update, [
+        dict([('_id', employee_id)] + [('_' + field, value) for field, value
+                                       in identity._asdict().items()])
+        for employee_id, identity in changes])
+    ids = [employee_id for employee_id, identity in changes]
+    _record_changes(ids, 'update', now)
+    # Cached principals hold the old names; revoked once committed.
+    db.session.info.setdefault('revoked_principals', set()).update(ids)
+
+
+def sync(source, chunk_size=None, dry_run=False, force=False):
+    """Make the employees match the identities of a directory source.
+
+    Both sides are sorted by lower-cased email and merged, so only new,
+    changed and departed identities are written: new ones are inserted and
+    changed ones updated with one statement per chunk, and employees the
+    directory no longer lists are deactivated. Employees registered in the
+    app are left alone unless the directory lists their email, after which
+    it manages them. Only the scoped tenant's employees are compared.
+    Returns a dict of counts.
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config['DIRECTORY_SYNC_CHUNK']
+    identities, skipped = _identities(source)
+    existing = _existing(chunk_size)
+    db.session.commit()
+    inserts, updates, deactivations = diff(identities, existing)
+
+    managed = sum(1 for employee in existing
+                  if employee.managed and employee.is_active)
+    if not force and managed and len(deactivations) > \
+            config['DIRECTORY_MAX_DEACTIVATIONS'] * managed:
+        raise DirectorySyncError(
+            '{} of {} directory employees would be deactivated; check the '
+            'source or force the sync.'.format(len(deactivations), managed))
+
+    counts = {'inserted': len(inserts), 'updated': len(updates),
+              'deactivated': len(deactivations), 'skipped': skipped,
+              'unchanged': len(identities) - len(inserts) - len(updates)}
+    if dry_run:
+        return counts
+
+    now = datetime.utcnow()
+    counts['updated'] = counts['inserted'] = 0
+    for start in range(0, len(updates), chunk_size):
+        chunk = _without_taken_usernames(updates[start:start + chunk_size])
+        if chunk:
+            _update_identities(chunk, now)
+        db.session.commit()
+        counts['updated'] += len(chunk)
+    for start in range(0, len(inserts), chunk_size):
+        chunk = [identity for employee_id, identity
+                 in _without_taken_usernames([
+                     (None, identity)
+                     for identity in inserts[start:start + chunk_size]])]
+        if chunk:
+            _insert(chunk, now)
+        db.session.commit()
+        counts['inserted'] += len(chunk)
+    counts['skipped'] += (len(updates) - counts['updated'] +
+                          len(inserts) - counts['inserted'])
+
+    for start in range(0, len(deactivations), chunk_size):
+        # Through the ORM, so reports move to the departing employee's
+        # manager and the history and outbox record the change.
+        for employee in Employee.query.filter(Employee.id.in_(
+                deactivations[start:start + chunk_size])):
+            deactivate(employee)
+        db.session.commit()
+    return counts
+
+
+directory_cli = AppGroup('directory',
+                         help='Sync employees from an identity directory.')
+
+
+@directory_cli.command('sync')
+@click.option('--source', default=None,
+              help='ldap[s]://host, sqlite:///<path> or a CSV path '
+                   '(DIRECTORY_SOURCE).')
+@click.option('--dry-run', is_flag=True,
+              help='Count the changes without making them.')
+@click.option('--force', is_flag=True,
+              help='Deactivate however many employees have left.')
+@click.option('--tenant', default=None,
+              help='Slug of the tenant to sync (the default tenant).')
+def sync_command(source, dry_run, force, tenant):
+    """Insert, update and deactivate employees to match the directory."""
+    tenant_id = current_tenant_id()
+    if tenant is not None:
+        tenant_id = db.session.query(Tenant.id).filter(
+            Tenant.slug == tenant.lower()).scalar()
+        if tenant_id is None:
+            raise click.ClickException('No tenant {}.'.format(tenant))
+    try:
+        with tenant_scope(tenant_id):
+            counts = sync(open_source(source), dry_run=dry_run,
+                          force=force)
+    except DirectorySyncError as error:
+        raise click.ClickException(str(error))
+    click.echo('{}{inserted} inserted, {updated} updated, {deactivated} '
+               'deactivated, {unchanged} unchanged, {skipped} skipped.'
+               .format('Dry run: ' if dry_run else '', **counts))
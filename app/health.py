@@ -0,0 +1,105 @@
+"""Liveness and readiness checks, and warming workers up before traffic."""
+
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from flask import current_app, jsonify
+from sqlalchemy import select
+
+
+class Health(object):
+    """Serve /healthz and /readyz to load balancers.
+
+    /healthz only shows that the worker is serving requests. /readyz also
+    pings the database through the connection pool and reports 503 if it
+    does not answer within HEALTH_DB_TIMEOUT seconds. A ping that hangs
+    past the timeout is shared by the probes that follow, so a stuck
+    database cannot pile up threads.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the health endpoints."""
+        app.extensions['health'] = {'lock': threading.Lock(), 'ping': None}
+        app.add_url_rule('/healthz', 'healthz', self.live)
+        app.add_url_rule('/readyz', 'readyz', self.ready)
+
+    def live(self):
+        """Report that the worker is up."""
+        return jsonify(status='ok')
+
+    def ready(self):
+        """Report whether the worker can reach the database."""
+        app = current_app._get_current_object()
+        try:
+            self.ping(app).result(app.config['HEALTH_DB_TIMEOUT'])
+        except TimeoutError:
+            return jsonify(status='unavailable',
+                           error='database ping timed out'), 503
+        except Exception as exc:
+            return jsonify(status='unavailable',
+                           error=type(exc).__name__), 503
+        return jsonify(status='ok')
+
+    def ping(self, app):
+        """Return a future of the pending database ping, starting one."""
+        state = app.extensions['health']
+        with state['lock']:
+            if state['ping'] is None or state['ping'].done():
+                state['ping'] = Future()
+                threading.Thread(target=self._ping,
+                                 args=(app, state['ping']),
+                                 name='health-ping', daemon=True).start()
+            return state['ping']
+
+    def _ping(self, app, future):
+        from . import db
+        try:
+            with app.app_context():
+                with db.engine.connect() as connection:
+                    connection.scalar(select([1]))
+        except Exception as exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(True)
+
+    def warm_up(self, app):
+        """Serve WARMUP_PATHS once and fill the connection pool.
+
+        The first requests to a new worker then find their routes, templates
+        and database connections ready. Failures are logged rather than
+        raised, so a worker still starts while the database is down.
+        """
+        domain = app.config.get('TENANT_DOMAIN')
+        client = app.test_client()
+        for path in app.config['WARMUP_PATHS']:
+            try:
+                response = client.get(path, base_url='http://{}/'.format(
+                    domain or 'localhost'))
+                if response.status_code >= 500:
+                    app.logger.warning('Warming up %s returned %d', path,
+                                       response.status_code)
+            except Exception:
+                app.logger.exception('Warming up %s failed', path)
+        return self.fill_pool(app)
+
+    def fill_pool(self, app):
+        """Open every connection of the pool and return how many it holds."""
+        from . import db
+        try:
+            with app.app_context():
+                size = getattr(db.engine.pool, 'size', lambda: 0)()
+                connections = []
+                try:
+                    for _ in range(size):
+                        connections.append(db.engine.connect())
+                finally:
+                    for connection in connections:
+                        connection.close()
+        except Exception:
+            app.logger.exception('Filling the connection pool failed')
+            return 0
+        return size
@@ -0,0 +1,120 @@
+"""Reporting lines kept in a closure table for single-query org charts."""
+
+from sqlalchemy import and_, event, func, literal, select
+
+from . import db
+from .models import Employee, EmployeeHierarchy
+
+hierarchy = EmployeeHierarchy.__table__
+
+# Rows per statement when rewriting the links of a moved subtree.
+CHUNK_SIZE = 500
+
+
+@event.listens_for(Employee, 'after_insert')
+def _add_self_link(mapper, connection, target):
+    connection.execute(hierarchy.insert(), ancestor_id=target.id,
+                       descendant_id=target.id, depth=0)
+
+
+class HierarchyError(ValueError):
+    """Raised when a reporting line change would create a cycle."""
+
+
+def _linked_ids(column, employee_id):
+    other = (hierarchy.c.ancestor_id if column is hierarchy.c.descendant_id
+             else hierarchy.c.descendant_id)
+    rows = db.session.execute(select([column]).where(and_(
+        other == employee_id, hierarchy.c.depth > 0)))
+    return [row[0] for row in rows]
+
+
+def set_manager(employee, manager):
+    """Make manager the direct manager of employee, or clear it if None.
+
+    The employee's whole subtree moves with them: links from their old
+    managers are deleted and links from every manager above the new one are
+    inserted with one INSERT ... SELECT.
+    """
+    manager_id = manager.id if manager is not None else None
+    if manager_id == employee.manager_id:
+        return
+
+    if manager_id is not None and db.session.query(
+            hierarchy.c.depth).filter(
+            hierarchy.c.ancestor_id == employee.id,
+            hierarchy.c.descendant_id == manager_id).first() is not None:
+        raise HierarchyError('An employee cannot report to themselves '
+                             'or to someone who reports to them.')
+
+    old_managers = _linked_ids(hierarchy.c.ancestor_id, employee.id)
+    if old_managers:
+        subtree = [employee.id] + _linked_ids(hierarchy.c.descendant_id,
+                                              employee.id)
+        for start in range(0, len(subtree), CHUNK_SIZE):
+            db.session.execute(hierarchy.delete().where(and_(
+                hierarchy.c.ancestor_id.in_(old_managers),
+                hierarchy.c.descendant_id.in_(
+                    subtree[start:start + CHUNK_SIZE]))))
+
+    if manager_id is not None:
+        above = hierarchy.alias('above')
+        below = hierarchy.alias('below')
+        db.session.execute(hierarchy.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select([above.c.ancestor_id, below.c.descendant_id,
+                    above.c.depth + below.c.depth + 1])
+            .where(and_(above.c.descendant_id == manager_id,
+                        below.c.ancestor_id == employee.id))))
+
+    employee.manager = manager
+
+
+def rebuild_hierarchy():
+    """Recompute the closure table from employees.manager_id.
+
+    Runs one INSERT ... SELECT per level of the org chart.
+    """
+    employees = Employee.__table__
+    db.session.execute(hierarchy.delete())
+    db.session.execute(hierarchy.insert().from_select(
+        ['ancestor_id', 'descendant_id', 'depth'],
+        select([employees.c.id.label('ancestor_id'),
+                employees.c.id.label('descendant_id'), literal(0)])))
+    depth = 0
+    while True:
+        result = db.session.execute(hierarchy.insert().from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select([hierarchy.c.ancestor_id, employees.c.id, depth + 1])
+            .select_from(hierarchy.join(
+                employees,
+                employees.c.manager_id == hierarchy.c.descendant_id))
+            .where(hierarchy.c.depth == depth)))
+        if not result.rowcount:
+            break
+        depth += 1
+
+
+def subordinates(employee, max_depth=None):
+    """Return (employee, depth) pairs for everyone under an employee."""
+    query = db.session.query(Employee, hierarchy.c.depth).join(
+        hierarchy, hierarchy.c.descendant_id == Employee.id).filter(
+        hierarchy.c.ancestor_id == employee.id, hierarchy.c.depth > 0)
+    if max_depth is not None:
+        query = query.filter(hierarchy.c.depth <= max_depth)
+    return query.order_by(hierarchy.c.depth, Employee.id).all()
+
+
+def reporting_chain(employee):
+    """Return the employee's managers, nearest first."""
+    return Employee.query.join(
+        hierarchy, hierarchy.c.ancestor_id == Employee.id).filter(
+        hierarchy.c.descendant_id == employee.id,
+        hierarchy.c.depth > 0).order_by(hierarchy.c.depth).all()
+
+
+def headcount_under(employee):
+    """Return the number of people under an employee at any depth."""
+    return db.session.query(func.count(hierarchy.c.descendant_id)).filter(
+        hierarchy.c.ancestor_id == employee.id,
+        hierarchy.c.depth > 0).scalar()
@@ -0,0 +1,164 @@
+"""Effective-dated assignment history for as-of and range queries."""
+
+from datetime import datetime
+
+from sqlalchemy import and_, event, func, inspect
+from sqlalchemy.orm import object_session
+
+from . import db
+from .models import ArchivedEmployee, Assignment, Employee
+
+assignments = Assignment.__table__
+
+# valid_to of current assignments, so open ranges need no NULL checks.
+END_OF_TIME = datetime(9999, 12, 31)
+
+TRACKED_COLUMNS = ('department_id', 'role_id', 'manager_id', 'is_active')
+
+# Employee ids per statement when closing assignments.
+CHUNK_SIZE = 500
+
+
+def _queue(target, close):
+    session = object_session(target)
+    if session is None:
+        return
+    row = None
+    if target.is_active is not False:
+        row = {'tenant_id': target.tenant_id,
+               'employee_id': target.id,
+               'department_id': target.department_id,
+               'role_id': target.role_id,
+               'manager_id': target.manager_id}
+    changes = session.info.setdefault('assignment_changes', {})
+    previous = changes.get(target.id, (False, None))
+    changes[target.id] = (close or previous[0], row)
+
+
+@event.listens_for(Employee, 'after_insert')
+def _open_assignment(mapper, connection, target):
+    _queue(target, close=False)
+
+
+@event.listens_for(Employee, 'after_update')
+def _change_assignment(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes()
+           for key in TRACKED_COLUMNS):
+        _queue(target, close=True)
+
+
+@event.listens_for(Employee, 'after_delete')
+def _close_assignment(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('assignment_changes', {})[target.id] = (
+            True, None)
+
+
+@event.listens_for(db.session, 'after_flush')
+def write_assignments(session, flush_context):
+    """Close the changed employees' assignments and open their new ones.
+
+    Every change in a transaction is stamped with the time of its first
+    flush, so a row opened and replaced within one transaction is deleted
+    rather than left behind as an empty range.
+    """
+    changes = session.info.pop('assignment_changes', None)
+    if not changes:
+        return
+    now = session.info.setdefault('assignment_time', datetime.utcnow())
+
+    closing = sorted(employee_id for employee_id, (close, row)
+                     in changes.items() if close)
+    for start in range(0, len(closing), CHUNK_SIZE):
+        chunk = closing[start:start + CHUNK_SIZE]
+        current = and_(assignments.c.employee_id.in_(chunk),
+                       assignments.c.valid_to == END_OF_TIME)
+        session.execute(assignments.delete().where(and_(
+            current, assignments.c.valid_from == now)))
+        session.execute(assignments.update().where(current).values(
+            valid_to=now))
+
+    rows = [dict(row, valid_from=now, valid_to=END_OF_TIME)
+            for close, row in changes.values() if row is not None]
+    if rows:
+        session.execute(assignments.insert(), rows)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _end_assignment_transaction(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('assignment_changes', None)
+        session.info.pop('assignment_time', None)
+
+
+def in_effect(when):
+    """Return a filter for the assignments in effect at a moment."""
+    return and_(Assignment.valid_from <= when, Assignment.valid_to > when)
+
+
+def overlapping(start, end):
+    """Return a filter for assignments in effect at any time in a range."""
+    return and_(Assignment.valid_from < end, Assignment.valid_to > start)
+
+
+def _named_assignments():
+    # Archived employees keep their history, so names come from either.
+    return db.session.query(
+        Assignment,
+        func.coalesce(Employee.first_name, ArchivedEmployee.first_name),
+        func.coalesce(Employee.last_name, ArchivedEmployee.last_name)
+    ).outerjoin(Employee, Employee.id == Assignment.employee_id).outerjoin(
+        ArchivedEmployee, ArchivedEmployee.id == Assignment.employee_id)
+
+
+def _describe(rows):
+    return [{
+        'employee_id': assignment.employee_id,
+        'first_name': first_name,
+        'last_name': last_name,
+        'department_id': assignment.department_id,
+        'role_id': assignment.role_id,
+        'manager_id': assignment.manager_id,
+        'valid_from': assignment.valid_from,
+        'valid_to': (assignment.valid_to
+                     if assignment.valid_to != END_OF_TIME else None)
+    } for assignment, first_name, last_name in rows]
+
+
+def assignments_as_of(when, department_id=None, role_id=None, after=0,
+                      limit=500):
+    """Return the assignments in effect at a moment as dicts.
+
+    Results are ordered by employee id; pass the last id as after to get
+    the next page. Archived employees are included.
+    """
+    query = _named_assignments().filter(in_effect(when),
+                                        Assignment.employee_id > after)
+    if department_id is not None:
+        query = query.filter(Assignment.department_id == department_id)
+    if role_id is not None:
+        query = query.filter(Assignment.role_id == role_id)
+    return _describe(query.order_by(Assignment.employee_id).limit(limit))
+
+
+def assignments_between(start, end, department_id=None):
+    """Return every assignment in effect at any time in [start, end)."""
+    query = _named_assignments().filter(overlapping(start, end))
+    if department_id is not None:
+        query = query.filter(Assignment.department_id == department_id)
+    return _describe(query.order_by(Assignment.employee_id,
+                                    Assignment.valid_from))
+
+
+def headcount_as_of(when, column=Assignment.department_id):
+    """Return {group id: employees} for the assignments at a moment."""
+    return dict(db.session.query(column, func.count(Assignment.id)).filter(
+        in_effect(when)).group_by(column))
+
+
+def assignment_history(employee_id):
+    """Return an employee's assignments, oldest first."""
+    return Assignment.query.filter_by(employee_id=employee_id).order_by(
+        Assignment.valid_from).all()
@@ -1,10 +1,15 @@
 """Views for the Home blueprint."""
 
 
-from flask import abort, render_template
+from datetime import datetime, timedelta
+
+from flask import abort, render_template, request
 from flask_login import current_user, login_required
 
 from . import home
+from .. import db
+from ..models import Department, Role
+from ..snapshots import TOTAL, line_chart, trend
 
 
 @home.route('/')
@@ -27,4 +32,20 @@ def admin_dashboard():
     if not current_user.is_admin:
         abort(403)
 
-    return render_template('home/admin_dashboard.html', title="Dashboard")
+    end = datetime.utcnow().date()
+    days = max(1, min(request.args.get('days', 730, type=int), 3650))
+    start = end - timedelta(days=days)
+    charts = []
+    for title, dimension, model, blank in (
+            ('Departments', 'department', Department, 'No department'),
+            ('Roles', 'role', Role, 'No role')):
+        series = trend(dimension, start, limit=6)
+        labels = dict(db.session.query(model.id, model.name).filter(
+            model.id.in_([group_id for group_id, points in series])))
+        labels[None] = blank
+        charts.append((title, line_chart(series, labels, start, end)))
+    charts.insert(0, ('Headcount', line_chart(
+        trend(TOTAL, start), {None: 'Everyone'}, start, end)))
+
+    return render_template('home/admin_dashboard.html', charts=charts,
+                           title="Dashboard")
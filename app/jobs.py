@@ -0,0 +1,375 @@
+"""Background jobs run by worker processes outside the web workers."""
+
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from multiprocessing import Process
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, func
+from sqlalchemy.exc import IntegrityError
+
+from .tenancy import tenant_scope
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE = (QUEUED, RUNNING)
+
+# Seconds between checks for due periodic tasks in each worker.
+SCHEDULE_INTERVAL = 60
+
+
+class JobCancelled(Exception):
+    """Raised inside a task when an admin has cancelled its job."""
+
+
+class JobContext(object):
+    """Passed to a running task to report progress and check cancellation."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def progress(self, done, total=None, message=None):
+        """Record progress and commit the task's work so far.
+
+        Call it between chunks of work: it commits the session, and raises
+        JobCancelled once the job has been cancelled.
+        """
+        from . import db
+        from .models import Job
+        values = {Job.progress: done, Job.heartbeat_at: datetime.utcnow()}
+        if total is not None:
+            values[Job.total] = total
+        if message is not None:
+            values[Job.message] = message[:200]
+        Job.query.filter(Job.id == self.job_id).update(
+            values, synchronize_session=False)
+        db.session.commit()
+        if db.session.query(Job.cancel_requested).filter(
+                Job.id == self.job_id).scalar():
+            raise JobCancelled()
+
+
+def describe(job):
+    """Return the status of a job as a JSON-friendly dict."""
+    return {
+        'id': job.id,
+        'name': job.name,
+        'args': json.loads(job.args or '{}'),
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'cancel_requested': bool(job.cancel_requested),
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at
+    }
+
+
+class JobQueue(object):
+    """Queue registered tasks in the jobs table for `flask jobs work`.
+
+    Workers claim a due job with a conditional UPDATE, so any number of
+    processes on any number of hosts can share one table. Failed jobs are
+    retried with exponential backoff up to their max attempts, and a job
+    whose worker stopped sending heartbeats is queued again.
+    """
+
+    def __init__(self, app=None):
+        self.tasks = {}
+        self.schedule = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the `flask jobs` commands."""
+        app.extensions['job_queue'] = self
+        app.cli.add_command(jobs_cli)
+
+    def task(self, name=None, max_attempts=None, every=None):
+        """Register a function taking a JobContext as a task.
+
+        With every, a timedelta, the workers also queue the task whenever
+        its last job is older than that.
+        """
+        def decorator(func):
+            self.tasks[name or func.__name__] = (func, max_attempts)
+            if every is not None:
+                self.schedule[name or func.__name__] = every
+            return func
+        return decorator
+
+    def enqueue(self, name, created_by=None, **args):
+        """Add a job for a registered task to the session and return it."""
+        from . import db
+        from .models import Job
+        if name not in self.tasks:
+            raise KeyError('Unknown task: {}'.format(name))
+        max_attempts = (self.tasks[name][1] or
+                        current_app.config['JOB_MAX_ATTEMPTS'])
+        now = datetime.utcnow()
+        job = Job(name=name, args=json.dumps(args), status=QUEUED,
+                  progress=0, attempts=0, max_attempts=max_attempts,
+                  cancel_requested=False, created_by=created_by,
+                  created_at=now, run_after=now)
+        db.session.add(job)
+        return job
+
+    def enqueue_scheduled(self):
+        """Queue the periodic tasks that are due and return their jobs.
+
+        A task is only queued by the worker whose conditional UPDATE moves
+        its job_schedules row forward, so workers polling at the same time
+        do not queue it twice.
+        """
+        from . import db
+        from .models import Job, JobSchedule
+        schedules = JobSchedule.__table__
+        now = datetime.utcnow()
+        jobs = []
+        for name, every in sorted(self.schedule.items()):
+            if db.session.query(schedules.c.name).filter(
+                    schedules.c.name == name).first() is None:
+                last = db.session.query(func.max(Job.created_at)).filter(
+                    Job.name == name).scalar()
+                try:
+                    db.session.execute(schedules.insert().values(
+                        name=name, next_run_at=now if last is None
+                        else last + every))
+                    db.session.commit()
+                except IntegrityError:
+                    # Another worker added the row first.
+                    db.session.rollback()
+            claimed = db.session.execute(schedules.update().where(and_(
+                schedules.c.name == name,
+                schedules.c.next_run_at <= now)).values(
+                next_run_at=now + every)).rowcount
+            if claimed:
+                jobs.append(self.enqueue(name))
+            db.session.commit()
+        return jobs
+
+    def cancel(self, job):
+        """Cancel a queued job, or ask a running one to stop.
+
+        Returns False if the job had already finished.
+        """
+        from . import db
+        from .models import Job
+        now = datetime.utcnow()
+        if Job.query.filter(Job.id == job.id, Job.status == QUEUED).update(
+                {Job.status: CANCELLED, Job.finished_at: now},
+                synchronize_session=False):
+            cancelled = True
+        else:
+            cancelled = bool(Job.query.filter(
+                Job.id == job.id, Job.status == RUNNING).update(
+                {Job.cancel_requested: True}, synchronize_session=False))
+        db.session.commit()
+        return cancelled
+
+    def retry(self, job):
+        """Queue a failed or cancelled job again from the start."""
+        from . import db
+        from .models import Job
+        retried = Job.query.filter(
+            Job.id == job.id, Job.status.in_((FAILED, CANCELLED))).update({
+                Job.status: QUEUED, Job.attempts: 0, Job.progress: 0,
+                Job.message: None, Job.error: None, Job.result: None,
+                Job.cancel_requested: False, Job.worker: None,
+                Job.run_after: datetime.utcnow(), Job.started_at: None,
+                Job.finished_at: None}, synchronize_session=False)
+        db.session.commit()
+        return bool(retried)
+
+    def claim(self, worker):
+        """Mark the next due job as running by worker and return its id."""
+        from . import db
+        from .models import Job
+        now = datetime.utcnow()
+        candidates = db.session.query(Job.id).filter(
+            Job.status == QUEUED, Job.run_after <= now).order_by(
+            Job.run_after, Job.id).limit(10).all()
+        db.session.commit()
+        for (job_id,) in candidates:
+            claimed = Job.query.filter(
+                Job.id == job_id, Job.status == QUEUED).update({
+                    Job.status: RUNNING, Job.worker: worker[:60],
+                    Job.attempts: Job.attempts + 1, Job.started_at: now,
+                    Job.heartbeat_at: now}, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return job_id
+        return None
+
+    def run(self, job_id):
+        """Run a claimed job and record how it ended."""
+        from . import db
+        from .models import Job
+        job = Job.query.get(job_id)
+        func = self.tasks.get(job.name, (None, None))[0]
+        args = json.loads(job.args or '{}')
+        tenant_id = job.tenant_id
+        db.session.commit()
+
+        values = {}
+        try:
+            if func is None:
+                raise LookupError('Unknown task: {}'.format(job.name))
+            # Tasks run as the tenant whose admin queued them.
+            with tenant_scope(tenant_id):
+                result = func(JobContext(job_id), **args)
+        except JobCancelled:
+            db.session.rollback()
+            values[Job.status] = CANCELLED
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Job %d (%s) failed', job_id,
+                                         job.name)
+            job = Job.query.get(job_id)
+            values[Job.error] = traceback.format_exc()
+            if job.attempts < job.max_attempts and \
+                    not job.cancel_requested:
+                delay = current_app.config['JOB_RETRY_DELAY'] * \
+                    2 ** (job.attempts - 1)
+                values.update({
+                    Job.status: QUEUED, Job.worker: None,
+                    Job.run_after: datetime.utcnow() + timedelta(
+                        seconds=delay)})
+            else:
+                values[Job.status] = FAILED
+        else:
+            values[Job.status] = SUCCEEDED
+            values[Job.result] = json.dumps(result, default=str)
+        values[Job.heartbeat_at] = datetime.utcnow()
+        if values[Job.status] != QUEUED:
+            values[Job.finished_at] = values[Job.heartbeat_at]
+        Job.query.filter(Job.id == job_id).update(
+            values, synchronize_session=False)
+        db.session.commit()
+
+    def requeue_stale(self):
+        """Queue again running jobs whose worker has stopped reporting.
+
+        The claim counted the attempt, so a job that keeps taking its worker
+        down fails once it is out of attempts instead of looping forever.
+        """
+        from . import db
+        from .models import Job
+        now = datetime.utcnow()
+        cutoff = now - timedelta(
+            seconds=current_app.config['JOB_STALE_AFTER'])
+        stale = and_(Job.status == RUNNING, Job.heartbeat_at < cutoff)
+        Job.query.filter(stale, Job.attempts >= Job.max_attempts).update(
+            {Job.status: FAILED, Job.worker: None, Job.finished_at: now,
+             Job.error: 'The worker stopped sending heartbeats.'},
+            synchronize_session=False)
+        requeued = Job.query.filter(stale).update(
+            {Job.status: QUEUED, Job.worker: None, Job.run_after: now},
+            synchronize_session=False)
+        db.session.commit()
+        return requeued
+
+    def run_pending(self, worker='inline'):
+        """Run every due job in this process and return how many ran."""
+        count = 0
+        job_id = self.claim(worker)
+        while job_id is not None:
+            self.run(job_id)
+            count += 1
+            job_id = self.claim(worker)
+        return count
+
+    def work(self, processes, burst=False):
+        """Run worker processes until they are stopped.
+
+        With burst, each worker exits once no job is due.
+        """
+        from . import db
+        app = current_app._get_current_object()
+        # Connections must not be shared with the forked workers.
+        db.engine.dispose()
+        workers = [Process(target=self._work, args=(app, number, burst),
+                           name='jobs-worker-{}'.format(number))
+                   for number in range(processes)]
+        for worker in workers:
+            worker.start()
+
+        def stop(signum, frame):
+            for worker in workers:
+                if worker.is_alive():
+                    os.kill(worker.pid, signal.SIGTERM)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for worker in workers:
+            worker.join()
+
+    def _work(self, app, number, burst):
+        stopping = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: stopping.set())
+        name = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), number)
+        interval = app.config['JOB_POLL_INTERVAL']
+        next_schedule = 0
+        while not stopping.is_set():
+            with app.app_context():
+                if time.time() >= next_schedule:
+                    self.enqueue_scheduled()
+                    next_schedule = time.time() + SCHEDULE_INTERVAL
+                self.requeue_stale()
+                job_id = self.claim(name)
+                if job_id is not None:
+                    self.run(job_id)
+                    continue
+            if burst:
+                return
+            stopping.wait(interval)
+
+
+jobs_cli = AppGroup('jobs', help='Run background jobs.')
+
+
+@jobs_cli.command('work')
+@click.option('--processes', '-p', type=int, default=None,
+              help='Number of worker processes (JOB_WORKERS).')
+@click.option('--burst', is_flag=True,
+              help='Exit once the queue is empty.')
+def work_command(processes, burst):
+    """Run queued jobs in a pool of worker processes."""
+    processes = processes or current_app.config['JOB_WORKERS']
+    click.echo('Starting {} job worker(s).'.format(processes))
+    current_app.extensions['job_queue'].work(processes, burst)
+
+
+@jobs_cli.command('enqueue')
+@click.argument('name')
+@click.argument('args', nargs=-1)
+def enqueue_command(name, args):
+    """Queue a task with KEY=VALUE arguments (values are parsed as JSON)."""
+    from . import db
+    kwargs = {}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        try:
+            kwargs[key] = json.loads(value)
+        except ValueError:
+            kwargs[key] = value
+    job = current_app.extensions['job_queue'].enqueue(name, **kwargs)
+    db.session.commit()
+    click.echo('Queued job {}.'.format(job.id))
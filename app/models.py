@@ -1,10 +1,31 @@
 """Models for the Dream Team Flask app."""
 
 
+from flask import session
 from flask_login import UserMixin
+from sqlalchemy import event, inspect
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from app import db, login_manager
+from app import access_tokens, db, login_manager, session_store
+from app.tenancy import DEFAULT_TENANT_ID, current_tenant_id
+
+
+class Tenant(db.Model):
+    """Create a table of the organizations sharing the deployment."""
+
+    __tablename__ = 'tenants'
+
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(60), nullable=False, unique=True)
+    name = db.Column(db.String(60), nullable=False)
+
+    def __repr__(self):
+        return '<Tenant: {}>'.format(self.slug)
+
+
+event.listen(Tenant.__table__, 'after_create', db.DDL(
+    "INSERT INTO tenants (id, slug, name) VALUES ({}, 'default', "
+    "'Default')".format(DEFAULT_TENANT_ID)))
 
 
 class Employee(UserMixin, db.Model):
@@ -13,14 +34,46 @@ class Employee(UserMixin, db.Model):
     __tablename__ = 'employees'
 
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(60), index=True, unique=True)
-    username = db.Column(db.String(60), index=True, unique=True)
-    first_name = db.Column(db.String(60), index=True)
-    last_name = db.Column(db.String(60), index=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'),
+                          nullable=False, default=current_tenant_id)
+    email = db.Column(db.String(60))
+    username = db.Column(db.String(60))
+    first_name = db.Column(db.String(60))
+    last_name = db.Column(db.String(60))
     password_hash = db.Column(db.String(128))
     department_id = db.Column(db.Integer, db.ForeignKey('departments.id'))
     role_id = db.Column(db.Integer, db.ForeignKey('roles.id'))
+    manager_id = db.Column(db.Integer, db.ForeignKey('employees.id'),
+                           index=True)
     is_admin = db.Column(db.Boolean, default=False)
+    is_active = db.Column(db.Boolean, nullable=False, default=True,
+                          server_default=db.true())
+    deactivated_at = db.Column(db.DateTime)
+    directory_managed = db.Column(db.Boolean, nullable=False, default=False,
+                                  server_default=db.false())
+    manager = db.relationship('Employee', remote_side=[id],
+                              backref=db.backref('reports', lazy='dynamic'))
+
+    # Emails and usernames are unique within a tenant, and every index
+    # starts with the tenant so no lookup scans another tenant's rows.
+    __table_args__ = (
+        db.Index('ix_employees_tenant_email', 'tenant_id', 'email',
+                 unique=True),
+        db.Index('ix_employees_tenant_username', 'tenant_id', 'username',
+                 unique=True),
+        db.Index('ix_employees_tenant_first_name', 'tenant_id',
+                 'first_name'),
+        db.Index('ix_employees_tenant_last_name', 'tenant_id', 'last_name'),
+        db.Index('ix_employees_tenant_active', 'tenant_id', 'is_active',
+                 'id'),
+        db.Index('ix_employees_tenant_deactivated_at', 'tenant_id',
+                 'deactivated_at'),
+        # Department and role ids already imply the tenant; these serve
+        # the member pages and counts of one department or role.
+        db.Index('ix_employees_department_active', 'department_id',
+                 'is_active', 'id'),
+        db.Index('ix_employees_role_active', 'role_id', 'is_active', 'id'),
+    )
 
     @property
     def password(self):
@@ -34,6 +87,9 @@ class Employee(UserMixin, db.Model):
 
     def verify_password(self, password):
         """Check if hashed password matches actual password."""
+        # Employees synced from the directory may have no password here.
+        if self.password_hash is None:
+            return False
         return check_password_hash(self.password_hash, password)
 
     def __repr__(self):
@@ -42,7 +98,50 @@ class Employee(UserMixin, db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Employee.query.get(int(user_id))
+    # Sessions signed in before everyone's were revoked are signed out.
+    if session.get('signed_in_at', 0) < access_tokens.revocations().everyone:
+        return None
+    principal = session_store.get(user_id)
+    if principal is not None:
+        return principal
+
+    # Imported here, as the baked queries are built from these models.
+    from app.queries import active_employee
+    employee = active_employee(int(user_id))
+    if employee is not None:
+        session_store.put(employee)
+    return employee
+
+
+@login_manager.request_loader
+def load_user_from_request(request):
+    return access_tokens.load(request)
+
+
+@event.listens_for(db.session, 'after_flush')
+def collect_revoked_principals(session, flush_context):
+    """Note employees whose cached principal is now stale."""
+    revoked = session.info.setdefault('revoked_principals', set())
+    for employee in session.deleted:
+        if isinstance(employee, Employee):
+            revoked.add(employee.id)
+    for employee in session.dirty:
+        if isinstance(employee, Employee) and (
+                inspect(employee).attrs.is_admin.history.has_changes() or
+                inspect(employee).attrs.is_active.history.has_changes()):
+            revoked.add(employee.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def revoke_principals(session):
+    """Revoke cached principals once their changes are committed."""
+    for user_id in session.info.pop('revoked_principals', ()):
+        session_store.revoke(user_id)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_revoked_principals(session, previous_transaction):
+    session.info.pop('revoked_principals', None)
 
 
 class Department(db.Model):
@@ -51,10 +150,17 @@ class Department(db.Model):
     __tablename__ = 'departments'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(60), unique=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'),
+                          nullable=False, default=current_tenant_id)
+    name = db.Column(db.String(60))
     description = db.Column(db.String(200))
     employees = db.relationship('Employee', backref='department', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_departments_tenant_name', 'tenant_id', 'name',
+                 unique=True),
+    )
+
     def __repr__(self):
         return '<Department : {}'.format(self.name)
 
@@ -65,9 +171,366 @@ class Role(db.Model):
     __tablename__ = 'roles'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(60), unique=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'),
+                          nullable=False, default=current_tenant_id)
+    name = db.Column(db.String(60))
     description = db.Column(db.String(200))
     employees = db.relationship('Employee', backref='role', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_roles_tenant_name', 'tenant_id', 'name', unique=True),
+    )
+
     def __repr__(self):
         return '<Role: {}>'.format(self.name)
+
+
+class ArchivedEmployee(db.Model):
+    """Create a table of employees archived long after deactivation."""
+
+    __tablename__ = 'employees_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    email = db.Column(db.String(60))
+    username = db.Column(db.String(60))
+    first_name = db.Column(db.String(60))
+    last_name = db.Column(db.String(60))
+    password_hash = db.Column(db.String(128))
+    department_id = db.Column(db.Integer)
+    role_id = db.Column(db.Integer)
+    manager_id = db.Column(db.Integer)
+    is_admin = db.Column(db.Boolean)
+    is_active = db.Column(db.Boolean)
+    deactivated_at = db.Column(db.DateTime)
+    directory_managed = db.Column(db.Boolean)
+    archived_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_employees_archive_tenant_email', 'tenant_id', 'email'),
+        db.Index('ix_employees_archive_tenant_username', 'tenant_id',
+                 'username'),
+    )
+
+    def __repr__(self):
+        return '<ArchivedEmployee: {}>'.format(self.username)
+
+
+class Assignment(db.Model):
+    """Create an effective-dated history of employee assignments.
+
+    Each row holds an employee's department, role and manager from
+    valid_from up to, but not including, valid_to. The current row of an
+    active employee ends at app.history.END_OF_TIME.
+    """
+
+    __tablename__ = 'assignment_history'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    employee_id = db.Column(db.Integer, nullable=False)
+    department_id = db.Column(db.Integer)
+    role_id = db.Column(db.Integer)
+    manager_id = db.Column(db.Integer)
+    valid_from = db.Column(db.DateTime, nullable=False)
+    valid_to = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_assignment_history_employee',
+                 'employee_id', 'valid_from'),
+        db.Index('ix_assignment_history_department',
+                 'department_id', 'valid_from', 'valid_to'),
+        db.Index('ix_assignment_history_role',
+                 'role_id', 'valid_from', 'valid_to'),
+        db.Index('ix_assignment_history_period', 'tenant_id',
+                 'valid_to', 'valid_from', 'department_id'),
+    )
+
+    def __repr__(self):
+        return '<Assignment: {} {} - {}>'.format(
+            self.employee_id, self.valid_from, self.valid_to)
+
+
+class HeadcountSnapshot(db.Model):
+    """Create a table of headcount aggregates for the dashboard trends.
+
+    Each row is the headcount of one department or role, or of the whole
+    organization when group_id is None, for a day, or averaged over the
+    week or month starting on day once it has been downsampled.
+    """
+
+    __tablename__ = 'headcount_snapshots'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    period = db.Column(db.String(5), nullable=False)
+    dimension = db.Column(db.String(20), nullable=False)
+    group_id = db.Column(db.Integer)
+    headcount = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_headcount_snapshots_dimension_day', 'tenant_id',
+                 'dimension', 'day', 'period'),
+    )
+
+    def __repr__(self):
+        return '<HeadcountSnapshot: {} {} {} {}>'.format(
+            self.dimension, self.group_id, self.period, self.day)
+
+
+class AuditEntry(db.Model):
+    """Create an audit log table of admin changes."""
+
+    __tablename__ = 'audit_log'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, index=True)
+    actor_id = db.Column(db.Integer)
+    actor_name = db.Column(db.String(60))
+    action = db.Column(db.String(20))
+    target_type = db.Column(db.String(20))
+    target_id = db.Column(db.Integer)
+    before = db.Column(db.Text)
+    after = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index('ix_audit_log_target', 'target_type', 'target_id'),
+    )
+
+    def __repr__(self):
+        return '<AuditEntry: {} {} {}>'.format(
+            self.action, self.target_type, self.target_id)
+
+
+class ChangeEvent(db.Model):
+    """Create an outbox table of employee, department and role changes."""
+
+    __tablename__ = 'change_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime)
+    entity = db.Column(db.String(20))
+    entity_id = db.Column(db.Integer)
+    operation = db.Column(db.String(10))
+    payload = db.Column(db.Text)
+    # The order the change committed in, handed out afterwards by
+    # app.outbox.sequence_changes; readers page by it rather than by id.
+    seq = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_change_events_tenant', 'tenant_id', 'id'),
+        db.Index('ix_change_events_entity', 'tenant_id', 'entity', 'id'),
+        db.Index('ix_change_events_seq', 'seq', unique=True),
+        db.Index('ix_change_events_tenant_seq', 'tenant_id', 'seq'),
+    )
+
+    def __repr__(self):
+        return '<ChangeEvent: {} {} {}>'.format(
+            self.operation, self.entity, self.entity_id)
+
+
+class ChangeSequence(db.Model):
+    """Create a one-row table of the last change sequence handed out."""
+
+    __tablename__ = 'change_sequence'
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_seq = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<ChangeSequence: {}>'.format(self.last_seq)
+
+
+class EmployeeHierarchy(db.Model):
+    """Create a closure table of reporting lines.
+
+    Every employee has a row pairing them with themselves at depth 0 and one
+    row for each manager above them, at the number of levels between them.
+    """
+
+    __tablename__ = 'employee_hierarchy'
+
+    ancestor_id = db.Column(db.Integer,
+                            db.ForeignKey('employees.id', ondelete='CASCADE'),
+                            primary_key=True)
+    descendant_id = db.Column(db.Integer,
+                              db.ForeignKey('employees.id',
+                                            ondelete='CASCADE'),
+                              primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_employee_hierarchy_ancestor_depth',
+                 'ancestor_id', 'depth'),
+        db.Index('ix_employee_hierarchy_descendant_depth',
+                 'descendant_id', 'depth'),
+    )
+
+    def __repr__(self):
+        return '<EmployeeHierarchy: {} > {} ({})>'.format(
+            self.ancestor_id, self.descendant_id, self.depth)
+
+
+class Job(db.Model):
+    """Create a table of background jobs run by `flask jobs work`."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=False,
+                          default=current_tenant_id)
+    name = db.Column(db.String(60), nullable=False)
+    args = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False)
+    progress = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer)
+    message = db.Column(db.String(200))
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    created_by = db.Column(db.Integer)
+    worker = db.Column(db.String(60))
+    created_at = db.Column(db.DateTime)
+    run_after = db.Column(db.DateTime)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+        db.Index('ix_jobs_name_created_at', 'name', 'created_at'),
+        db.Index('ix_jobs_tenant', 'tenant_id', 'id'),
+    )
+
+    def __repr__(self):
+        return '<Job: {} {} {}>'.format(self.id, self.name, self.status)
+
+
+class JobSchedule(db.Model):
+    """Create a table of when each periodic task is next queued."""
+
+    __tablename__ = 'job_schedules'
+
+    name = db.Column(db.String(60), primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<JobSchedule: {} {}>'.format(self.name, self.next_run_at)
+
+
+class Webhook(db.Model):
+    """Create a table of endpoints sent batches of outbox changes."""
+
+    __tablename__ = 'webhooks'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'),
+                          nullable=False, default=current_tenant_id)
+    url = db.Column(db.String(255), nullable=False)
+    secret = db.Column(db.String(64), nullable=False)
+    # Comma-separated change entities to send, or every entity if empty.
+    entities = db.Column(db.String(60))
+    is_active = db.Column(db.Boolean, default=True)
+    # Sequence of the last change event the endpoint has accepted.
+    cursor = db.Column(db.Integer, nullable=False, default=0)
+    failures = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime)
+    leased_until = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    deliveries = db.relationship('WebhookDelivery', backref='webhook',
+                                 lazy='dynamic', cascade='all, delete-orphan',
+                                 passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_webhooks_tenant', 'tenant_id', 'id'),
+    )
+
+    def __repr__(self):
+        return '<Webhook: {}>'.format(self.url)
+
+
+class WebhookDelivery(db.Model):
+    """Create a table of the attempts to send batches to webhooks."""
+
+    __tablename__ = 'webhook_deliveries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    webhook_id = db.Column(db.Integer,
+                           db.ForeignKey('webhooks.id', ondelete='CASCADE'),
+                           nullable=False)
+    created_at = db.Column(db.DateTime)
+    first_change_id = db.Column(db.Integer)
+    last_change_id = db.Column(db.Integer)
+    changes = db.Column(db.Integer)
+    status_code = db.Column(db.Integer)
+    error = db.Column(db.String(200))
+    duration_ms = db.Column(db.Integer)
+    succeeded = db.Column(db.Boolean, default=False)
+
+    __table_args__ = (
+        db.Index('ix_webhook_deliveries_webhook', 'webhook_id', 'id'),
+        db.Index('ix_webhook_deliveries_created_at', 'created_at'),
+    )
+
+    def __repr__(self):
+        return '<WebhookDelivery: {} {}>'.format(self.webhook_id,
+                                                 self.status_code)
+
+
+class SlowQuery(db.Model):
+    """Create a table of slow SQL statements, counted by their digest."""
+
+    __tablename__ = 'slow_queries'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, nullable=False,
+                          default=current_tenant_id)
+    digest = db.Column(db.String(40), nullable=False)
+    statement = db.Column(db.Text)
+    # Where the slowest run came from, and its parameters' types.
+    endpoint = db.Column(db.String(100))
+    call_site = db.Column(db.String(200))
+    parameters = db.Column(db.Text)
+    count = db.Column(db.Integer, default=0)
+    total_ms = db.Column(db.Float, default=0)
+    max_ms = db.Column(db.Float, default=0)
+    plan = db.Column(db.Text)
+    first_seen = db.Column(db.DateTime)
+    last_seen = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_slow_queries_tenant_digest', 'tenant_id', 'digest',
+                 unique=True),
+        db.Index('ix_slow_queries_tenant_total', 'tenant_id', 'total_ms'),
+    )
+
+    def __repr__(self):
+        return '<SlowQuery: {} x{}>'.format(self.digest, self.count)
+
+
+class RevokedToken(db.Model):
+    """Create a table of revoked API access tokens."""
+
+    __tablename__ = 'revoked_tokens'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Either one token, or every token of an employee issued before the
+    # Unix time issued_before, or with neither set every token and session
+    # issued before it.
+    jti = db.Column(db.String(32))
+    employee_id = db.Column(db.Integer)
+    issued_before = db.Column(db.Float)
+    # When the revoked tokens have expired and the row can be ignored.
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_revoked_tokens_expires_at', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return '<RevokedToken: {}>'.format(self.jti or self.employee_id)
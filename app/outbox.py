@@ -0,0 +1,135 @@
+"""Transactional outbox of employee, department and role changes."""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+
+from . import db
+from .audit import snapshot
+from .models import ChangeEvent, ChangeSequence, Department, Employee, Role
+
+TRACKED_MODELS = (Employee, Department, Role)
+
+
+def _queue_event(target, operation):
+    session = object_session(target)
+    if session is None:
+        return
+    session.info.setdefault('change_events', []).append({
+        'tenant_id': target.tenant_id,
+        'created_at': datetime.utcnow(),
+        'entity': target.__tablename__,
+        'entity_id': target.id,
+        'operation': operation,
+        'payload': json.dumps(snapshot(target), default=str)
+    })
+
+
+def _after_insert(mapper, connection, target):
+    _queue_event(target, 'insert')
+
+
+def _after_update(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[column.key].history.has_changes()
+           for column in mapper.columns):
+        _queue_event(target, 'update')
+
+
+def _after_delete(mapper, connection, target):
+    _queue_event(target, 'delete')
+
+
+for model in TRACKED_MODELS:
+    event.listen(model, 'after_insert', _after_insert)
+    event.listen(model, 'after_update', _after_update)
+    event.listen(model, 'after_delete', _after_delete)
+
+
+@event.listens_for(db.session, 'after_flush')
+def write_change_events(session, flush_context):
+    """Insert the flushed changes into the outbox in the same transaction."""
+    rows = session.info.pop('change_events', None)
+    if rows:
+        session.execute(ChangeEvent.__table__.insert(), rows)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_change_events(session, previous_transaction):
+    session.info.pop('change_events', None)
+
+
+def describe(change):
+    """Return a change event as a JSON-friendly dict."""
+    return {
+        'id': change.id,
+        'seq': change.seq,
+        'created_at': change.created_at.isoformat(),
+        'entity': change.entity,
+        'entity_id': change.entity_id,
+        'operation': change.operation,
+        'data': json.loads(change.payload)
+    }
+
+
+def sequence_changes():
+    """Number the committed changes that have no sequence yet.
+
+    Ids are taken when a change is flushed, so a change can commit after
+    changes with higher ids have been read. Sequences are handed out here
+    instead, only to changes that have committed, while holding the
+    change_sequence row, so every later change gets a higher one. Returns
+    how many changes were numbered.
+    """
+    changes = ChangeEvent.__table__
+    counter = ChangeSequence.__table__
+    if db.engine.execute(select([changes.c.id]).where(
+            changes.c.seq.is_(None)).limit(1)).first() is None:
+        return 0
+    if db.engine.execute(select([counter.c.id])).first() is None:
+        try:
+            db.engine.execute(counter.insert().values(
+                id=1, last_seq=select([func.coalesce(
+                    func.max(changes.c.seq), 0)]).as_scalar()))
+        except IntegrityError:
+            # Another reader added it first.
+            pass
+    with db.engine.begin() as connection:
+        # Locked before the changes are read, so concurrent calls run one
+        # after the other and each sees what the previous one numbered.
+        connection.execute(counter.update().where(counter.c.id == 1).values(
+            last_seq=counter.c.last_seq))
+        last = connection.execute(select([counter.c.last_seq]).where(
+            counter.c.id == 1)).scalar()
+        ids = [row[0] for row in connection.execute(
+            select([changes.c.id]).where(changes.c.seq.is_(None)).order_by(
+                changes.c.id))]
+        if ids:
+            connection.execute(
+                changes.update().where(
+                    changes.c.id == bindparam('change_id')).values(
+                    seq=bindparam('change_seq')),
+                [{'change_id': change_id, 'change_seq': last + number}
+                 for number, change_id in enumerate(ids, 1)])
+            connection.execute(counter.update().where(
+                counter.c.id == 1).values(last_seq=last + len(ids)))
+    return len(ids)
+
+
+def changes_since(cursor=0, limit=500, entity=None):
+    """Return up to limit changes with a sequence greater than cursor.
+
+    The cursor to pass next is the seq of the last change returned. As
+    changes are numbered once they have committed, a change committing
+    after later ones were read is returned by the next call rather than
+    skipped, however long its transaction took.
+    """
+    sequence_changes()
+    query = ChangeEvent.query.filter(ChangeEvent.seq > cursor)
+    if entity:
+        query = query.filter(ChangeEvent.entity == entity)
+    changes = query.order_by(ChangeEvent.seq).limit(limit).all()
+    return [describe(change) for change in changes]
@@ -0,0 +1,53 @@
+"""Baked queries for the employee lookups made on nearly every request.
+
+A baked query is built, tenant-scoped and compiled to SQL once per process
+and cached; each call only binds its parameters. The tenant filter reads
+the scoped tenant when the statement runs, so one cached statement serves
+every tenant.
+"""
+
+from sqlalchemy import bindparam
+from sqlalchemy.ext import baked
+
+from . import db
+from .models import ArchivedEmployee, Employee
+
+bakery = baked.bakery()
+
+
+def active_employee(employee_id):
+    """Return the active employee with an id, or None."""
+    query = bakery(lambda session: session.query(Employee))
+    query += lambda q: q.filter(Employee.id == bindparam('employee_id'),
+                                Employee.is_active == db.true())
+    return query(db.session()).params(employee_id=employee_id).first()
+
+
+def active_employee_by_email(email):
+    """Return the active employee with an email, or None."""
+    query = bakery(lambda session: session.query(Employee))
+    query += lambda q: q.filter(Employee.email == bindparam('email'),
+                                Employee.is_active == db.true())
+    return query(db.session()).params(email=email).first()
+
+
+def _taken(column, value):
+    # The lambdas close over model and column, so both are part of the
+    # cache key.
+    for model in (Employee, ArchivedEmployee):
+        query = bakery(lambda session: session.query(model.id), model)
+        query.add_criteria(lambda q: q.filter(
+            getattr(model, column) == bindparam('value')), model, column)
+        if query(db.session()).params(value=value).first() is not None:
+            return True
+    return False
+
+
+def email_taken(email):
+    """Return whether an employee, current or archived, has an email."""
+    return _taken('email', email)
+
+
+def username_taken(username):
+    """Return whether an employee, current or archived, has a username."""
+    return _taken('username', username)
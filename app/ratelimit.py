@@ -0,0 +1,159 @@
+"""Sliding-window rate limiting for the Dream Team app."""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .tenancy import current_tenant_id
+
+
+class MemoryBackend(object):
+    """Bounded in-process counter store with per-key expiry."""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def incr(self, key, ttl):
+        """Increment a counter and return its new value."""
+        now = time.time()
+        with self._lock:
+            value, expires = self._counters.pop(key, (0, 0))
+            if expires <= now:
+                value = 0
+            value += 1
+            self._counters[key] = (value, now + ttl)
+            # Evict the least recently touched counters to bound memory.
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        return value
+
+    def get(self, key):
+        """Return the current value of a counter."""
+        with self._lock:
+            value, expires = self._counters.get(key, (0, 0))
+        return value if expires > time.time() else 0
+
+    def clear(self):
+        """Drop all counters."""
+        with self._lock:
+            self._counters.clear()
+
+
+class RedisBackend(object):
+    """Counter store shared between workers through a Redis-like server."""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.StrictRedis.from_url(url)
+
+    def incr(self, key, ttl):
+        """Increment a counter and return its new value."""
+        pipe = self._client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, ttl)
+        return pipe.execute()[0]
+
+    def get(self, key):
+        """Return the current value of a counter."""
+        return int(self._client.get(key) or 0)
+
+    def clear(self):
+        """Drop all rate limit counters."""
+        for key in self._client.scan_iter('ratelimit:*'):
+            self._client.delete(key)
+
+
+class SlidingWindow(object):
+    """Approximate sliding-window counter.
+
+    Only two fixed-window counters are kept per key; the previous window is
+    weighted by how much of it still overlaps the sliding window.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def hit(self, key, limit, window):
+        """Record an attempt for key; return False if it is over the limit."""
+        now = time.time()
+        current = int(now // window)
+        overlap = 1 - (now % window) / window
+        prefix = 'ratelimit:{}:'.format(key)
+        count = self.backend.incr(prefix + str(current), window * 2)
+        previous = self.backend.get(prefix + str(current - 1))
+        return previous * overlap + count <= limit
+
+
+class LoginLimiter(object):
+    """Throttle login attempts per client IP and per email address."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set up the counter backend for an app."""
+        url = app.config.get('RATELIMIT_STORAGE_URL')
+        if url:
+            backend = RedisBackend(url)
+        else:
+            backend = MemoryBackend(app.config.get('RATELIMIT_MAX_KEYS',
+                                                   10000))
+        app.extensions['login_limiter'] = {
+            'window': SlidingWindow(backend),
+            'stats': {'allowed': 0, 'rejected_ip': 0, 'rejected_email': 0},
+            'lock': threading.Lock()
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['login_limiter']
+
+    def check(self, ip, email):
+        """Return None if the attempt may proceed, else the rejecting scope."""
+        config = current_app.config
+        state = self._state
+        scope = None
+        limit, window = config['LOGIN_RATE_LIMIT_IP']
+        if not state['window'].hit('ip:' + str(ip), limit, window):
+            scope = 'ip'
+        else:
+            limit, window = config['LOGIN_RATE_LIMIT_EMAIL']
+            # The same email can belong to employees of several tenants.
+            if not state['window'].hit('email:{}:{}'.format(
+                    current_tenant_id(), (email or '').lower()),
+                    limit, window):
+                scope = 'email'
+
+        with state['lock']:
+            if scope is None:
+                state['stats']['allowed'] += 1
+            else:
+                state['stats']['rejected_' + scope] += 1
+        if scope is not None:
+            current_app.logger.warning(
+                'Login throttled by %s limit for %s', scope, ip)
+        return scope
+
+    def retry_after(self, scope):
+        """Return the number of seconds a rejected client should wait."""
+        key = 'LOGIN_RATE_LIMIT_{}'.format(scope.upper())
+        return current_app.config[key][1]
+
+    def stats(self):
+        """Return a snapshot of the allowed/rejected counters."""
+        state = self._state
+        with state['lock']:
+            return dict(state['stats'])
+
+    def reset(self):
+        """Clear all counters and metrics."""
+        state = self._state
+        state['window'].backend.clear()
+        with state['lock']:
+            for key in state['stats']:
+                state['stats'][key] = 0
@@ -0,0 +1,163 @@
+"""Server-side session store caching authenticated principals."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+from flask import current_app
+from flask_login import UserMixin
+
+from .tenancy import current_tenant_id
+
+PRINCIPAL_FIELDS = ('id', 'tenant_id', 'email', 'username', 'first_name',
+                    'last_name', 'is_admin')
+
+
+class Principal(UserMixin):
+    """Cached snapshot of an authenticated employee."""
+
+    def __init__(self, **fields):
+        for field in PRINCIPAL_FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def __repr__(self):
+        return '<Principal: {}>'.format(self.username)
+
+
+class MemoryStore(object):
+    """Bounded principal store local to one worker process."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            data, expires = self._entries.get(user_id, (None, 0))
+            if expires <= time.time():
+                self._entries.pop(user_id, None)
+                return None
+            self._entries.move_to_end(user_id)
+        return data
+
+    def set(self, user_id, data, ttl):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (data, time.time() + ttl)
+            # Evict the least recently used principals to bound memory.
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+class SqliteStore(object):
+    """Principal store in a SQLite file shared by every worker on a host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with closing(sqlite3.connect(path)) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS principals ('
+                         'user_id INTEGER PRIMARY KEY, data TEXT, '
+                         'expires REAL)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # Never reuse a connection opened before a fork.
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, user_id):
+        row = self._connect().execute(
+            'SELECT data FROM principals WHERE user_id = ? AND expires > ?',
+            (user_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, user_id, data, ttl):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO principals VALUES (?, ?, ?)',
+            (user_id, json.dumps(data), time.time() + ttl))
+
+    def delete(self, user_id):
+        self._connect().execute(
+            'DELETE FROM principals WHERE user_id = ?', (user_id,))
+
+
+class SessionStore(object):
+    """Cache the logged-in principal so requests skip the employee lookup.
+
+    Disabled unless SESSION_STORE is set to 'memory' or 'sqlite:///<path>'.
+    Entries expire after SESSION_STORE_TTL seconds, and the memory store
+    keeps at most SESSION_STORE_MAX_ENTRIES of them. An employee's entry is
+    dropped as soon as their admin flag or status changes or they are
+    deleted in this worker, and in every other worker, or after a change
+    from the CLI or a job, once it has reloaded the revoked access tokens.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Create the configured backend for an app."""
+        url = app.config.get('SESSION_STORE')
+        if not url:
+            backend = None
+        elif url == 'memory':
+            backend = MemoryStore(app.config['SESSION_STORE_MAX_ENTRIES'])
+        elif url.startswith('sqlite:///'):
+            backend = SqliteStore(url[len('sqlite:///'):])
+        else:
+            raise ValueError('Unsupported SESSION_STORE: {}'.format(url))
+        app.extensions['session_store'] = backend
+
+    @property
+    def _backend(self):
+        return current_app.extensions.get('session_store')
+
+    def get(self, user_id):
+        """Return the cached principal for a user id, or None."""
+        from . import access_tokens
+        backend = self._backend
+        if backend is None:
+            return None
+        data = backend.get(int(user_id))
+        # A session cookie shared across tenant hosts must not carry an
+        # employee into another tenant.
+        if data is None or data.get('tenant_id') != current_tenant_id():
+            return None
+        # Revoked since it was cached, perhaps by another process.
+        if access_tokens.revocations().revoked(data['id'],
+                                               data.get('cached_at', 0)):
+            backend.delete(data['id'])
+            return None
+        return Principal(**data)
+
+    def put(self, employee):
+        """Cache the principal for an employee."""
+        backend = self._backend
+        if backend is not None:
+            data = dict((field, getattr(employee, field))
+                        for field in PRINCIPAL_FIELDS)
+            data['cached_at'] = time.time()
+            backend.set(employee.id, data,
+                        current_app.config['SESSION_STORE_TTL'])
+
+    def revoke(self, user_id):
+        """Drop the cached principal for a user id."""
+        backend = self._backend
+        if backend is not None:
+            backend.delete(int(user_id))
@@ -0,0 +1,276 @@
+"""Log slow SQL statements with where they came from, and explain them."""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import and_, event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+from .tenancy import scoped_tenant_id
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(APP_DIR)
+# Frames in these files are the recording machinery or shared lookups, not
+# the caller.
+SKIPPED_FILES = (os.path.abspath(__file__),
+                 os.path.join(APP_DIR, 'database.py'),
+                 os.path.join(APP_DIR, 'queries.py'))
+
+EXPLAIN_PREFIXES = {'mysql': 'EXPLAIN ', 'postgresql': 'EXPLAIN ',
+                    'sqlite': 'EXPLAIN QUERY PLAN '}
+
+# Runs of placeholders, as rendered for IN lists of any length.
+PLACEHOLDER_LIST = re.compile(
+    r'(\?|%s|%\(\w+\)s|:\w+)(\s*,\s*(\?|%s|%\(\w+\)s|:\w+))+')
+
+_handlers = {}
+_local = threading.local()
+
+
+def fingerprint(statement):
+    """Return the digest of a statement with its IN lists collapsed."""
+    normalized = PLACEHOLDER_LIST.sub('?, ...', ' '.join(statement.split()))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def call_site():
+    """Return 'path:line in function' of the app code running a statement."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename not in SKIPPED_FILES:
+            return '{}:{} in {}'.format(
+                os.path.relpath(filename, ROOT_DIR), frame.f_lineno,
+                frame.f_code.co_name)
+        frame = frame.f_back
+    return None
+
+
+def parameter_types(parameters):
+    """Describe bound parameters by their types, hiding their values.
+
+    Statements carry password hashes, webhook secrets and other tenants'
+    data, so only the types are logged and shown.
+    """
+    if isinstance(parameters, dict):
+        return '{' + ', '.join('{}: {}'.format(key, type(value).__name__)
+                               for key, value in sorted(
+                                   parameters.items())) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__
+                               for value in parameters) + ')'
+    return type(parameters).__name__
+
+
+def _before_execute(conn, cursor, statement, parameters, context,
+                    executemany):
+    if context is not None:
+        context._slow_query_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context,
+                   executemany):
+    start = getattr(context, '_slow_query_start', None)
+    if start is None or not has_app_context() or \
+            getattr(_local, 'recording', False):
+        return
+    elapsed = time.perf_counter() - start
+    recorder = current_app.extensions.get('slow_query_log')
+    if recorder is not None and elapsed >= recorder.threshold:
+        recorder.enqueue({
+            'time': datetime.utcnow(),
+            'duration_ms': round(elapsed * 1000, 1),
+            'statement': statement,
+            'parameters': None if executemany else parameters,
+            'executemany': executemany,
+            'dialect': conn.dialect.name,
+            'endpoint': request.endpoint if has_request_context() else None,
+            'call_site': call_site(),
+            # None outside a tenant's scope, e.g. in job workers.
+            'tenant_id': scoped_tenant_id()
+        })
+
+
+class SlowQueryRecorder(object):
+    """Log, count and explain slow statements from a daemon thread.
+
+    The statement's thread only builds the entry; writing the log, the
+    slow_queries row and running EXPLAIN happen behind it.
+    """
+
+    def __init__(self, app, threshold, path=None, explain=False):
+        self.app = app
+        self.threshold = threshold
+        self.explain = explain
+        self.logger = self._logger(app, path)
+        self._start_lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    @staticmethod
+    def _logger(app, path):
+        if not path:
+            return app.logger
+        logger = logging.getLogger('dreamteam.slow_queries.' + path)
+        if path not in _handlers:
+            _handlers[path] = RotatingFileHandler(
+                path, maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+                backupCount=app.config['SLOW_QUERY_LOG_BACKUPS'])
+            logger.addHandler(_handlers[path])
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        return logger
+
+    def enqueue(self, entry):
+        """Queue an entry, starting this process's thread if needed."""
+        # A thread started before a fork does not run in the child.
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    thread = threading.Thread(target=self._run,
+                                              args=(self._queue,),
+                                              name='slow-query-recorder')
+                    thread.daemon = True
+                    thread.start()
+                    self._pid = os.getpid()
+        self._queue.put(entry)
+
+    def _run(self, entries):
+        _local.recording = True
+        while True:
+            entry = entries.get()
+            try:
+                self.write(entry)
+            except Exception:
+                self.app.logger.exception('Failed to record a slow query')
+            finally:
+                entries.task_done()
+
+    def flush(self):
+        """Wait until every queued entry has been recorded."""
+        if self._queue is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def write(self, entry):
+        """Log an entry and add it to its tenant's slow_queries row.
+
+        The bound values are only used to explain the statement; the log
+        and the row hold their types.
+        """
+        parameters = ('executemany' if entry['executemany'] else
+                      parameter_types(entry['parameters']))[:1000]
+        self.logger.warning('Slow query: %s', json.dumps(dict(
+            entry, parameters=parameters), default=str))
+        # Statements outside a tenant's scope are only logged, so no
+        # tenant's admins see statements touching every tenant.
+        if entry['tenant_id'] is None:
+            return
+
+        from . import db
+        from .models import SlowQuery
+        table = SlowQuery.__table__
+        digest = fingerprint(entry['statement'])
+        key = and_(table.c.tenant_id == entry['tenant_id'],
+                   table.c.digest == digest)
+        sample = {'endpoint': (entry['endpoint'] or '')[:100] or None,
+                  'call_site': (entry['call_site'] or '')[:200] or None,
+                  'parameters': parameters}
+        with self.app.app_context():
+            row = db.engine.execute(select([table.c.id, table.c.plan]).where(
+                key)).first()
+            if row is None:
+                try:
+                    db.engine.execute(table.insert().values(
+                        tenant_id=entry['tenant_id'], digest=digest,
+                        statement=entry['statement'], count=1,
+                        total_ms=entry['duration_ms'],
+                        max_ms=entry['duration_ms'],
+                        first_seen=entry['time'], last_seen=entry['time'],
+                        **sample))
+                except IntegrityError:
+                    # Another worker inserted the row since it was read.
+                    row = db.engine.execute(select([
+                        table.c.id, table.c.plan]).where(key)).first()
+            if row is not None:
+                # Single statements, so concurrent workers cannot lose
+                # each other's counts.
+                db.engine.execute(table.update().where(key).values(
+                    count=table.c.count + 1,
+                    total_ms=table.c.total_ms + entry['duration_ms'],
+                    last_seen=entry['time']))
+                db.engine.execute(table.update().where(and_(
+                    key, table.c.max_ms < entry['duration_ms'])).values(
+                    max_ms=entry['duration_ms'], **sample))
+            if row is None or row.plan is None:
+                plan = self.explain_plan(entry)
+                if plan is not None:
+                    db.engine.execute(table.update().where(key).values(
+                        plan=plan))
+
+    def explain_plan(self, entry):
+        """Return the database's plan for a logged SELECT, or None."""
+        from . import db
+        prefix = EXPLAIN_PREFIXES.get(entry['dialect'])
+        if not self.explain or prefix is None or entry['executemany'] or \
+                not entry['statement'].lstrip().upper().startswith('SELECT'):
+            return None
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(prefix + entry['statement'],
+                           entry['parameters'] or ())
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchall()
+            connection.rollback()
+        except Exception as exc:
+            return 'EXPLAIN failed: {}'.format(exc)
+        finally:
+            connection.close()
+        return '\n'.join(', '.join('{}={}'.format(column, value)
+                                   for column, value in zip(columns, row))
+                         for row in rows)
+
+
+class SlowQueryLog(object):
+    """Record statements slower than SLOW_QUERY_THRESHOLD seconds.
+
+    Each is logged with its parameters, the endpoint and the line of app
+    code that ran it, to SLOW_QUERY_LOG_FILE (rotated) or the app log, and
+    counted in slow_queries for the admin Slow Queries page. With
+    SLOW_QUERY_EXPLAIN, the first run of each SELECT is also explained.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Start timing statements if the app sets a threshold."""
+        threshold = app.config.get('SLOW_QUERY_THRESHOLD')
+        if threshold is None:
+            return
+        app.extensions['slow_query_log'] = SlowQueryRecorder(
+            app, threshold, path=app.config.get('SLOW_QUERY_LOG_FILE'),
+            explain=app.config.get('SLOW_QUERY_EXPLAIN'))
+        if not event.contains(Engine, 'before_cursor_execute',
+                              _before_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_execute)
+
+    def flush(self):
+        """Wait until the queued slow statements have been recorded."""
+        recorder = current_app.extensions.get('slow_query_log')
+        if recorder is not None:
+            recorder.flush()
@@ -0,0 +1,159 @@
+"""Daily headcount snapshots, downsampled with age, for dashboard trends.
+
+Snapshots are taken and downsampled for the scoped tenant, see
+app.tenancy.tenant_scope.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, func, or_
+
+from . import db
+from .history import headcount_as_of
+from .models import Assignment, HeadcountSnapshot
+from .tenancy import current_tenant_id
+
+snapshots = HeadcountSnapshot.__table__
+
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+TOTAL = 'total'
+DIMENSIONS = (('department', Assignment.department_id),
+              ('role', Assignment.role_id))
+
+COLORS = ('#aec251', '#337ab7', '#d9534f', '#f0ad4e', '#5bc0de', '#687430',
+          '#777777', '#9b59b6')
+
+
+def take_snapshot(day):
+    """Write the headcounts at the end of a day, replacing any already there.
+
+    Counts come from the assignment history, so past days can be filled in.
+    Returns the number of rows written.
+    """
+    moment = datetime.combine(day, time.max)
+    tenant_id = current_tenant_id()
+    rows = []
+    for dimension, column in DIMENSIONS:
+        counts = headcount_as_of(moment, column)
+        rows.extend(dict(tenant_id=tenant_id, day=day, period=DAY,
+                         dimension=dimension, group_id=group_id,
+                         headcount=headcount)
+                    for group_id, headcount in counts.items())
+    # Every assignment falls in exactly one group of each dimension.
+    rows.append(dict(tenant_id=tenant_id, day=day, period=DAY,
+                     dimension=TOTAL, group_id=None,
+                     headcount=sum(counts.values())))
+    db.session.execute(snapshots.delete().where(and_(
+        snapshots.c.tenant_id == tenant_id, snapshots.c.day == day,
+        snapshots.c.period == DAY)))
+    db.session.execute(snapshots.insert(), rows)
+    return len(rows)
+
+
+def _period_start(day, period):
+    if period == WEEK:
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _collapse(source, target, cutoff):
+    # Only periods that start before the cutoff's period are complete.
+    cutoff = _period_start(cutoff, target)
+    first = db.session.query(func.min(HeadcountSnapshot.day)).filter(
+        HeadcountSnapshot.period == source,
+        HeadcountSnapshot.day < cutoff).scalar()
+    if first is None:
+        return 0
+
+    tenant_id = current_tenant_id()
+    old = and_(snapshots.c.tenant_id == tenant_id,
+               snapshots.c.period.in_((source, target)),
+               snapshots.c.day >= _period_start(first, target),
+               snapshots.c.day < cutoff)
+    rows = db.session.execute(snapshots.select().where(old)).fetchall()
+    # A row already downsampled counts as one sample of its period.
+    sums = defaultdict(lambda: [0, 0])
+    for row in rows:
+        key = (_period_start(row.day, target), row.dimension, row.group_id)
+        sums[key][0] += row.headcount
+        sums[key][1] += 1
+    db.session.execute(snapshots.delete().where(old))
+    db.session.execute(snapshots.insert(), [
+        dict(tenant_id=tenant_id, day=day, period=target,
+             dimension=dimension, group_id=group_id,
+             headcount=int(round(total / float(samples))))
+        for (day, dimension, group_id), (total, samples) in sums.items()])
+    return len(rows)
+
+
+def downsample(today):
+    """Average daily rows into weeks, then weekly rows into months.
+
+    Days older than HEADCOUNT_DAILY_DAYS become one row per week, and weeks
+    older than HEADCOUNT_WEEKLY_DAYS one row per month, so a long trend
+    stays a few hundred rows. Returns the number of rows merged.
+    """
+    config = current_app.config
+    return (_collapse(DAY, WEEK, today - timedelta(
+                days=config['HEADCOUNT_DAILY_DAYS'])) +
+            _collapse(WEEK, MONTH, today - timedelta(
+                days=config['HEADCOUNT_WEEKLY_DAYS'])))
+
+
+def trend(dimension, since, limit=None):
+    """Return [(group id, [(day, headcount), ...]), ...] since a day.
+
+    With limit, only the groups with the largest latest headcount are
+    returned, biggest first.
+    """
+    query = db.session.query(HeadcountSnapshot.group_id).filter(
+        HeadcountSnapshot.dimension == dimension)
+    group_ids = None
+    if limit is not None:
+        latest = db.session.query(func.max(HeadcountSnapshot.day)).filter(
+            HeadcountSnapshot.dimension == dimension).scalar()
+        group_ids = [row[0] for row in query.filter(
+            HeadcountSnapshot.day == latest).order_by(
+            HeadcountSnapshot.headcount.desc()).limit(limit)]
+
+    rows = db.session.query(
+        HeadcountSnapshot.group_id, HeadcountSnapshot.day,
+        HeadcountSnapshot.headcount).filter(
+        HeadcountSnapshot.dimension == dimension,
+        HeadcountSnapshot.day >= since)
+    if group_ids is not None:
+        condition = HeadcountSnapshot.group_id.in_(group_ids)
+        if None in group_ids:
+            condition = or_(condition, HeadcountSnapshot.group_id.is_(None))
+        rows = rows.filter(condition)
+    series = defaultdict(list)
+    for group_id, day, headcount in rows.order_by(HeadcountSnapshot.day):
+        series[group_id].append((day, headcount))
+    order = group_ids if group_ids is not None else sorted(
+        series, key=lambda group_id: (group_id is None, group_id))
+    return [(group_id, series[group_id]) for group_id in order
+            if group_id in series]
+
+
+def line_chart(series, labels, start, end, width=600, height=200):
+    """Lay out series as SVG polylines scaled to a shared axis."""
+    peak = max([headcount for group_id, points in series
+                for day, headcount in points] or [0]) or 1
+    span = float((end - start).days) or 1.0
+    lines = []
+    for number, (group_id, points) in enumerate(series):
+        lines.append({
+            'label': labels.get(group_id, 'None'),
+            'color': COLORS[number % len(COLORS)],
+            'points': ' '.join(
+                '{:.1f},{:.1f}'.format(
+                    (day - start).days / span * width,
+                    height - headcount / float(peak) * height)
+                for day, headcount in points)
+        })
+    return {'lines': lines, 'peak': peak, 'width': width, 'height': height,
+            'start': start, 'end': end}
@@ -0,0 +1,46 @@
+"""Streamed rendering of listing pages."""
+
+import itertools
+
+from flask import (Response, current_app, get_flashed_messages,
+                   stream_with_context, url_for)
+
+# Sentinel id substituted into URLs built by url_template.
+_PLACEHOLDER = 2147483647
+
+
+class RowStream(object):
+    """Lazily iterate over query rows while letting templates test for any."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._head = []
+
+    def __bool__(self):
+        if not self._head:
+            try:
+                self._head.append(next(self._rows))
+            except StopIteration:
+                return False
+        return True
+
+    def __iter__(self):
+        head, self._head = self._head, []
+        return itertools.chain(head, self._rows)
+
+
+def url_template(endpoint, param='id'):
+    """Build a URL once with a {param} placeholder for per-row formatting."""
+    url = url_for(endpoint, **{param: _PLACEHOLDER})
+    return url.replace(str(_PLACEHOLDER), '{' + param + '}')
+
+
+def stream_template(template_name, **context):
+    """Render a template into a response sent as it is generated."""
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    # Pop flashed messages now, while the session can still be saved.
+    get_flashed_messages(with_categories=True)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(app.config.get('STREAM_BUFFER_SIZE', 100))
+    return Response(stream_with_context(stream))
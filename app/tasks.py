@@ -0,0 +1,74 @@
+"""Bulk admin operations run as background jobs."""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from . import db, job_queue
+from .archive import archive_inactive
+from .hierarchy import hierarchy, rebuild_hierarchy
+from .models import Department, Employee, Tenant
+from .snapshots import downsample, take_snapshot
+from .tenancy import tenant_scope
+
+# Employees updated per commit by bulk tasks.
+CHUNK_SIZE = 500
+
+
+@job_queue.task()
+def rebuild_org_chart(job):
+    """Recompute the reporting-line closure table from manager ids."""
+    job.progress(0, 1, 'Rebuilding reporting lines')
+    rebuild_hierarchy()
+    links = db.session.query(db.func.count()).select_from(hierarchy).scalar()
+    job.progress(1, 1, 'Rebuilt {} reporting links'.format(links))
+    return {'links': links}
+
+
+@job_queue.task()
+def reassign_department(job, from_id, to_id):
+    """Move every employee of one department to another."""
+    if Department.query.get(to_id) is None:
+        raise ValueError('Department {} does not exist'.format(to_id))
+    ids = [row[0] for row in db.session.query(Employee.id).filter(
+        Employee.department_id == from_id).order_by(Employee.id)]
+    job.progress(0, len(ids))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        # Loaded through the ORM so the change events are recorded.
+        for employee in Employee.query.filter(Employee.id.in_(chunk)):
+            employee.department_id = to_id
+        job.progress(start + len(chunk))
+    return {'moved': len(ids)}
+
+
+@job_queue.task()
+def archive_employees(job, days=None):
+    """Move employees inactive for more than days to employees_archive."""
+    if days is None:
+        days = current_app.config['EMPLOYEE_ARCHIVE_AFTER_DAYS']
+    before = datetime.utcnow() - timedelta(days=days)
+    return {'archived': archive_inactive(before, progress=job.progress)}
+
+
+@job_queue.task(every=timedelta(hours=1))
+def snapshot_headcount(job, days=2, tenant_id=None):
+    """Snapshot the headcounts of the last days and downsample older ones.
+
+    Every tenant is snapshotted unless tenant_id is given.
+    """
+    today = datetime.utcnow().date()
+    if tenant_id is None:
+        tenant_ids = [row[0] for row in db.session.query(Tenant.id).order_by(
+            Tenant.id)]
+    else:
+        tenant_ids = [tenant_id]
+    merged = 0
+    for number, tenant_id in enumerate(tenant_ids):
+        with tenant_scope(tenant_id):
+            for day in range(days):
+                take_snapshot(today - timedelta(days=days - 1 - day))
+            merged += downsample(today)
+            db.session.commit()
+        job.progress(number + 1, len(tenant_ids))
+    return {'tenants': len(tenant_ids), 'days': days, 'merged': merged}
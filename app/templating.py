@@ -0,0 +1,44 @@
+"""Template bytecode caching and warmup."""
+
+import os
+import stat
+
+from jinja2 import FileSystemBytecodeCache
+
+
+def private_directory(path):
+    """Create a directory only the current user can use, or check one.
+
+    The bytecode cache runs the code it finds, so a directory another user
+    created or can write to is refused with a ValueError.
+    """
+    try:
+        os.makedirs(path, mode=0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or \
+            info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError('{} must be a directory owned by this user and '
+                         'writable only by it.'.format(path))
+    return path
+
+
+def init_templates(app):
+    """Set up the bytecode cache and optionally precompile templates."""
+    cache_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if cache_dir:
+        cache_dir = private_directory(os.path.join(app.instance_path,
+                                                   cache_dir))
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            cache_dir, '__dreamteam_%s.cache')
+    if app.config.get('TEMPLATE_WARMUP'):
+        warm_templates(app)
+
+
+def warm_templates(app):
+    """Compile every HTML template so no request pays for it."""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
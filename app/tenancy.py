@@ -0,0 +1,136 @@
+"""Many organizations, or tenants, served from one deployment."""
+
+from contextlib import contextmanager
+
+import click
+from flask import abort, current_app, g, has_app_context, request
+from flask.cli import AppGroup
+from sqlalchemy import Integer, bindparam, event, or_
+from sqlalchemy.orm import Query
+
+# The tenant that single-tenant deployments and pre-tenancy rows belong to.
+DEFAULT_TENANT_ID = 1
+
+
+def scoped_tenant_id():
+    """Return the tenant queries are scoped to, or None if unscoped."""
+    return g.get('tenant_id') if has_app_context() else None
+
+
+def current_tenant_id():
+    """Return the tenant new rows belong to."""
+    tenant_id = scoped_tenant_id()
+    return tenant_id if tenant_id is not None else DEFAULT_TENANT_ID
+
+
+@contextmanager
+def tenant_scope(tenant_id):
+    """Scope queries and new rows to a tenant outside of a request."""
+    previous = g.get('tenant_id')
+    g.tenant_id = tenant_id
+    try:
+        yield
+    finally:
+        g.tenant_id = previous
+
+
+# Read when each statement runs rather than when it is compiled, so cached
+# statements such as the baked lazy loads stay correct for every tenant.
+_tenant = bindparam('scoped_tenant_id', type_=Integer,
+                    callable_=scoped_tenant_id)
+
+
+@event.listens_for(Query, 'before_compile', retval=True)
+def _scope_to_tenant(query):
+    """Limit ORM queries of models with a tenant_id to the scoped tenant.
+
+    Only the query's first entity is filtered: rows joined to it through
+    foreign keys belong to the same tenant, and outer joins keep their
+    NULL rows. Unscoped code, such as the job workers between jobs, sees
+    every tenant. Core statements are not filtered and must name the
+    tenant themselves.
+    """
+    entity = query.column_descriptions[0]['entity']
+    if entity is not None and hasattr(entity, 'tenant_id'):
+        query = query.enable_assertions(False).filter(or_(
+            _tenant.is_(None), entity.tenant_id == _tenant))
+    return query
+
+
+class Tenancy(object):
+    """Resolve the tenant of each request from its host name.
+
+    With TENANT_DOMAIN set, <slug>.<TENANT_DOMAIN> is served as the tenant
+    with that slug and the bare domain as the default tenant; other hosts
+    get a 404. Without it every request belongs to the default tenant.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Resolve tenants for an app's requests."""
+        app.extensions['tenancy'] = {'ids': {}, 'exempt': set()}
+        app.before_request(self._resolve)
+        app.teardown_request(self._clear)
+        app.cli.add_command(tenants_cli)
+
+    def exempt(self, app, *endpoints):
+        """Serve endpoints to any host without resolving a tenant."""
+        app.extensions['tenancy']['exempt'].update(endpoints)
+
+    def tenant_id(self, host):
+        """Return the id of the tenant a host name belongs to, or None."""
+        domain = current_app.config.get('TENANT_DOMAIN')
+        host = host.split(':')[0].lower()
+        if not domain or host == domain:
+            return DEFAULT_TENANT_ID
+        if not host.endswith('.' + domain):
+            return None
+        slug = host[:-len(domain) - 1]
+        ids = current_app.extensions['tenancy']['ids']
+        if slug not in ids:
+            from .models import Tenant
+            tenant = Tenant.query.filter_by(slug=slug).first()
+            if tenant is None:
+                return None
+            # Only known slugs are cached, so unknown hosts cannot grow it.
+            ids[slug] = tenant.id
+        return ids[slug]
+
+    def _resolve(self):
+        if request.endpoint in current_app.extensions['tenancy']['exempt']:
+            return
+        tenant_id = self.tenant_id(request.host)
+        if tenant_id is None:
+            abort(404)
+        g.tenant_id = tenant_id
+
+    def _clear(self, exc):
+        g.pop('tenant_id', None)
+
+
+tenants_cli = AppGroup('tenants', help='Manage the tenants.')
+
+
+@tenants_cli.command('create')
+@click.argument('slug')
+@click.argument('name')
+def create_command(slug, name):
+    """Add a tenant served at SLUG.<TENANT_DOMAIN>."""
+    from . import db
+    from .models import Tenant
+    tenant = Tenant(slug=slug.lower(), name=name)
+    db.session.add(tenant)
+    db.session.commit()
+    click.echo('Created tenant {} ({}).'.format(tenant.id, tenant.slug))
+
+
+@tenants_cli.command('list')
+def list_command():
+    """List the tenants."""
+    from .models import Tenant
+    for tenant in Tenant.query.order_by(Tenant.id):
+        click.echo('{:>6}  {:<30} {}'.format(tenant.id, tenant.slug,
+                                             tenant.name))
@@ -0,0 +1,198 @@
+"""Signed bearer tokens for API clients, checked without a database read."""
+
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import event, inspect, select
+
+from .sessions import Principal
+from .tenancy import current_tenant_id
+
+SALT = 'access-token'
+
+# Changes to these employee columns revoke the employee's tokens.
+REVOKING_COLUMNS = ('is_admin', 'is_active', 'password_hash')
+
+
+def bearer_token(request):
+    """Return the token of a request's Authorization header, or None."""
+    scheme, _, token = request.headers.get('Authorization',
+                                           '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+class RevocationList(object):
+    """One worker's copy of the unexpired token revocations."""
+
+    def __init__(self):
+        self.tokens = frozenset()
+        self.employees = {}
+        # Everything issued before this Unix time, as after a restore.
+        self.everyone = 0
+        self.next_refresh = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, interval):
+        """Reload the revocations if they are older than interval seconds.
+
+        One thread reloads them while the others keep using the old copy.
+        """
+        if time.time() < self.next_refresh or \
+                not self._lock.acquire(blocking=False):
+            return
+        try:
+            from . import db
+            from .models import RevokedToken
+            table = RevokedToken.__table__
+            rows = db.session.execute(select([
+                table.c.jti, table.c.employee_id,
+                table.c.issued_before]).where(
+                table.c.expires_at > datetime.utcnow())).fetchall()
+            employees = {}
+            everyone = 0
+            for row in rows:
+                if row.employee_id is not None:
+                    employees[row.employee_id] = max(
+                        row.issued_before, employees.get(row.employee_id, 0))
+                elif row.jti is None:
+                    everyone = max(row.issued_before, everyone)
+            self.tokens = frozenset(row.jti for row in rows if row.jti)
+            self.employees = employees
+            self.everyone = everyone
+            self.next_refresh = time.time() + interval
+        finally:
+            self._lock.release()
+
+    def revoked(self, employee_id, issued_at):
+        """Return whether a credential issued at a Unix time is revoked."""
+        return issued_at <= max(self.everyone,
+                                self.employees.get(employee_id, 0))
+
+    def __contains__(self, claims):
+        return claims['jti'] in self.tokens or \
+            self.revoked(claims['id'], claims['iat'])
+
+
+def _revoke_changed_employees(session, flush_context):
+    from .models import Employee, RevokedToken
+    ids = [employee.id for employee in session.deleted
+           if isinstance(employee, Employee)]
+    ids.extend(employee.id for employee in session.dirty
+               if isinstance(employee, Employee) and any(
+                   inspect(employee).attrs[key].history.has_changes()
+                   for key in REVOKING_COLUMNS))
+    if ids:
+        now = time.time()
+        expires_at = datetime.utcnow() + timedelta(
+            seconds=current_app.config['ACCESS_TOKEN_TTL'])
+        session.execute(RevokedToken.__table__.insert(), [
+            {'employee_id': employee_id, 'issued_before': now,
+             'expires_at': expires_at} for employee_id in ids])
+        # This worker rereads them on its next check, committed or not.
+        current_app.extensions['access_tokens'].next_refresh = 0
+
+
+class AccessTokens(object):
+    """Issue and check the bearer tokens of API clients.
+
+    A token is signed with SECRET_KEY and carries the employee's id,
+    tenant, username and admin flag, so a request presenting it in an
+    'Authorization: Bearer' header is authenticated without reading the
+    employees table. Tokens expire after ACCESS_TOKEN_TTL seconds. A
+    revoked token, or any token of an employee whose admin flag, status or
+    password has changed, is rejected once each worker has reloaded the
+    small revoked_tokens table, at most ACCESS_TOKEN_REVOCATION_REFRESH
+    seconds later.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Keep a revocation list for an app."""
+        from . import db
+        app.extensions['access_tokens'] = RevocationList()
+        if not event.contains(db.session, 'after_flush',
+                              _revoke_changed_employees):
+            event.listen(db.session, 'after_flush',
+                         _revoke_changed_employees)
+
+    @staticmethod
+    def _serializer():
+        return URLSafeTimedSerializer(current_app.secret_key, salt=SALT)
+
+    def issue(self, employee):
+        """Return a new token for an employee."""
+        return self._serializer().dumps({
+            'id': employee.id, 'tid': employee.tenant_id,
+            'usr': employee.username, 'adm': bool(employee.is_admin),
+            'jti': secrets.token_hex(16), 'iat': time.time()})
+
+    def claims(self, token):
+        """Return the claims of a valid, unexpired token, or None."""
+        try:
+            return self._serializer().loads(
+                token, max_age=current_app.config['ACCESS_TOKEN_TTL'])
+        except BadSignature:
+            return None
+
+    def load(self, request):
+        """Return the principal of a request's bearer token, or None."""
+        token = bearer_token(request)
+        claims = None if token is None else self.claims(token)
+        # A token must not carry an employee into another tenant.
+        if claims is None or claims['tid'] != current_tenant_id():
+            return None
+        if claims in self.revocations():
+            return None
+        return Principal(id=claims['id'], tenant_id=claims['tid'],
+                         username=claims.get('usr'), is_admin=claims['adm'])
+
+    @staticmethod
+    def revocations():
+        """Return this worker's revocation list, reloaded if it is stale."""
+        revocations = current_app.extensions['access_tokens']
+        revocations.refresh(
+            current_app.config['ACCESS_TOKEN_REVOCATION_REFRESH'])
+        return revocations
+
+    def revoke(self, token):
+        """Revoke a token for every worker; returns False if it is invalid."""
+        from . import db
+        from .models import RevokedToken
+        claims = self.claims(token)
+        if claims is None:
+            return False
+        RevokedToken.query.filter(
+            RevokedToken.expires_at < datetime.utcnow()).delete(
+            synchronize_session=False)
+        db.session.add(RevokedToken(
+            jti=claims['jti'], expires_at=datetime.utcfromtimestamp(
+                claims['iat'] + current_app.config['ACCESS_TOKEN_TTL'])))
+        db.session.commit()
+        current_app.extensions['access_tokens'].next_refresh = 0
+        return True
+
+    @staticmethod
+    def revoke_everyone():
+        """Revoke every token and signed-in session issued until now.
+
+        The revocation is added to the current transaction and lasts as long
+        as a token or a permanent session can.
+        """
+        from . import db
+        from .models import RevokedToken
+        lifetime = max(
+            timedelta(seconds=current_app.config['ACCESS_TOKEN_TTL']),
+            current_app.permanent_session_lifetime)
+        db.session.add(RevokedToken(
+            issued_before=time.time(),
+            expires_at=datetime.utcnow() + lifetime))
+        current_app.extensions['access_tokens'].next_refresh = 0
@@ -0,0 +1,338 @@
+"""Webhooks sent batches of outbox changes by a pool of sender threads."""
+
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import json
+import secrets
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, exists, func, or_
+
+from .tenancy import current_tenant_id
+
+ENTITIES = ('employees', 'departments', 'roles')
+
+# Seconds between deletions of deliveries older than WEBHOOK_DELIVERY_DAYS.
+PRUNE_INTERVAL = 3600
+
+# Errors from a kept-alive connection the server closed while it was idle.
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError,
+                ConnectionResetError)
+
+
+def sign(secret, body):
+    """Return the X-Webhook-Signature header value for a request body."""
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), body,
+                                hashlib.sha256).hexdigest()
+
+
+class UnsafeURLError(ValueError):
+    """Raised when a webhook's host does not resolve to a public address."""
+
+
+def checked_address(host, port, allowed=()):
+    """Resolve a webhook's host and return an address it may be sent to.
+
+    Loopback, link-local, private and other non-public addresses are
+    refused unless they are in one of the allowed networks, so a webhook
+    cannot reach the metadata service or hosts inside the network.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as exc:
+        raise UnsafeURLError('{} does not resolve: {}'.format(host, exc))
+    networks = [ipaddress.ip_network(network) for network in allowed]
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not address.is_global and \
+                not any(address in network for network in networks):
+            raise UnsafeURLError('{} resolves to {}, which is not a public '
+                                 'address.'.format(host, address))
+    return infos[0][4][0]
+
+
+class Connections(threading.local):
+    """The kept-alive connections of one sender thread, by scheme and host."""
+
+    def __init__(self):
+        self.open = {}
+
+    def post(self, url, body, headers, timeout):
+        """POST body to url and return the response status.
+
+        A kept-alive connection the server has since closed is retried once
+        on a new connection.
+        """
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        while True:
+            connection = self.open.pop(key, None)
+            reused = connection is not None
+            if not reused:
+                # Checked on every new connection, and the socket goes to
+                # the checked address, so a host that resolved to a public
+                # address when it was added cannot be rebound to another.
+                address = checked_address(
+                    parts.hostname, parts.port or (
+                        443 if parts.scheme == 'https' else 80),
+                    current_app.config['WEBHOOK_ALLOWED_NETWORKS'])
+                connection = (http.client.HTTPSConnection
+                              if parts.scheme == 'https' else
+                              http.client.HTTPConnection)(parts.netloc,
+                                                          timeout=timeout)
+                connection._create_connection = \
+                    lambda target, *args: socket.create_connection(
+                        (address, target[1]), *args)
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                response.read()
+            except Exception as exc:
+                connection.close()
+                if reused and isinstance(exc, STALE_ERRORS):
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self.open[key] = connection
+            return response.status
+
+    def close(self):
+        """Close this thread's connections."""
+        while self.open:
+            self.open.popitem()[1].close()
+
+
+class WebhookDispatcher(object):
+    """Send outbox changes to webhooks from `flask webhooks dispatch`.
+
+    A webhook is sent its changes once one has waited WEBHOOK_BATCH_WINDOW
+    seconds, so a burst of writes reaches each endpoint as a few batches of
+    up to WEBHOOK_BATCH_SIZE changes. Its cursor is a change sequence, which
+    follows commit order, so a change committing late is sent after the
+    ones read before it rather than skipped. A webhook is leased with a conditional UPDATE while
+    its batch is in flight, so dispatchers on several hosts can share the
+    table. A failed batch is retried with exponential backoff rather than
+    skipped: endpoints get every change at least once, in order.
+    """
+
+    def __init__(self, app=None):
+        self.connections = Connections()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Register the `flask webhooks` commands."""
+        app.extensions['webhooks'] = self
+        app.cli.add_command(webhooks_cli)
+
+    def add(self, url, entities=()):
+        """Add a webhook for the changes made from now on and return it."""
+        from . import db
+        from .models import ChangeEvent, Webhook
+        from .outbox import sequence_changes
+        tenant_id = current_tenant_id()
+        sequence_changes()
+        cursor = db.session.query(func.max(ChangeEvent.seq)).filter(
+            ChangeEvent.tenant_id == tenant_id).scalar()
+        webhook = Webhook(tenant_id=tenant_id, url=url,
+                          secret=secrets.token_hex(32),
+                          entities=','.join(entities), is_active=True,
+                          cursor=cursor or 0, failures=0,
+                          created_at=datetime.utcnow())
+        db.session.add(webhook)
+        return webhook
+
+    def due(self):
+        """Return the ids of the active webhooks with changes to send."""
+        from . import db
+        from .models import ChangeEvent, Webhook
+        from .outbox import sequence_changes
+        sequence_changes()
+        now = datetime.utcnow()
+        ready = now - timedelta(
+            seconds=current_app.config['WEBHOOK_BATCH_WINDOW'])
+        pending = exists().where(and_(
+            ChangeEvent.tenant_id == Webhook.tenant_id,
+            ChangeEvent.seq > Webhook.cursor,
+            ChangeEvent.created_at <= ready))
+        ids = [row[0] for row in db.session.query(Webhook.id).filter(
+            Webhook.is_active == db.true(),
+            or_(Webhook.next_attempt_at.is_(None),
+                Webhook.next_attempt_at <= now),
+            or_(Webhook.leased_until.is_(None), Webhook.leased_until < now),
+            pending).order_by(Webhook.id)]
+        db.session.commit()
+        return ids
+
+    def deliver(self, webhook_id):
+        """Send a webhook's next batch of changes and record the attempt.
+
+        Returns the delivery, or None if another dispatcher holds the
+        webhook or none of its pending changes are for its entities.
+        """
+        from . import db
+        from .models import ChangeEvent, Webhook, WebhookDelivery
+        from .outbox import describe
+        config = current_app.config
+        now = datetime.utcnow()
+        timeout = config['WEBHOOK_TIMEOUT']
+        # A stale connection is retried once, so the lease outlasts two
+        # timeouts.
+        leased = Webhook.query.filter(
+            Webhook.id == webhook_id,
+            or_(Webhook.leased_until.is_(None),
+                Webhook.leased_until < now)).update(
+            {Webhook.leased_until: now + timedelta(seconds=3 * timeout)},
+            synchronize_session=False)
+        db.session.commit()
+        if not leased:
+            return None
+
+        webhook = Webhook.query.get(webhook_id)
+        # Every pending change goes, young or not: skipping one would move
+        # the cursor past it.
+        changes = ChangeEvent.query.filter(
+            ChangeEvent.tenant_id == webhook.tenant_id,
+            ChangeEvent.seq > webhook.cursor).order_by(
+            ChangeEvent.seq).limit(config['WEBHOOK_BATCH_SIZE']).all()
+        entities = set(filter(None, (webhook.entities or '').split(',')))
+        batch = [describe(change) for change in changes
+                 if not entities or change.entity in entities]
+
+        values = {Webhook.leased_until: None}
+        delivery = None
+        if batch:
+            body = json.dumps({'webhook_id': webhook.id, 'changes': batch},
+                              default=str).encode('utf-8')
+            headers = {'Content-Type': 'application/json',
+                       'User-Agent': 'dream-team-webhooks',
+                       'X-Webhook-Signature': sign(webhook.secret, body)}
+            status = error = None
+            started = time.time()
+            try:
+                status = self.connections.post(webhook.url, body, headers,
+                                               timeout)
+            except Exception as exc:
+                error = '{}: {}'.format(type(exc).__name__, exc)[:200]
+            succeeded = status is not None and 200 <= status < 300
+            delivery = WebhookDelivery(
+                webhook_id=webhook.id, created_at=now,
+                first_change_id=batch[0]['id'],
+                last_change_id=batch[-1]['id'], changes=len(batch),
+                status_code=status, error=error,
+                duration_ms=int((time.time() - started) * 1000),
+                succeeded=succeeded)
+            db.session.add(delivery)
+        if delivery is None or delivery.succeeded:
+            if changes:
+                values[Webhook.cursor] = changes[-1].seq
+            values.update({Webhook.failures: 0,
+                           Webhook.next_attempt_at: None})
+        else:
+            failures = webhook.failures + 1
+            delay = min(config['WEBHOOK_RETRY_DELAY'] * 2 ** (failures - 1),
+                        config['WEBHOOK_MAX_RETRY_DELAY'])
+            values.update({Webhook.failures: failures,
+                           Webhook.next_attempt_at: now + timedelta(
+                               seconds=delay)})
+            current_app.logger.warning(
+                'Webhook %d failed (%s), retrying in %ds', webhook.id,
+                delivery.error or delivery.status_code, delay)
+        Webhook.query.filter(Webhook.id == webhook_id).update(
+            values, synchronize_session=False)
+        db.session.commit()
+        return delivery
+
+    def run_pending(self):
+        """Send a batch to every due webhook in this thread.
+
+        Returns the deliveries made.
+        """
+        deliveries = (self.deliver(webhook_id) for webhook_id in self.due())
+        return [delivery for delivery in deliveries if delivery is not None]
+
+    def prune(self):
+        """Delete the deliveries older than WEBHOOK_DELIVERY_DAYS."""
+        from . import db
+        from .models import WebhookDelivery
+        cutoff = datetime.utcnow() - timedelta(
+            days=current_app.config['WEBHOOK_DELIVERY_DAYS'])
+        deleted = WebhookDelivery.query.filter(
+            WebhookDelivery.created_at < cutoff).delete(
+            synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    def dispatch(self, threads, stopping=None, burst=False):
+        """Send due batches from a pool of threads until stopping is set.
+
+        Each webhook has at most one batch in flight, so a slow endpoint
+        holds one thread rather than delaying the others. With burst, it
+        returns once no webhook is due.
+        """
+        app = current_app._get_current_object()
+        stopping = stopping or threading.Event()
+        interval = app.config['WEBHOOK_POLL_INTERVAL']
+        in_flight = {}
+        next_prune = 0
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while not stopping.is_set():
+                for webhook_id, future in list(in_flight.items()):
+                    if future.done():
+                        del in_flight[webhook_id]
+                with app.app_context():
+                    if time.time() >= next_prune:
+                        self.prune()
+                        next_prune = time.time() + PRUNE_INTERVAL
+                    due = [webhook_id for webhook_id in self.due()
+                           if webhook_id not in in_flight]
+                for webhook_id in due:
+                    in_flight[webhook_id] = pool.submit(
+                        self._deliver, app, webhook_id)
+                if burst and not due:
+                    if not in_flight:
+                        return
+                    for future in list(in_flight.values()):
+                        future.result()
+                    continue
+                stopping.wait(interval)
+
+    def _deliver(self, app, webhook_id):
+        with app.app_context():
+            try:
+                self.deliver(webhook_id)
+            except Exception:
+                app.logger.exception('Webhook %d could not be sent',
+                                     webhook_id)
+
+
+webhooks_cli = AppGroup('webhooks', help='Send changes to webhooks.')
+
+
+@webhooks_cli.command('dispatch')
+@click.option('--threads', '-t', type=int, default=None,
+              help='Number of sender threads (WEBHOOK_THREADS).')
+@click.option('--burst', is_flag=True,
+              help='Exit once no webhook has changes to send.')
+def dispatch_command(threads, burst):
+    """Send pending changes to the webhooks."""
+    threads = threads or current_app.config['WEBHOOK_THREADS']
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+    click.echo('Sending webhooks from {} thread(s).'.format(threads))
+    current_app.extensions['webhooks'].dispatch(threads, stopping, burst)
@@ -0,0 +1,99 @@
+"""Benchmark as-of and range queries on a multi-year assignment history.
+
+Generates --employees employees whose department and role change every
+two months to a year over --years years, then times the history queries
+with the assignment_history indexes and again without them.
+
+    python benchmarks/bench_assignments.py --employees 100000 --years 5
+"""
+
+import random
+from datetime import datetime, timedelta
+
+from common import make_app, parser, timed
+
+DEPARTMENTS = 20
+ROLES = 10
+BATCH = 5000
+
+
+def build(db, employees, assignments, count, years, end_of_time):
+    random.seed(2019)
+    now = datetime.utcnow()
+    start = now - timedelta(days=365 * years)
+    rows = []
+    for number in range(1, count + 1):
+        moment = start + timedelta(days=random.uniform(0, 365))
+        while moment < now:
+            until = moment + timedelta(days=random.uniform(60, 365))
+            rows.append(dict(employee_id=number,
+                             department_id=random.randint(1, DEPARTMENTS),
+                             role_id=random.randint(1, ROLES),
+                             valid_from=moment,
+                             valid_to=until if until < now else end_of_time))
+            moment = until
+    for first in range(1, count + 1, BATCH):
+        db.session.execute(employees.insert(), [
+            dict(id=number, username='employee{}'.format(number),
+                 first_name='Employee', last_name=str(number))
+            for number in range(first, min(first + BATCH, count + 1))])
+    for first in range(0, len(rows), BATCH):
+        db.session.execute(assignments.insert(), rows[first:first + BATCH])
+    db.session.commit()
+    return len(rows)
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--employees', type=int, default=100000)
+    args_parser.add_argument('--years', type=int, default=5)
+    args = args_parser.parse_args()
+
+    app = make_app(args.database_uri)
+    from app import db
+    from app.history import (END_OF_TIME, assignment_history,
+                             assignments_as_of, assignments_between,
+                             headcount_as_of)
+    from app.models import Assignment, Employee
+
+    with app.app_context():
+        rows = timed('generate {} employees over {} years'.format(
+            args.employees, args.years),
+            lambda: build(db, Employee.__table__, Assignment.__table__,
+                          args.employees, args.years, END_OF_TIME),
+            repeat=1)
+        print('assignment rows: {}'.format(rows))
+        now = datetime.utcnow()
+        dates = [now - timedelta(days=365 * args.years // 2),
+                 now - timedelta(days=30), now]
+        month = (dates[0], dates[0] + timedelta(days=30))
+
+        def department_members():
+            after, total = 0, 0
+            while True:
+                page = assignments_as_of(dates[0], department_id=1,
+                                         after=after)
+                if not page:
+                    return total
+                total += len(page)
+                after = page[-1]['employee_id']
+
+        def run(suffix):
+            for when in dates:
+                timed('headcount by department at {}{}'.format(
+                    when.date(), suffix), lambda: headcount_as_of(when))
+            timed('members of one department, all pages' + suffix,
+                  department_members)
+            timed('one department over a month' + suffix,
+                  lambda: assignments_between(*month, department_id=1))
+            timed('one employee timeline' + suffix,
+                  lambda: assignment_history(args.employees // 2))
+
+        run('')
+        for index in Assignment.__table__.indexes:
+            index.drop(db.engine)
+        run(' (no indexes)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Benchmark dumping and restoring a large organization.
+
+Seeds --employees employees spread over 100 departments and roles with
+reporting lines --span wide, then times a dump, a restore into an empty
+database and a replacing restore, and prints the backup's size.
+
+    python benchmarks/bench_backup.py --employees 1000000
+"""
+
+import os
+import tempfile
+
+from common import make_app, parser, timed
+
+
+def seed(app, employees, span):
+    """Insert the departments, roles and employees with bulk statements."""
+    from app import db
+    from app.models import Department, Employee, Role
+
+    with app.app_context():
+        db.session.execute(Department.__table__.insert(), [
+            {'tenant_id': 1, 'name': 'Department {}'.format(number)}
+            for number in range(1, 101)])
+        db.session.execute(Role.__table__.insert(), [
+            {'tenant_id': 1, 'name': 'Role {}'.format(number)}
+            for number in range(1, 101)])
+        for start in range(1, employees + 1, 10000):
+            db.session.execute(Employee.__table__.insert(), [
+                {'id': number, 'tenant_id': 1,
+                 'email': 'user{}@example.com'.format(number),
+                 'username': 'user{}'.format(number), 'first_name': 'User',
+                 'last_name': str(number), 'password_hash': 'x',
+                 'department_id': number % 100 + 1,
+                 'role_id': number % 100 + 1,
+                 'manager_id': number // span or None, 'is_admin': False,
+                 'is_active': True, 'directory_managed': False}
+                for number in range(start, min(start + 10000,
+                                               employees + 1))])
+        db.session.commit()
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--employees', type=int, default=200000)
+    args_parser.add_argument('--span', type=int, default=8)
+    args = args_parser.parse_args()
+
+    app = make_app(args.database_uri)
+    seed(app, args.employees, args.span)
+    from app import db
+    from app.backup import dump, restore
+
+    path = os.path.join(tempfile.gettempdir(), 'dreamteam_backup.ndjson.gz')
+    with app.app_context():
+        timed('dump {} employees'.format(args.employees),
+              lambda: dump(path), repeat=1)
+        print('backup size {:.1f} MB'.format(os.path.getsize(path) / 1e6))
+        db.drop_all()
+        db.create_all()
+        timed('restore into an empty database', lambda: restore(path),
+              repeat=1)
+        timed('restore replacing the rows',
+              lambda: restore(path, replace=True), repeat=1)
+
+
+if __name__ == '__main__':
+    main()
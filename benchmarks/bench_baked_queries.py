@@ -0,0 +1,68 @@
+"""Benchmark the per-call cost of the hot employee lookups.
+
+Times --calls calls of each lookup built as an ordinary ORM query, as the
+views did, and as the cached baked query, against a SQLite database with
+--employees employees. The lookups hit the primary key or an index, so
+the difference is mostly Python spent building and compiling queries.
+
+    python benchmarks/bench_baked_queries.py --calls 20000
+"""
+
+from common import make_app, parser, timed
+
+
+def seed(app, employees):
+    """Add the employees."""
+    from app import db
+    from app.models import Employee
+
+    with app.app_context():
+        db.session.add_all(Employee(
+            email='user{}@bench.example'.format(number),
+            username='user{}'.format(number)) for number in range(employees))
+        db.session.commit()
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--employees', type=int, default=1000)
+    args_parser.add_argument('--calls', type=int, default=5000)
+    args = args_parser.parse_args()
+
+    app = make_app(args.database_uri)
+    seed(app, args.employees)
+    from app import db
+    from app.models import ArchivedEmployee, Employee
+    from app.queries import (active_employee, active_employee_by_email,
+                             email_taken)
+    from app.tenancy import tenant_scope
+
+    def orm_email_taken(email):
+        return bool(Employee.query.filter_by(email=email).first() or
+                    ArchivedEmployee.query.filter_by(email=email).first())
+
+    lookups = [
+        ('load_user', lambda number: Employee.query.filter_by(
+            id=number, is_active=True).first(), active_employee),
+        ('login email', lambda number: Employee.query.filter_by(
+            email='user{}@bench.example'.format(number),
+            is_active=True).first(),
+         lambda number: active_employee_by_email(
+             'user{}@bench.example'.format(number))),
+        ('email taken', lambda number: orm_email_taken(
+            'new{}@bench.example'.format(number)),
+         lambda number: email_taken('new{}@bench.example'.format(number))),
+    ]
+    with app.app_context(), tenant_scope(1):
+        for label, orm, baked in lookups:
+            for name, lookup in (('orm', orm), ('baked', baked)):
+                def run():
+                    for number in range(args.calls):
+                        lookup(number % args.employees + 1)
+                        db.session.expunge_all()
+                timed('{} {} x{}'.format(label, name, args.calls),
+                      run, repeat=3)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark assigning employees one request at a time and in batches.
+
+Seeds --employees employees, then moves --assignments of them to another
+department and role through the admin assign form, one POST each, and
+again through /admin/api/batch in batches of --batch-size operations.
+
+    python benchmarks/bench_batch.py --assignments 1000
+"""
+
+from common import make_app, parser, timed
+
+
+def seed(app, employees):
+    """Add the admin, two departments and roles, and the employees."""
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from app.models import Department, Employee, Role
+
+    with app.app_context():
+        for number in range(2):
+            db.session.add(Department(name='Department {}'.format(number)))
+            db.session.add(Role(name='Role {}'.format(number)))
+        db.session.add(Employee(
+            email='admin@bench.example', username='admin', is_admin=True,
+            password_hash=generate_password_hash('bench', 'pbkdf2:sha256:1')))
+        db.session.add_all(Employee(email='user{}@bench.example'.format(
+            number), username='user{}'.format(number), first_name='User',
+            last_name=str(number)) for number in range(employees))
+        db.session.commit()
+        return [row[0] for row in db.session.query(Employee.id).filter(
+            Employee.is_admin.is_(False)).order_by(Employee.id)]
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--employees', type=int, default=2000)
+    args_parser.add_argument('--assignments', type=int, default=500)
+    args_parser.add_argument('--batch-size', type=int, default=500)
+    args = args_parser.parse_args()
+
+    app = make_app(args.database_uri, WTF_CSRF_ENABLED=False,
+                   LOGIN_RATE_LIMIT_IP=(10 ** 9, 1))
+    ids = seed(app, args.employees)[:args.assignments]
+    client = app.test_client()
+    client.post('/login', data={'email': 'admin@bench.example',
+                                'password': 'bench'})
+
+    def one_at_a_time():
+        for employee_id in ids:
+            response = client.post(
+                '/admin/employees/assign/{}'.format(employee_id),
+                data={'department': '1', 'role': '1', 'manager': ''})
+            assert response.status_code == 302, response.status_code
+
+    def batched():
+        for start in range(0, len(ids), args.batch_size):
+            response = client.post('/admin/api/batch', json={'operations': [
+                {'op': 'assign', 'entity': 'employees', 'id': employee_id,
+                 'values': {'department_id': 2, 'role_id': 2}}
+                for employee_id in ids[start:start + args.batch_size]]})
+            assert response.status_code == 200, response.json
+
+    timed('{} assign form posts'.format(len(ids)), one_at_a_time, repeat=1)
+    timed('{} assignments in batches of {}'.format(len(ids),
+                                                   args.batch_size),
+          batched, repeat=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Compare sync, threaded and gevent workers on slow read-only requests.
+
+Runs a single gunicorn worker of each class against an app whose database
+queries each take --latency seconds, and drives the read-only admin pages
+with --clients logged-in keep-alive connections. A sync worker serves one
+request at a time, a gthread worker one per thread, while a gevent worker
+keeps serving other requests while queries wait.
+
+    python benchmarks/bench_concurrency.py --clients 50 --latency 0.05
+"""
+
+import os
+import subprocess
+import sys
+
+from common import ROOT, load, make_app, parser, report, wait_for
+
+PATHS = ['/dashboard', '/admin/departments', '/admin/roles',
+         '/admin/api/changes?limit=50']
+
+
+def session_cookie(app):
+    """Seed an admin with some data and return its session cookie."""
+    from app import db
+    from app.models import Department, Employee, Role
+
+    with app.app_context():
+        db.session.add(Employee(email='admin@bench.example',
+                                username='admin', password='bench',
+                                is_admin=True))
+        for number in range(20):
+            db.session.add(Department(name='Department {}'.format(number),
+                                      description='Benchmark'))
+            db.session.add(Role(name='Role {}'.format(number),
+                                description='Benchmark'))
+        db.session.commit()
+
+    client = app.test_client()
+    response = client.post('/login', data={'email': 'admin@bench.example',
+                                           'password': 'bench'})
+    assert response.status_code == 302, 'benchmark login failed'
+    cookie = next(cookie for cookie in client.cookie_jar
+                  if cookie.name == app.session_cookie_name)
+    return '{}={}'.format(cookie.name, cookie.value)
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--clients', type=int, default=50)
+    args_parser.add_argument('--seconds', type=float, default=10)
+    args_parser.add_argument('--latency', type=float, default=0.05,
+                             help='seconds added to every query')
+    args_parser.add_argument('--port', type=int, default=8944)
+    args = args_parser.parse_args()
+    app = make_app(args.database_uri, WTF_CSRF_ENABLED=False)
+    headers = {'Cookie': session_cookie(app)}
+
+    modes = [('sync', {'GUNICORN_THREADS': '1'}),
+             ('gthread', {'GUNICORN_THREADS': '8'})]
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print('gevent is not installed; skipping the gevent worker.')
+    else:
+        modes.append(('gevent', {'GUNICORN_WORKER_CONNECTIONS': '200'}))
+
+    command = [sys.executable, '-c',
+               'from gunicorn.app.wsgiapp import run; run()',
+               '-c', 'gunicorn.conf.py',
+               '-b', '127.0.0.1:{}'.format(args.port),
+               '--pythonpath', 'benchmarks', 'slow_db_app:app']
+    for worker_class, extra in modes:
+        env = dict(os.environ, SQLALCHEMY_DATABASE_URI=args.database_uri,
+                   BENCH_DB_LATENCY=str(args.latency),
+                   GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS='1',
+                   GUNICORN_ACCESS_LOG='', **extra)
+        server = subprocess.Popen(command, cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_for(args.port)
+            latencies, errors = load(args.port, PATHS, args.clients,
+                                     args.seconds, headers)
+        finally:
+            server.terminate()
+            server.wait()
+        report('1 {} worker'.format(worker_class), latencies, errors,
+               args.seconds)
+
+
+if __name__ == '__main__':
+    main()
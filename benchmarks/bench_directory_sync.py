@@ -0,0 +1,73 @@
+"""Benchmark syncing employees from a large identity directory.
+
+Writes --identities identities to a SQLite source, times the first sync
+that inserts them all, then changes --churn of them (renames, departures
+and new hires in equal parts) and times the incremental sync and one with
+nothing to do.
+
+    python benchmarks/bench_directory_sync.py --identities 300000
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+
+from common import make_app, parser, timed
+
+
+def write_source(path, identities):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE identities (email, username, '
+                       'first_name, last_name)')
+    connection.executemany('INSERT INTO identities VALUES (?, ?, ?, ?)',
+                           identities)
+    connection.commit()
+    connection.close()
+
+
+def identity(number, last_name=None):
+    return ('user{}@example.com'.format(number), 'user{}'.format(number),
+            'User', last_name or str(number))
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--identities', type=int, default=300000)
+    args_parser.add_argument('--churn', type=float, default=0.01)
+    args = args_parser.parse_args()
+
+    app = make_app(args.database_uri, DIRECTORY_MAX_DEACTIVATIONS=1.0)
+    from app.directory import SqliteSource, sync
+
+    path = os.path.join(tempfile.gettempdir(), 'dreamteam_directory.db')
+    source = SqliteSource(path)
+    identities = [identity(number) for number in range(args.identities)]
+    write_source(path, identities)
+
+    with app.app_context():
+        counts = timed('first sync of {} identities'.format(args.identities),
+                       lambda: sync(source), repeat=1)
+        print(counts)
+
+        random.seed(2019)
+        changes = int(args.identities * args.churn) // 3
+        picked = random.sample(range(args.identities), changes * 2)
+        for number in picked[:changes]:
+            identities[number] = identity(number, 'Renamed')
+        departed = set(picked[changes:])
+        identities = [row for number, row in enumerate(identities)
+                      if number not in departed] + [
+            identity(args.identities + number) for number in range(changes)]
+        write_source(path, identities)
+
+        counts = timed('sync with {} changes'.format(changes * 3),
+                       lambda: sync(source), repeat=1)
+        print(counts)
+        timed('sync with no changes', lambda: sync(source), repeat=1)
+
+
+if __name__ == '__main__':
+    main()
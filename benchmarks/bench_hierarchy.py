@@ -0,0 +1,91 @@
+"""Benchmark org chart queries on a deep reporting hierarchy.
+
+Builds a spine of managers --depth levels deep where every manager on the
+spine also has --width direct reports, then compares the closure-table
+queries with walking Employee.reports recursively in Python.
+
+    python benchmarks/bench_hierarchy.py --depth 25 --width 200
+"""
+
+from common import make_app, parser, timed
+
+
+def build(db, Employee, depth, width):
+    from app.hierarchy import rebuild_hierarchy
+
+    employees = Employee.__table__
+    manager_id = None
+    spine = []
+    for level in range(depth):
+        result = db.session.execute(employees.insert(), dict(
+            username='spine{}'.format(level), manager_id=manager_id))
+        manager_id = result.inserted_primary_key[0]
+        spine.append(manager_id)
+        db.session.execute(employees.insert(), [
+            dict(username='leaf{}_{}'.format(level, n),
+                 manager_id=manager_id) for n in range(width)])
+    rebuild_hierarchy()
+    db.session.commit()
+    return spine
+
+
+def walk(employee):
+    count = 0
+    for report in employee.reports:
+        count += 1 + walk(report)
+    return count
+
+
+def walk_up(employee):
+    chain = []
+    while employee.manager is not None:
+        employee = employee.manager
+        chain.append(employee)
+    return chain
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--depth', type=int, default=25)
+    args_parser.add_argument('--width', type=int, default=200)
+    args = args_parser.parse_args()
+
+    app = make_app(args.database_uri)
+    from app import db
+    from app.hierarchy import (headcount_under, reporting_chain,
+                               set_manager, subordinates)
+    from app.models import Employee
+
+    with app.app_context():
+        spine = timed('build {} levels x {} reports'.format(
+            args.depth, args.width),
+            lambda: build(db, Employee, args.depth, args.width), repeat=1)
+        top = Employee.query.get(spine[0])
+        bottom = Employee.query.get(spine[-1])
+        middle = Employee.query.get(spine[len(spine) // 2])
+        parent = middle.manager
+
+        def uncached(func):
+            def run():
+                db.session.expire_all()
+                return func()
+            return run
+
+        def move_and_back():
+            set_manager(middle, top)
+            db.session.commit()
+            set_manager(middle, parent)
+            db.session.commit()
+
+        print('employees under top manager: {}'.format(headcount_under(top)))
+        timed('headcount_under (closure)', lambda: headcount_under(top))
+        timed('headcount (recursive walk)', uncached(lambda: walk(top)),
+              repeat=1)
+        timed('subordinates (closure)', lambda: len(subordinates(top)))
+        timed('reporting_chain (closure)', lambda: reporting_chain(bottom))
+        timed('reporting chain (walk up)', uncached(lambda: walk_up(bottom)))
+        timed('move half the spine and back', move_and_back, repeat=3)
+
+
+if __name__ == '__main__':
+    main()
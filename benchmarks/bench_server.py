@@ -0,0 +1,67 @@
+"""Compare request throughput of run.py with the gunicorn configuration.
+
+Starts each server in turn against a scratch database, then drives it with
+--clients keep-alive connections for --seconds and reports requests per
+second and latency percentiles for each path.
+
+    python benchmarks/bench_server.py --clients 16 --seconds 10
+"""
+
+import os
+import subprocess
+import sys
+
+from common import ROOT, load, make_app, parser, report, wait_for
+
+PATHS = ['/', '/login']
+
+
+def servers(port):
+    """Yield (label, command, extra environment) for each server mode."""
+    yield ('run.py (Flask dev server)',
+           [sys.executable, '-c',
+            'import run; run.app.run(port={})'.format(port)], {})
+    gunicorn = [sys.executable, '-c',
+                'from gunicorn.app.wsgiapp import run; run()',
+                '-c', 'gunicorn.conf.py',
+                '-b', '127.0.0.1:{}'.format(port),
+                'run:app']
+    for worker_class in ('sync', 'gthread'):
+        yield ('gunicorn ' + worker_class, gunicorn,
+               {'GUNICORN_WORKER_CLASS': worker_class})
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print('gevent is not installed; skipping the gevent worker.')
+    else:
+        yield ('gunicorn gevent', gunicorn,
+               {'GUNICORN_WORKER_CLASS': 'gevent'})
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--clients', type=int, default=16)
+    args_parser.add_argument('--seconds', type=float, default=10)
+    args_parser.add_argument('--port', type=int, default=8943)
+    args = args_parser.parse_args()
+    make_app(args.database_uri)
+
+    for label, command, extra in servers(args.port):
+        env = dict(os.environ, FLASK_CONFIG='production',
+                   SQLALCHEMY_DATABASE_URI=args.database_uri,
+                   GUNICORN_ACCESS_LOG='', **extra)
+        server = subprocess.Popen(command, cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            wait_for(args.port)
+            latencies, errors = load(args.port, PATHS, args.clients,
+                                     args.seconds)
+        finally:
+            server.terminate()
+            server.wait()
+        report(label, latencies, errors, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark worker cold start: imports, create_app and first responses.
+
+Each run is a fresh interpreter importing run.py the way a WSGI server
+would, then requesting the homepage and login page once.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, parser
+
+CHILD = '''
+import json, time
+start = time.perf_counter()
+import flask, flask_sqlalchemy, flask_login, flask_bootstrap
+libraries = time.perf_counter()
+import run
+created = time.perf_counter()
+client = run.app.test_client()
+client.get('/')
+first = time.perf_counter()
+client.get('/login')
+second = time.perf_counter()
+print(json.dumps({
+    'import libraries': libraries - start,
+    'import run.py (create_app)': created - libraries,
+    'first response (/)': first - created,
+    'first response (/login)': second - first,
+    'total': second - start,
+}))
+'''
+
+SCENARIOS = [
+    ('no bytecode cache, no warmup', {'JINJA_BYTECODE_CACHE_DIR': '',
+                                      'TEMPLATE_WARMUP': ''}),
+    ('warmup, cold bytecode cache', {'TEMPLATE_WARMUP': '1',
+                                     'CLEAR_CACHE': '1'}),
+    ('warmup, warm bytecode cache', {'TEMPLATE_WARMUP': '1'}),
+    ('no warmup, warm bytecode cache', {'TEMPLATE_WARMUP': ''}),
+    ('page and pool warmup, warm bytecode cache', {'TEMPLATE_WARMUP': '1',
+                                                   'WARMUP': '1'}),
+]
+
+
+def run_child(database_uri, cache_dir, settings):
+    if settings.get('CLEAR_CACHE'):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    env = dict(os.environ, FLASK_CONFIG='production', SECRET_KEY='bench',
+               SQLALCHEMY_DATABASE_URI=database_uri,
+               JINJA_BYTECODE_CACHE_DIR=settings.get(
+                   'JINJA_BYTECODE_CACHE_DIR', cache_dir),
+               TEMPLATE_WARMUP=settings['TEMPLATE_WARMUP'],
+               WARMUP=settings.get('WARMUP', ''))
+    output = subprocess.check_output([sys.executable, '-c', CHILD],
+                                     cwd=ROOT, env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    args_parser = parser(__doc__)
+    args_parser.add_argument('--runs', type=int, default=5)
+    args = args_parser.parse_args()
+    cache_dir = tempfile.mkdtemp(prefix='dreamteam-jinja-bench-')
+
+    try:
+        for label, settings in SCENARIOS:
+            if not settings.get('CLEAR_CACHE'):
+                run_child(args.database_uri, cache_dir, settings)
+            results = [run_child(args.database_uri, cache_dir, settings)
+                       for _ in range(args.runs)]
+            print(label)
+            for key in results[0]:
+                median = statistics.median(r[key] for r in results)
+                print('  {:<44} {:>10.1f} ms'.format(key, median * 1000))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Shared helpers for the Dream Team benchmarks."""
+
+import argparse
+import http.client
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parser(description):
+    """Return an argument parser with the common --database-uri option."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        '--database-uri',
+        default='sqlite:///' + os.path.join(tempfile.gettempdir(),
+                                            'dreamteam_bench.db'),
+        help='database to benchmark against (it is dropped and recreated)')
+    return parser
+
+
+def make_app(database_uri, **config):
+    """Create the app against a fresh database, without an instance dir."""
+    os.environ['FLASK_CONFIG'] = 'production'
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['SQLALCHEMY_DATABASE_URI'] = database_uri
+    from app import create_app, db
+    app = create_app('production')
+    app.config.update(config)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def timed(label, func, repeat=5):
+    """Run func repeat times and print the best wall time."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{:<48} {:>10.3f} ms'.format(label, best * 1000))
+    return result
+
+
+def wait_for(port, timeout=30):
+    """Wait until a server accepts connections on a local port."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start on port {}'.format(port))
+
+
+def load(port, paths, clients, seconds, headers=None):
+    """Request paths round-robin from keep-alive clients for seconds.
+
+    Returns the sorted latencies of successful requests and the error count.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        while time.time() < deadline:
+            path = paths[len(mine) % len(paths)]
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path, headers=headers or {})
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise http.client.HTTPException(response.status)
+                mine.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port,
+                                                  timeout=30)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors[0]
+
+
+def report(label, latencies, errors, seconds):
+    """Print throughput and latency percentiles for a load run."""
+    if not latencies:
+        print('{:<28} no successful requests, {} errors'.format(label,
+                                                                errors))
+        return
+    print('{:<28} {:>8.0f} req/s  p50 {:>7.1f} ms  p99 {:>7.1f} ms  '
+          '{} errors'.format(
+              label, len(latencies) / seconds,
+              latencies[len(latencies) // 2] * 1000,
+              latencies[int(len(latencies) * 0.99)] * 1000, errors))
@@ -0,0 +1,23 @@
+"""The Dream Team app with a fixed delay added to every database query.
+
+Served by bench_concurrency.py to stand in for a MySQL server that is far
+away or under load. BENCH_DB_LATENCY sets the delay in seconds.
+"""
+
+import os
+import time
+
+from sqlalchemy import event
+
+from app import create_app, db
+
+LATENCY = float(os.environ.get('BENCH_DB_LATENCY', '0.05'))
+
+app = create_app('production')
+
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _wait_for_database(conn, cursor, statement, parameters, context,
+                           executemany):
+        # Looked up on each call so gevent's patched sleep is used.
+        time.sleep(LATENCY)
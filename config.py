@@ -1,5 +1,7 @@
 """Config for Dream Team app."""
 
+import os
+
 
 class Config(object):
     """Common configurations."""
@@ -7,6 +9,130 @@ class Config(object):
     DEBUG = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Pragmas run on each pooled connection to a sqlite:/// database:
+    # write-ahead logging so readers never wait for the writer, fsync only
+    # at checkpoints, a 64 MB page cache and 256 MB memory map, and foreign
+    # keys enforced as MySQL does. Writers wait SQLITE_BUSY_TIMEOUT seconds
+    # for one another.
+    SQLITE_PRAGMAS = (('journal_mode', 'WAL'), ('synchronous', 'NORMAL'),
+                      ('cache_size', -64000), ('mmap_size', 268435456),
+                      ('temp_store', 'MEMORY'), ('foreign_keys', 'ON'))
+    SQLITE_BUSY_TIMEOUT = 10
+
+    # Login throttling: (attempts, window in seconds) per client IP and email.
+    LOGIN_RATE_LIMIT_IP = (20, 60)
+    LOGIN_RATE_LIMIT_EMAIL = (5, 60)
+    # Redis URL for counters shared between workers; in-process if unset.
+    RATELIMIT_STORAGE_URL = None
+    RATELIMIT_MAX_KEYS = 10000
+    # Proxies in front of the app, such as the load balancer, whose
+    # X-Forwarded-For and X-Forwarded-Proto headers are trusted. Unset,
+    # every client behind a proxy shares the proxy's address.
+    PROXY_FIX_HOPS = 0
+
+    # Server-side principal cache: None, 'memory' or 'sqlite:///<path>'.
+    SESSION_STORE = None
+    SESSION_STORE_TTL = 300
+    SESSION_STORE_MAX_ENTRIES = 10000
+
+    # Bearer tokens from POST /token last ACCESS_TOKEN_TTL seconds. Each
+    # worker reloads the revoked ones every ACCESS_TOKEN_REVOCATION_REFRESH
+    # seconds.
+    ACCESS_TOKEN_TTL = 900
+    ACCESS_TOKEN_REVOCATION_REFRESH = 30
+
+    # Most operations one POST to /admin/api/batch may carry.
+    BATCH_MAX_OPERATIONS = 1000
+
+    # Audit entries are written in batches by a background thread, to the
+    # audit_log table or, if AUDIT_LOG_FILE is set, to an append-only file.
+    AUDIT_LOG_FILE = None
+    AUDIT_LOG_BATCH_SIZE = 100
+    AUDIT_LOG_FLUSH_INTERVAL = 1.0
+
+    # Serve the fingerprinted copies written by `flask assets build`.
+    ASSETS_USE_MANIFEST = True
+
+    # Directory for compiled template bytecode shared across restarts
+    # (relative to the instance folder, and only used if private to the app's
+    # user), and whether to compile every template while the app is created.
+    JINJA_BYTECODE_CACHE_DIR = None
+    TEMPLATE_WARMUP = False
+
+    # Whether create_app serves WARMUP_PATHS once and fills the connection
+    # pool, and how long /readyz waits for a database ping.
+    WARMUP = False
+    WARMUP_PATHS = ('/', '/login', '/register')
+    HEALTH_DB_TIMEOUT = 2.0
+
+    # Statements slower than SLOW_QUERY_THRESHOLD seconds are logged with
+    # their parameters, endpoint and call site to SLOW_QUERY_LOG_FILE (or
+    # the app log) and counted on the admin Slow Queries page; with
+    # SLOW_QUERY_EXPLAIN each SELECT is also explained once. Off if None.
+    SLOW_QUERY_THRESHOLD = None
+    SLOW_QUERY_LOG_FILE = None
+    SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOW_QUERY_LOG_BACKUPS = 5
+    SLOW_QUERY_EXPLAIN = False
+
+    # Background jobs: worker processes for `flask jobs work`, seconds
+    # between polls, attempts before a job fails, base retry backoff, and
+    # seconds without progress before a running job is queued again.
+    JOB_WORKERS = 2
+    JOB_POLL_INTERVAL = 1.0
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 30
+    JOB_STALE_AFTER = 900
+
+    # Webhooks: sender threads for `flask webhooks dispatch`, seconds
+    # between polls, seconds changes wait so a burst goes out as one batch,
+    # changes per batch, request timeout, base and maximum retry backoff,
+    # and days deliveries are kept.
+    WEBHOOK_THREADS = 4
+    WEBHOOK_POLL_INTERVAL = 1.0
+    WEBHOOK_BATCH_WINDOW = 2.0
+    WEBHOOK_BATCH_SIZE = 1000
+    WEBHOOK_TIMEOUT = 10
+    WEBHOOK_RETRY_DELAY = 10
+    WEBHOOK_MAX_RETRY_DELAY = 3600
+    WEBHOOK_DELIVERY_DAYS = 30
+    # Webhooks may only be sent to public addresses, or to these networks,
+    # e.g. ['10.1.0.0/16'] for an internal service.
+    WEBHOOK_ALLOWED_NETWORKS = []
+
+    # Days after deactivation before the archive job moves an employee to
+    # employees_archive.
+    EMPLOYEE_ARCHIVE_AFTER_DAYS = 90
+
+    # Headcount snapshots are kept daily for this many days, then weekly
+    # until HEADCOUNT_WEEKLY_DAYS, then monthly.
+    HEADCOUNT_DAILY_DAYS = 90
+    HEADCOUNT_WEEKLY_DAYS = 365
+
+    # Parent domain of the tenants' hosts: <slug>.<TENANT_DOMAIN> serves the
+    # tenant with that slug. Unset, every request uses the default tenant.
+    TENANT_DOMAIN = None
+
+    # Identity directory for `flask directory sync`: 'ldap[s]://host',
+    # 'sqlite:///<path>' or the path of a CSV export. Employees are written
+    # DIRECTORY_SYNC_CHUNK at a time, and a sync that would deactivate more
+    # than DIRECTORY_MAX_DEACTIVATIONS of the directory's employees stops
+    # unless forced.
+    DIRECTORY_SOURCE = None
+    DIRECTORY_LDAP_BASE_DN = None
+    DIRECTORY_LDAP_BIND_DN = None
+    DIRECTORY_LDAP_PASSWORD = None
+    DIRECTORY_LDAP_FILTER = '(objectClass=inetOrgPerson)'
+    DIRECTORY_LDAP_ATTRIBUTES = {'email': 'mail', 'username': 'uid',
+                                 'first_name': 'givenName',
+                                 'last_name': 'sn'}
+    DIRECTORY_SYNC_CHUNK = 500
+    DIRECTORY_MAX_DEACTIVATIONS = 0.05
+
+    # Rows read or inserted per statement by `flask backup dump` and
+    # `flask backup restore`.
+    BACKUP_CHUNK = 5000
+
 
 class DevelopmentConfig(Config):
     """Development configurations."""
@@ -18,12 +144,46 @@ class ProductionConfig(Config):
     """Production configurations."""
 
     DEBUG = False
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR',
+                                              'jinja-cache')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', '1') == '1'
+    WARMUP = os.environ.get('WARMUP', '1') == '1'
+
+    # Connection pool per worker process; gunicorn.conf.py sizes it to the
+    # number of threads.
+    SQLALCHEMY_POOL_SIZE = (int(os.environ['SQLALCHEMY_POOL_SIZE'])
+                            if 'SQLALCHEMY_POOL_SIZE' in os.environ else None)
+    SQLALCHEMY_MAX_OVERFLOW = (int(os.environ['SQLALCHEMY_MAX_OVERFLOW'])
+                               if 'SQLALCHEMY_MAX_OVERFLOW' in os.environ
+                               else None)
+    # Reconnect before MySQL drops idle connections.
+    SQLALCHEMY_POOL_RECYCLE = 280
+
+    SLOW_QUERY_THRESHOLD = (float(os.environ['SLOW_QUERY_THRESHOLD'])
+                            if 'SLOW_QUERY_THRESHOLD' in os.environ
+                            else None)
+    SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE')
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN') == '1'
+
+    TENANT_DOMAIN = os.environ.get('TENANT_DOMAIN')
+
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))
+
+    DIRECTORY_SOURCE = os.environ.get('DIRECTORY_SOURCE')
+    DIRECTORY_LDAP_BASE_DN = os.environ.get('DIRECTORY_LDAP_BASE_DN')
+    DIRECTORY_LDAP_BIND_DN = os.environ.get('DIRECTORY_LDAP_BIND_DN')
+    DIRECTORY_LDAP_PASSWORD = os.environ.get('DIRECTORY_LDAP_PASSWORD')
+
+    WEBHOOK_ALLOWED_NETWORKS = [
+        network for network in os.environ.get(
+            'WEBHOOK_ALLOWED_NETWORKS', '').split(',') if network]
 
 
 class TestingConfig(Config):
     """Testing configurations."""
 
     TESTING = True
+    WTF_CSRF_ENABLED = False
 
 
 app_config = {
@@ -0,0 +1,72 @@
+"""Gunicorn configuration for running the Dream Team app in production.
+
+    gunicorn -c gunicorn.conf.py run:app
+
+The app is imported once in the master and forked into the workers. Every
+setting can be overridden through the GUNICORN_* environment variables
+below. Set GUNICORN_WORKER_CLASS to 'gevent' (with gevent installed) to
+serve many slow requests concurrently from each worker: PyMySQL is pure
+Python, so once gevent patches the socket module a request waiting on
+MySQL hands its worker over to the next one.
+"""
+
+import multiprocessing
+import os
+
+cores = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded so the PyMySQL sockets, locks and
+    # queues it creates yield to other greenlets while they wait.
+    from gevent import monkey
+    monkey.patch_all()
+    # One process per core; concurrency comes from greenlets.
+    default_workers, default_threads = cores, 1
+elif worker_class == 'gthread':
+    default_workers, default_threads = cores + 1, 4
+else:
+    default_workers, default_threads = cores * 2 + 1, 1
+
+workers = int(os.environ.get('GUNICORN_WORKERS', default_workers))
+threads = int(os.environ.get('GUNICORN_THREADS', default_threads))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so slow leaks cannot accumulate.
+max_requests = 5000
+max_requests_jitter = 500
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+
+os.environ.setdefault('FLASK_CONFIG', 'production')
+# Enough pooled connections for every thread or greenlet in a worker.
+os.environ.setdefault('SQLALCHEMY_POOL_SIZE', str(
+    min(worker_connections, 20) if worker_class == 'gevent' else threads))
+
+
+def when_ready(server):
+    """Close the master's warmed-up connections before forking workers."""
+    from app import db
+
+    with server.app.wsgi().app_context():
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    """Replace the database connections inherited from the master process.
+
+    The master warmed the routes and templates the workers inherit; each
+    worker then opens its own pool before it accepts requests.
+    """
+    from app import db, health
+
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose()
+    if app.config['WARMUP']:
+        health.fill_pool(app)
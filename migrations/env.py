@@ -73,6 +73,8 @@ def run_migrations_online():
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
+                      # SQLite can only alter tables by copying them.
+                      render_as_batch=True,
                       **current_app.extensions['migrate'].configure_args)
     
     try:
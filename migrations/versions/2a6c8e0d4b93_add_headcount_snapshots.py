@@ -0,0 +1,36 @@
+"""add headcount snapshots
+
+Revision ID: 2a6c8e0d4b93
+Revises: e7b3d5f1a846
+Create Date: 2026-10-19 17:20:37.845162
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a6c8e0d4b93'
+down_revision = 'e7b3d5f1a846'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('headcount_snapshots',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('period', sa.String(length=5), nullable=False),
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=True),
+    sa.Column('headcount', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_headcount_snapshots_dimension_day', 'headcount_snapshots', ['dimension', 'day', 'period'], unique=False)
+    op.create_index('ix_jobs_name_created_at', 'jobs', ['name', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_jobs_name_created_at', table_name='jobs')
+    op.drop_index('ix_headcount_snapshots_dimension_day', table_name='headcount_snapshots')
+    op.drop_table('headcount_snapshots')
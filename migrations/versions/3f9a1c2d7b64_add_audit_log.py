@@ -0,0 +1,39 @@
+"""add audit log
+
+Revision ID: 3f9a1c2d7b64
+Revises: 72d5f3091ed0
+Create Date: 2026-10-19 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2d7b64'
+down_revision = '72d5f3091ed0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('actor_id', sa.Integer(), nullable=True),
+    sa.Column('actor_name', sa.String(length=60), nullable=True),
+    sa.Column('action', sa.String(length=20), nullable=True),
+    sa.Column('target_type', sa.String(length=20), nullable=True),
+    sa.Column('target_id', sa.Integer(), nullable=True),
+    sa.Column('before', sa.Text(), nullable=True),
+    sa.Column('after', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_log_created_at'), 'audit_log', ['created_at'], unique=False)
+    op.create_index('ix_audit_log_target', 'audit_log', ['target_type', 'target_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_log_target', table_name='audit_log')
+    op.drop_index(op.f('ix_audit_log_created_at'), table_name='audit_log')
+    op.drop_table('audit_log')
@@ -0,0 +1,34 @@
+"""add change events outbox
+
+Revision ID: 8b2e4d6a0c17
+Revises: 3f9a1c2d7b64
+Create Date: 2026-10-19 10:02:47.118364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6a0c17'
+down_revision = '3f9a1c2d7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('entity', sa.String(length=20), nullable=True),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('operation', sa.String(length=10), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_change_events_entity', 'change_events', ['entity', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_change_events_entity', table_name='change_events')
+    op.drop_table('change_events')
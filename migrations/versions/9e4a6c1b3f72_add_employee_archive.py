@@ -0,0 +1,51 @@
+"""add employee deactivation and archive
+
+Revision ID: 9e4a6c1b3f72
+Revises: 5d8f2b7c9e31
+Create Date: 2026-10-19 15:48:12.406518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a6c1b3f72'
+down_revision = '5d8f2b7c9e31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.add_column(sa.Column('is_active', sa.Boolean(), server_default=sa.true(), nullable=False))
+        batch_op.add_column(sa.Column('deactivated_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_employees_deactivated_at'), ['deactivated_at'], unique=False)
+    op.create_table('employees_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('email', sa.String(length=60), nullable=True),
+    sa.Column('username', sa.String(length=60), nullable=True),
+    sa.Column('first_name', sa.String(length=60), nullable=True),
+    sa.Column('last_name', sa.String(length=60), nullable=True),
+    sa.Column('password_hash', sa.String(length=128), nullable=True),
+    sa.Column('department_id', sa.Integer(), nullable=True),
+    sa.Column('role_id', sa.Integer(), nullable=True),
+    sa.Column('manager_id', sa.Integer(), nullable=True),
+    sa.Column('is_admin', sa.Boolean(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('deactivated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_employees_archive_email'), 'employees_archive', ['email'], unique=False)
+    op.create_index(op.f('ix_employees_archive_username'), 'employees_archive', ['username'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_employees_archive_username'), table_name='employees_archive')
+    op.drop_index(op.f('ix_employees_archive_email'), table_name='employees_archive')
+    op.drop_table('employees_archive')
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_employees_deactivated_at'))
+        batch_op.drop_column('deactivated_at')
+        batch_op.drop_column('is_active')
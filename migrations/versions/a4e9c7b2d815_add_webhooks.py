@@ -0,0 +1,59 @@
+"""add webhooks
+
+Revision ID: a4e9c7b2d815
+Revises: f1c8e2a6d473
+Create Date: 2026-10-19 21:02:47.118305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e9c7b2d815'
+down_revision = 'f1c8e2a6d473'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhooks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('secret', sa.String(length=64), nullable=False),
+    sa.Column('entities', sa.String(length=60), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=True),
+    sa.Column('cursor', sa.Integer(), nullable=False),
+    sa.Column('failures', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('leased_until', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['tenant_id'], ['tenants.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_webhooks_tenant', 'webhooks', ['tenant_id', 'id'], unique=False)
+    op.create_table('webhook_deliveries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('webhook_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('first_change_id', sa.Integer(), nullable=True),
+    sa.Column('last_change_id', sa.Integer(), nullable=True),
+    sa.Column('changes', sa.Integer(), nullable=True),
+    sa.Column('status_code', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=200), nullable=True),
+    sa.Column('duration_ms', sa.Integer(), nullable=True),
+    sa.Column('succeeded', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['webhook_id'], ['webhooks.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_webhook_deliveries_created_at', 'webhook_deliveries', ['created_at'], unique=False)
+    op.create_index('ix_webhook_deliveries_webhook', 'webhook_deliveries', ['webhook_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_webhook_deliveries_webhook', table_name='webhook_deliveries')
+    op.drop_index('ix_webhook_deliveries_created_at', table_name='webhook_deliveries')
+    op.drop_table('webhook_deliveries')
+    op.drop_index('ix_webhooks_tenant', table_name='webhooks')
+    op.drop_table('webhooks')
@@ -0,0 +1,28 @@
+"""add job schedules
+
+Revision ID: a9d4e2c6f035
+Revises: f4a2c7e9b318
+Create Date: 2026-10-19 10:04:27.381506
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d4e2c6f035'
+down_revision = 'f4a2c7e9b318'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job_schedules',
+    sa.Column('name', sa.String(length=60), nullable=False),
+    sa.Column('next_run_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('job_schedules')
@@ -0,0 +1,41 @@
+"""add change sequence
+
+Revision ID: b3e7f1d9c542
+Revises: a9d4e2c6f035
+Create Date: 2026-10-19 15:27:03.846119
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e7f1d9c542'
+down_revision = 'a9d4e2c6f035'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('change_events') as batch_op:
+        batch_op.add_column(sa.Column('seq', sa.Integer(), nullable=True))
+        batch_op.create_index('ix_change_events_seq', ['seq'], unique=True)
+        batch_op.create_index('ix_change_events_tenant_seq', ['tenant_id', 'seq'], unique=False)
+    op.create_table('change_sequence',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('last_seq', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Existing changes keep their order, so webhook cursors, which were
+    # ids, are valid sequences.
+    op.execute('UPDATE change_events SET seq = id')
+    op.execute('INSERT INTO change_sequence (id, last_seq) '
+               'SELECT 1, COALESCE(MAX(id), 0) FROM change_events')
+
+
+def downgrade():
+    op.drop_table('change_sequence')
+    with op.batch_alter_table('change_events') as batch_op:
+        batch_op.drop_index('ix_change_events_tenant_seq')
+        batch_op.drop_index('ix_change_events_seq')
+        batch_op.drop_column('seq')
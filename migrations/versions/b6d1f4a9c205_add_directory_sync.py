@@ -0,0 +1,30 @@
+"""add directory-managed employees
+
+Revision ID: b6d1f4a9c205
+Revises: 2a6c8e0d4b93
+Create Date: 2026-10-19 18:02:37.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4a9c205'
+down_revision = '2a6c8e0d4b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.add_column(sa.Column('directory_managed', sa.Boolean(), server_default=sa.false(), nullable=False))
+    with op.batch_alter_table('employees_archive') as batch_op:
+        batch_op.add_column(sa.Column('directory_managed', sa.Boolean(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('employees_archive') as batch_op:
+        batch_op.drop_column('directory_managed')
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.drop_column('directory_managed')
@@ -0,0 +1,45 @@
+"""add reporting lines
+
+Revision ID: c41d7e9f2a58
+Revises: 8b2e4d6a0c17
+Create Date: 2026-10-19 11:20:05.734921
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9f2a58'
+down_revision = '8b2e4d6a0c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.add_column(sa.Column('manager_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_employees_manager_id'), ['manager_id'], unique=False)
+        batch_op.create_foreign_key('fk_employees_manager_id', 'employees', ['manager_id'], ['id'])
+    op.create_table('employee_hierarchy',
+    sa.Column('ancestor_id', sa.Integer(), nullable=False),
+    sa.Column('descendant_id', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_id'], ['employees.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['descendant_id'], ['employees.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id')
+    )
+    op.create_index('ix_employee_hierarchy_ancestor_depth', 'employee_hierarchy', ['ancestor_id', 'depth'], unique=False)
+    op.create_index('ix_employee_hierarchy_descendant_depth', 'employee_hierarchy', ['descendant_id', 'depth'], unique=False)
+    op.execute('INSERT INTO employee_hierarchy (ancestor_id, descendant_id, depth) '
+               'SELECT id, id, 0 FROM employees')
+
+
+def downgrade():
+    op.drop_index('ix_employee_hierarchy_descendant_depth', table_name='employee_hierarchy')
+    op.drop_index('ix_employee_hierarchy_ancestor_depth', table_name='employee_hierarchy')
+    op.drop_table('employee_hierarchy')
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.drop_constraint('fk_employees_manager_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_employees_manager_id'))
+        batch_op.drop_column('manager_id')
@@ -0,0 +1,43 @@
+"""add slow query log
+
+Revision ID: c5f2a8d9e614
+Revises: a4e9c7b2d815
+Create Date: 2026-10-19 22:14:36.502871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f2a8d9e614'
+down_revision = 'a4e9c7b2d815'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('slow_queries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tenant_id', sa.Integer(), nullable=False),
+    sa.Column('digest', sa.String(length=40), nullable=False),
+    sa.Column('statement', sa.Text(), nullable=True),
+    sa.Column('endpoint', sa.String(length=100), nullable=True),
+    sa.Column('call_site', sa.String(length=200), nullable=True),
+    sa.Column('parameters', sa.Text(), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=True),
+    sa.Column('total_ms', sa.Float(), nullable=True),
+    sa.Column('max_ms', sa.Float(), nullable=True),
+    sa.Column('plan', sa.Text(), nullable=True),
+    sa.Column('first_seen', sa.DateTime(), nullable=True),
+    sa.Column('last_seen', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_slow_queries_tenant_digest', 'slow_queries', ['tenant_id', 'digest'], unique=True)
+    op.create_index('ix_slow_queries_tenant_total', 'slow_queries', ['tenant_id', 'total_ms'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_slow_queries_tenant_total', table_name='slow_queries')
+    op.drop_index('ix_slow_queries_tenant_digest', table_name='slow_queries')
+    op.drop_table('slow_queries')
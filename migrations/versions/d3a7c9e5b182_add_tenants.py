@@ -0,0 +1,141 @@
+"""add tenants
+
+Revision ID: d3a7c9e5b182
+Revises: b6d1f4a9c205
+Create Date: 2026-10-19 19:24:51.603117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a7c9e5b182'
+down_revision = 'b6d1f4a9c205'
+branch_labels = None
+depends_on = None
+
+# MySQL named the unnamed unique constraints after their columns, while
+# SQLite leaves them unnamed; batch mode names those by this convention.
+UNIQUE_NAMES = {'uq': 'uq_%(table_name)s_%(column_0_name)s'}
+
+
+def upgrade():
+    tenants = op.create_table('tenants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('slug', sa.String(length=60), nullable=False),
+    sa.Column('name', sa.String(length=60), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('slug')
+    )
+    # Existing rows all belong to the default tenant.
+    op.bulk_insert(tenants, [{'id': 1, 'slug': 'default', 'name': 'Default'}])
+
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_foreign_key('fk_employees_tenant_id', 'tenants', ['tenant_id'], ['id'])
+        batch_op.drop_index('ix_employees_email')
+        batch_op.drop_index('ix_employees_username')
+        batch_op.drop_index('ix_employees_first_name')
+        batch_op.drop_index('ix_employees_last_name')
+        batch_op.drop_index('ix_employees_deactivated_at')
+        batch_op.create_index('ix_employees_tenant_email', ['tenant_id', 'email'], unique=True)
+        batch_op.create_index('ix_employees_tenant_username', ['tenant_id', 'username'], unique=True)
+        batch_op.create_index('ix_employees_tenant_first_name', ['tenant_id', 'first_name'], unique=False)
+        batch_op.create_index('ix_employees_tenant_last_name', ['tenant_id', 'last_name'], unique=False)
+        batch_op.create_index('ix_employees_tenant_active', ['tenant_id', 'is_active', 'id'], unique=False)
+        batch_op.create_index('ix_employees_tenant_deactivated_at', ['tenant_id', 'deactivated_at'], unique=False)
+
+    mysql = op.get_bind().dialect.name == 'mysql'
+    for table in ('departments', 'roles'):
+        with op.batch_alter_table(table, naming_convention=UNIQUE_NAMES) as batch_op:
+            batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+            batch_op.create_foreign_key('fk_{}_tenant_id'.format(table), 'tenants', ['tenant_id'], ['id'])
+            batch_op.drop_constraint('name' if mysql else 'uq_{}_name'.format(table), type_='unique')
+            batch_op.create_index('ix_{}_tenant_name'.format(table), ['tenant_id', 'name'], unique=True)
+
+    with op.batch_alter_table('employees_archive') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.drop_index('ix_employees_archive_email')
+        batch_op.drop_index('ix_employees_archive_username')
+        batch_op.create_index('ix_employees_archive_tenant_email', ['tenant_id', 'email'], unique=False)
+        batch_op.create_index('ix_employees_archive_tenant_username', ['tenant_id', 'username'], unique=False)
+
+    with op.batch_alter_table('assignment_history') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.drop_index('ix_assignment_history_period')
+        batch_op.create_index('ix_assignment_history_period', ['tenant_id', 'valid_to', 'valid_from', 'department_id'], unique=False)
+
+    with op.batch_alter_table('headcount_snapshots') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.drop_index('ix_headcount_snapshots_dimension_day')
+        batch_op.create_index('ix_headcount_snapshots_dimension_day', ['tenant_id', 'dimension', 'day', 'period'], unique=False)
+
+    with op.batch_alter_table('audit_log') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('change_events') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.drop_index('ix_change_events_entity')
+        batch_op.create_index('ix_change_events_tenant', ['tenant_id', 'id'], unique=False)
+        batch_op.create_index('ix_change_events_entity', ['tenant_id', 'entity', 'id'], unique=False)
+
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.add_column(sa.Column('tenant_id', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_index('ix_jobs_tenant', ['tenant_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_index('ix_jobs_tenant')
+        batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('change_events') as batch_op:
+        batch_op.drop_index('ix_change_events_entity')
+        batch_op.drop_index('ix_change_events_tenant')
+        batch_op.create_index('ix_change_events_entity', ['entity', 'id'], unique=False)
+        batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('audit_log') as batch_op:
+        batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('headcount_snapshots') as batch_op:
+        batch_op.drop_index('ix_headcount_snapshots_dimension_day')
+        batch_op.create_index('ix_headcount_snapshots_dimension_day', ['dimension', 'day', 'period'], unique=False)
+        batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('assignment_history') as batch_op:
+        batch_op.drop_index('ix_assignment_history_period')
+        batch_op.create_index('ix_assignment_history_period', ['valid_to', 'valid_from', 'department_id'], unique=False)
+        batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('employees_archive') as batch_op:
+        batch_op.drop_index('ix_employees_archive_tenant_username')
+        batch_op.drop_index('ix_employees_archive_tenant_email')
+        batch_op.create_index('ix_employees_archive_username', ['username'], unique=False)
+        batch_op.create_index('ix_employees_archive_email', ['email'], unique=False)
+        batch_op.drop_column('tenant_id')
+
+    for table in ('roles', 'departments'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_index('ix_{}_tenant_name'.format(table))
+            batch_op.create_unique_constraint('name', ['name'])
+            batch_op.drop_constraint('fk_{}_tenant_id'.format(table), type_='foreignkey')
+            batch_op.drop_column('tenant_id')
+
+    with op.batch_alter_table('employees') as batch_op:
+        batch_op.drop_index('ix_employees_tenant_deactivated_at')
+        batch_op.drop_index('ix_employees_tenant_active')
+        batch_op.drop_index('ix_employees_tenant_last_name')
+        batch_op.drop_index('ix_employees_tenant_first_name')
+        batch_op.drop_index('ix_employees_tenant_username')
+        batch_op.drop_index('ix_employees_tenant_email')
+        batch_op.create_index('ix_employees_deactivated_at', ['deactivated_at'], unique=False)
+        batch_op.create_index('ix_employees_last_name', ['last_name'], unique=False)
+        batch_op.create_index('ix_employees_first_name', ['first_name'], unique=False)
+        batch_op.create_index('ix_employees_username', ['username'], unique=True)
+        batch_op.create_index('ix_employees_email', ['email'], unique=True)
+        batch_op.drop_constraint('fk_employees_tenant_id', type_='foreignkey')
+        batch_op.drop_column('tenant_id')
+
+    op.drop_table('tenants')
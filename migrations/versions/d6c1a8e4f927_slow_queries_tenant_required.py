@@ -0,0 +1,28 @@
+"""log slow queries outside a tenant only
+
+Revision ID: d6c1a8e4f927
+Revises: b3e7f1d9c542
+Create Date: 2026-10-19 17:41:09.218530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6c1a8e4f927'
+down_revision = 'b3e7f1d9c542'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows without a tenant were never deduplicated by the unique index.
+    op.execute('DELETE FROM slow_queries WHERE tenant_id IS NULL')
+    with op.batch_alter_table('slow_queries') as batch_op:
+        batch_op.alter_column('tenant_id', existing_type=sa.Integer(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('slow_queries') as batch_op:
+        batch_op.alter_column('tenant_id', existing_type=sa.Integer(), nullable=True)
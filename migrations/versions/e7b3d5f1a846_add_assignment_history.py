@@ -0,0 +1,47 @@
+"""add assignment history
+
+Revision ID: e7b3d5f1a846
+Revises: 9e4a6c1b3f72
+Create Date: 2026-10-19 16:31:55.270193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b3d5f1a846'
+down_revision = '9e4a6c1b3f72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('assignment_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('employee_id', sa.Integer(), nullable=False),
+    sa.Column('department_id', sa.Integer(), nullable=True),
+    sa.Column('role_id', sa.Integer(), nullable=True),
+    sa.Column('manager_id', sa.Integer(), nullable=True),
+    sa.Column('valid_from', sa.DateTime(), nullable=False),
+    sa.Column('valid_to', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_assignment_history_employee', 'assignment_history', ['employee_id', 'valid_from'], unique=False)
+    op.create_index('ix_assignment_history_department', 'assignment_history', ['department_id', 'valid_from', 'valid_to'], unique=False)
+    op.create_index('ix_assignment_history_role', 'assignment_history', ['role_id', 'valid_from', 'valid_to'], unique=False)
+    op.create_index('ix_assignment_history_period', 'assignment_history', ['valid_to', 'valid_from', 'department_id'], unique=False)
+    # Current assignments predate the history, so they start at the epoch.
+    op.execute("INSERT INTO assignment_history "
+               "(employee_id, department_id, role_id, manager_id, valid_from, valid_to) "
+               "SELECT id, department_id, role_id, manager_id, "
+               "'1970-01-01 00:00:00', '9999-12-31 00:00:00' "
+               "FROM employees WHERE is_active")
+
+
+def downgrade():
+    op.drop_index('ix_assignment_history_period', table_name='assignment_history')
+    op.drop_index('ix_assignment_history_role', table_name='assignment_history')
+    op.drop_index('ix_assignment_history_department', table_name='assignment_history')
+    op.drop_index('ix_assignment_history_employee', table_name='assignment_history')
+    op.drop_table('assignment_history')
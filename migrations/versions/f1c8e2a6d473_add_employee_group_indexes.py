@@ -0,0 +1,30 @@
+"""add department and role member indexes
+
+Revision ID: f1c8e2a6d473
+Revises: d3a7c9e5b182
+Create Date: 2026-10-19 20:11:05.382940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c8e2a6d473'
+down_revision = 'd3a7c9e5b182'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_employees_department_active', 'employees', ['department_id', 'is_active', 'id'], unique=False)
+    op.create_index('ix_employees_role_active', 'employees', ['role_id', 'is_active', 'id'], unique=False)
+
+
+def downgrade():
+    # MySQL drops the implicit foreign key indexes once these cover the
+    # keys, so the keys need indexes of their own again first.
+    op.create_index('ix_employees_department_id', 'employees', ['department_id'], unique=False)
+    op.create_index('ix_employees_role_id', 'employees', ['role_id'], unique=False)
+    op.drop_index('ix_employees_role_active', table_name='employees')
+    op.drop_index('ix_employees_department_active', table_name='employees')
@@ -0,0 +1,29 @@
+"""allow slow queries outside a tenant
+
+Revision ID: f4a2c7e9b318
+Revises: e8b3d6f1a027
+Create Date: 2026-10-19 09:12:44.503817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a2c7e9b318'
+down_revision = 'e8b3d6f1a027'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('slow_queries') as batch_op:
+        batch_op.alter_column('tenant_id', existing_type=sa.Integer(), nullable=True)
+    # The stored values were bound parameters, secrets included.
+    op.execute('UPDATE slow_queries SET parameters = NULL')
+
+
+def downgrade():
+    op.execute('DELETE FROM slow_queries WHERE tenant_id IS NULL')
+    with op.batch_alter_table('slow_queries') as batch_op:
+        batch_op.alter_column('tenant_id', existing_type=sa.Integer(), nullable=False)
@@ -1,12 +1,60 @@
 """Back end tests for Dream Team."""
 
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
 
 from flask import abort, url_for
 from flask_testing import TestCase
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
 
-from app import create_app, db
-from app.models import Department, Employee, Role
+from app import (access_tokens, audit_log, backup, create_app, db, health,
+                 job_queue, login_limiter, session_store, slow_query_log,
+                 trust_proxies, webhook_dispatcher)
+from app.archive import archive_inactive, deactivate, restore
+from app.assets import build
+from app.directory import (CsvSource, DirectorySyncError, open_source,
+                           sync)
+from app.models import (ArchivedEmployee, AuditEntry, ChangeEvent, Department,
+                        Employee, HeadcountSnapshot, Job, JobSchedule,
+                        RevokedToken, Role, SlowQuery, Tenant, Webhook,
+                        WebhookDelivery)
+from app.history import (END_OF_TIME, assignment_history, assignments,
+                         assignments_as_of, assignments_between,
+                         headcount_as_of)
+from app.hierarchy import (HierarchyError, headcount_under,
+                           rebuild_hierarchy, reporting_chain, set_manager,
+                           subordinates)
+from app.outbox import changes_since
+from app.queries import (active_employee, active_employee_by_email, bakery,
+                         email_taken, username_taken)
+from app.snapshots import downsample, take_snapshot, trend
+from app.ratelimit import MemoryBackend, SlidingWindow
+from app.sessions import MemoryStore, SessionStore
+from app.slow_queries import fingerprint
+from app.templating import init_templates, warm_templates
+from app.tenancy import tenant_scope
+from app.webhooks import sign
+
+
+def add_late_change(change_id, hours=0):
+    """Commit a change event with a chosen id and age."""
+    db.session.execute(ChangeEvent.__table__.insert().values(
+        id=change_id, tenant_id=1, entity='roles', entity_id=1,
+        operation='update', payload='{}',
+        created_at=datetime.utcnow() - timedelta(hours=hours)))
+    db.session.commit()
 
 
 class TestBase(TestCase):
@@ -30,12 +78,14 @@ class TestBase(TestCase):
         db.create_all()
 
         admin = Employee(
+            email='admin@email.com',
             username='admin',
             password='admin2019',
             is_admin=True
         )
 
         employee = Employee(
+            email='test_user@email.com',
             username='test_user',
             password='test2019'
         )
@@ -46,9 +96,15 @@ class TestBase(TestCase):
 
     def tearDown(self):
         """Tear down the test environment."""
+        audit_log.flush()
         db.session.remove()
         db.drop_all()
 
+    def login(self, email, password):
+        """Log in through the login view."""
+        return self.client.post(url_for('auth.login'),
+                                data=dict(email=email, password=password))
+
 
 class TestModels(TestBase):
     """Test the app's models."""
@@ -180,5 +236,1880 @@ class TestErrorPages(TestBase):
         self.assertTrue(b'500 Error' in response.data)
 
 
+class TestLoginThrottling(TestBase):
+    """Test the login rate limiter."""
+
+    def test_sliding_window(self):
+        """Test that the window rejects attempts over the limit."""
+        window = SlidingWindow(MemoryBackend())
+        results = [window.hit('key', 3, 60) for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        self.assertTrue(window.hit('other', 3, 60))
+
+    def test_memory_backend_is_bounded(self):
+        """Test that the memory backend evicts old counters."""
+        backend = MemoryBackend(max_keys=2)
+        for key in ('a', 'b', 'c'):
+            backend.incr(key, 60)
+        self.assertEqual(backend.get('a'), 0)
+        self.assertEqual(backend.get('c'), 1)
+
+    def test_login_throttled_by_email(self):
+        """Test that repeated failed logins for one email are rejected."""
+        limit = self.app.config['LOGIN_RATE_LIMIT_EMAIL'][0]
+        for _ in range(limit):
+            response = self.login('admin@email.com', 'wrong')
+            self.assertEqual(response.status_code, 200)
+
+        response = self.login('admin@email.com', 'admin2019')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(login_limiter.stats()['rejected_email'], 1)
+
+        response = self.login('test_user@email.com', 'test2019')
+        self.assertEqual(response.status_code, 302)
+
+    def test_clients_behind_a_proxy_are_told_apart(self):
+        """Test that the per-IP limit uses the forwarded client address."""
+        self.app.config.update(PROXY_FIX_HOPS=1,
+                               LOGIN_RATE_LIMIT_IP=(2, 60))
+        trust_proxies(self.app)
+
+        def attempt(client_ip, email):
+            return self.client.post(
+                url_for('auth.login'),
+                data=dict(email=email, password='wrong'),
+                headers={'X-Forwarded-For': client_ip}).status_code
+
+        self.assertEqual([attempt('203.0.113.7', 'user{}@email.com'.format(n))
+                          for n in range(3)], [200, 200, 429])
+        self.assertEqual(attempt('198.51.100.9', 'other@email.com'), 200)
+        # Only the address added by the trusted proxy counts.
+        self.assertEqual(attempt('203.0.113.7, 198.51.100.10',
+                                 'spoofed@email.com'), 200)
+
+
+class TestSessionStore(TestBase):
+    """Test the server-side principal cache."""
+
+    def setUp(self):
+        """Enable the in-memory session store."""
+        super(TestSessionStore, self).setUp()
+        self.app.extensions['session_store'] = MemoryStore()
+
+    def count_queries(self, url):
+        """Request a url and return the number of statements it ran."""
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        return response, len(statements)
+
+    def test_dashboard_skips_user_lookup(self):
+        """Test that pages are served without an employee query."""
+        self.login('admin@email.com', 'admin2019')
+        # The first page loads the revocations, reread only periodically.
+        self.client.get(url_for('home.dashboard'))
+        response, queries = self.count_queries(url_for('home.dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+    def test_demoted_admin_is_revoked(self):
+        """Test that demoting an admin revokes the cached principal."""
+        self.login('admin@email.com', 'admin2019')
+        admin = Employee.query.filter_by(username='admin').first()
+        admin.is_admin = False
+        db.session.commit()
+
+        response = self.client.get(url_for('home.admin_dashboard'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_revocations_from_other_processes(self):
+        """Test that a demotion committed elsewhere drops the principal."""
+        self.login('admin@email.com', 'admin2019')
+        self.assertEqual(self.client.get(
+            url_for('home.admin_dashboard')).status_code, 200)
+        # As a CLI command would: this worker's listeners never see it.
+        admin_id = Employee.query.filter_by(username='admin').one().id
+        db.session.execute(Employee.__table__.update().where(
+            Employee.__table__.c.id == admin_id).values(is_admin=False))
+        db.session.execute(RevokedToken.__table__.insert().values(
+            employee_id=admin_id, issued_before=time.time(),
+            expires_at=datetime.utcnow() + timedelta(minutes=15)))
+        db.session.commit()
+        self.app.extensions['access_tokens'].next_refresh = 0
+
+        response = self.client.get(url_for('home.admin_dashboard'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_memory_store_is_bounded(self):
+        """Test that the least recently used and expired entries go."""
+        store = MemoryStore(max_entries=2)
+        store.set(1, {'id': 1}, 60)
+        store.set(2, {'id': 2}, 60)
+        store.get(1)
+        store.set(3, {'id': 3}, 60)
+        self.assertIsNone(store.get(2))
+        self.assertEqual(store.get(1), {'id': 1})
+        store.set(3, {'id': 3}, -1)
+        self.assertIsNone(store.get(3))
+        self.assertEqual(list(store._entries), [1])
+
+    def test_disabled_store(self):
+        """Test that the store is a no-op when not configured."""
+        self.app.extensions['session_store'] = None
+        admin = Employee.query.filter_by(username='admin').first()
+        store = SessionStore()
+        store.put(admin)
+        self.assertIsNone(store.get(admin.id))
+
+
+class TestAuditLog(TestBase):
+    """Test the audit log of admin changes."""
+
+    def setUp(self):
+        """Log in as the admin."""
+        super(TestAuditLog, self).setUp()
+        self.login('admin@email.com', 'admin2019')
+
+    def test_department_changes_are_audited(self):
+        """Test that adding and editing a department is recorded."""
+        self.client.post(url_for('admin.add_department'),
+                         data=dict(name='IT', description='Tech'))
+        department_id = Department.query.filter_by(name='IT').first().id
+        self.client.post(url_for('admin.edit_department', id=department_id),
+                         data=dict(name='IT', description='Technology'))
+        audit_log.flush()
+
+        entries = AuditEntry.query.order_by(AuditEntry.id).all()
+        self.assertEqual([e.action for e in entries], ['add', 'edit'])
+        self.assertEqual(entries[1].actor_name, 'admin')
+        self.assertEqual(entries[1].target_id, department_id)
+        self.assertEqual(json.loads(entries[1].before)['description'],
+                         'Tech')
+        self.assertEqual(json.loads(entries[1].after)['description'],
+                         'Technology')
+
+    def test_file_sink(self):
+        """Test that entries can be appended to a file instead."""
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.app.extensions['audit_log'].path = path
+
+        role = Role(name='CEO', description='Run the whole company')
+        db.session.add(role)
+        db.session.commit()
+        self.client.get(url_for('admin.delete_role', id=role.id))
+        audit_log.flush()
+
+        with open(path) as log_file:
+            entries = [json.loads(line) for line in log_file]
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]['action'], 'delete')
+        self.assertEqual(entries[0]['before']['name'], 'CEO')
+        self.assertEqual(AuditEntry.query.count(), 0)
+
+
+class TestChangeEvents(TestBase):
+    """Test the change event outbox."""
+
+    def test_writes_are_recorded(self):
+        """Test that inserts, updates and deletes produce events."""
+        department = Department(name='IT', description='Tech')
+        db.session.add(department)
+        db.session.commit()
+        department.description = 'Technology'
+        db.session.commit()
+        db.session.delete(department)
+        db.session.commit()
+
+        changes = changes_since(0, entity='departments')
+        self.assertEqual([c['operation'] for c in changes],
+                         ['insert', 'update', 'delete'])
+        self.assertEqual(changes[1]['data']['description'], 'Technology')
+
+    def test_rolled_back_writes_are_not_recorded(self):
+        """Test that events share the transaction of the write."""
+        cursor = changes_since(0)[-1]['seq']
+        db.session.add(Role(name='CEO', description='Run the company'))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(changes_since(cursor), [])
+
+    def test_late_commits_are_not_skipped(self):
+        """Test that a change committed after higher ids is still read."""
+        last = changes_since(0)[-1]['id']
+        add_late_change(last + 10)
+        cursor = changes_since(0)[-1]['seq']
+        # The transaction that flushed first, an hour ago, commits now.
+        add_late_change(last + 5, hours=1)
+        self.assertEqual([change['id'] for change in changes_since(cursor)],
+                         [last + 5])
+
+    def test_register_is_recorded(self):
+        """Test that registration produces an employee insert event."""
+        self.client.post(url_for('auth.register'), data=dict(
+            email='new@email.com', username='new', first_name='New',
+            last_name='Hire', password='pw', confirm_password='pw'))
+        change = changes_since(0, entity='employees')[-1]
+        self.assertEqual(change['operation'], 'insert')
+        self.assertEqual(change['data']['username'], 'new')
+        self.assertNotIn('password_hash', change['data'])
+
+    def test_changes_api_pages_by_cursor(self):
+        """Test that the API returns batches after a cursor."""
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.get(url_for('admin.list_changes', limit=1))
+        self.assertEqual(len(response.json['changes']), 1)
+        self.assertTrue(response.json['has_more'])
+
+        response = self.client.get(url_for(
+            'admin.list_changes', since=response.json['cursor']))
+        self.assertEqual(len(response.json['changes']), 1)
+        self.assertEqual(response.json['changes'][0]['data']['username'],
+                         'test_user')
+        self.assertEqual(ChangeEvent.query.count(), 2)
+
+        for limit in (0, -5):
+            response = self.client.get(url_for('admin.list_changes',
+                                               limit=limit))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json['changes']), 1)
+
+
+class TestHierarchy(TestBase):
+    """Test reporting lines and org chart queries."""
+
+    def setUp(self):
+        """Create a chain of five employees, each managing the next."""
+        super(TestHierarchy, self).setUp()
+        self.chain = []
+        for level in range(5):
+            employee = Employee(username='level{}'.format(level),
+                                first_name='Level', last_name=str(level))
+            db.session.add(employee)
+            db.session.flush()
+            if self.chain:
+                set_manager(employee, self.chain[-1])
+            self.chain.append(employee)
+        db.session.commit()
+
+    def test_subtree_queries(self):
+        """Test subordinates, reporting chain and headcount."""
+        top, bottom = self.chain[0], self.chain[-1]
+        self.assertEqual(headcount_under(top), 4)
+        self.assertEqual([e for e, depth in subordinates(top)],
+                         self.chain[1:])
+        self.assertEqual(len(subordinates(top, max_depth=2)), 2)
+        self.assertEqual(reporting_chain(bottom), self.chain[-2::-1])
+
+    def test_moving_a_subtree(self):
+        """Test that reassigning a manager moves their whole team."""
+        new_boss = Employee.query.filter_by(username='test_user').first()
+        set_manager(self.chain[2], new_boss)
+        db.session.commit()
+
+        self.assertEqual(headcount_under(self.chain[0]), 1)
+        self.assertEqual(headcount_under(new_boss), 3)
+        self.assertEqual(reporting_chain(self.chain[4]),
+                         [self.chain[3], self.chain[2], new_boss])
+
+    def test_cycles_are_rejected(self):
+        """Test that a manager cannot report to their own report."""
+        with self.assertRaises(HierarchyError):
+            set_manager(self.chain[0], self.chain[3])
+
+    def test_rebuild_matches_maintained_links(self):
+        """Test that rebuilding from manager_id gives the same links."""
+        rebuild_hierarchy()
+        db.session.commit()
+        self.assertEqual(headcount_under(self.chain[0]), 4)
+        self.assertEqual(reporting_chain(self.chain[4])[-1], self.chain[0])
+
+    def test_org_chart_view(self):
+        """Test that the org chart page lists the team."""
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.get(url_for('admin.org_chart',
+                                           id=self.chain[1].id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Team (3)', response.data)
+        self.assertIn(b'Level 0', response.data)
+        self.assertNotIn(b'Showing up to', response.data)
+        response = self.client.get(url_for('admin.org_chart',
+                                           id=self.chain[0].id, depth=2))
+        self.assertIn(b'Showing up to 2 levels', response.data)
+
+    def test_manager_is_assigned_by_email(self):
+        """Test that the assign form looks the manager up by email."""
+        self.chain[0].email = 'level0@email.com'
+        department = Department(name='IT', description='Tech')
+        role = Role(name='Engineer', description='Builds things')
+        db.session.add_all([department, role])
+        db.session.commit()
+        employee = Employee.query.filter_by(username='test_user').first()
+        self.login('admin@email.com', 'admin2019')
+        url = url_for('admin.assign_employee', id=employee.id)
+        data = dict(department=department.id, role=role.id)
+        response = self.client.post(url, data=dict(
+            data, manager='nobody@email.com'))
+        self.assertIn(b'No active employee has that email', response.data)
+        self.client.post(url, data=dict(data, manager='level0@email.com'))
+        self.assertEqual(Employee.query.get(employee.id).manager_id,
+                         self.chain[0].id)
+        self.assertIn(b'level0@email.com', self.client.get(url).data)
+        self.client.post(url, data=dict(data, manager=''))
+        self.assertIsNone(Employee.query.get(employee.id).manager_id)
+
+
+class TestArchive(TestBase):
+    """Test deactivating, archiving and restoring employees."""
+
+    def setUp(self):
+        """Create a manager with one report under the test user."""
+        super(TestArchive, self).setUp()
+        self.employee = Employee.query.filter_by(username='test_user').one()
+        self.manager = Employee(username='manager', email='m@email.com')
+        self.report = Employee(username='report', email='r@email.com')
+        db.session.add_all([self.manager, self.report])
+        db.session.flush()
+        set_manager(self.employee, self.manager)
+        set_manager(self.report, self.employee)
+        db.session.commit()
+
+    def test_deactivate_hands_reports_to_manager(self):
+        """Test that deactivating detaches an employee from the chart."""
+        deactivate(self.employee)
+        db.session.commit()
+
+        self.assertEqual(self.report.manager, self.manager)
+        self.assertEqual(headcount_under(self.manager), 1)
+        self.assertEqual(headcount_under(self.employee), 0)
+        self.assertIsNone(self.employee.manager)
+
+    def test_deactivated_employee_cannot_log_in(self):
+        """Test that login and listings only see active employees."""
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.post(url_for('admin.deactivate_employee',
+                                            id=self.employee.id))
+        self.assertRedirects(response, url_for('admin.list_employees'))
+        response = self.client.get(url_for('admin.list_employees'))
+        self.assertNotIn(url_for('admin.assign_employee',
+                                 id=self.employee.id).encode(),
+                         response.data)
+        response = self.client.get(url_for('admin.list_inactive_employees'))
+        self.assertIn(b'Reactivate', response.data)
+        self.client.get(url_for('auth.logout'))
+
+        response = self.login('test_user@email.com', 'test2019')
+        self.assertIn(b'Invalid email or password', response.data)
+
+    def test_archive_and_restore(self):
+        """Test that long-inactive employees are archived and restored."""
+        employee_id = self.employee.id
+        deactivate(self.employee)
+        db.session.commit()
+        self.assertEqual(archive_inactive(datetime.utcnow() -
+                                          timedelta(days=1)), 0)
+
+        archived = archive_inactive(datetime.utcnow() + timedelta(seconds=1),
+                                    chunk_size=1)
+        self.assertEqual(archived, 1)
+        self.assertIsNone(Employee.query.get(employee_id))
+        self.assertEqual(ArchivedEmployee.query.get(employee_id).username,
+                         'test_user')
+
+        restore(ArchivedEmployee.query.get(employee_id))
+        db.session.commit()
+        employee = Employee.query.get(employee_id)
+        self.assertTrue(employee.is_active)
+        self.assertEqual(ArchivedEmployee.query.count(), 0)
+        self.assertEqual(reporting_chain(employee), [])
+        response = self.login('test_user@email.com', 'test2019')
+        self.assertRedirects(response, url_for('home.dashboard'))
+
+    def test_restore_of_a_taken_email_is_refused(self):
+        """Test that restoring over a reused email is reported, not raised."""
+        employee_id = self.employee.id
+        deactivate(self.employee)
+        db.session.commit()
+        archive_inactive(datetime.utcnow() + timedelta(seconds=1))
+        db.session.add(Employee(email='test_user@email.com',
+                                username='successor'))
+        db.session.commit()
+
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.post(url_for('admin.restore_employee',
+                                            id=employee_id),
+                                    follow_redirects=True)
+        self.assertIn(b'now used by someone else', response.data)
+        self.assertIsNotNone(ArchivedEmployee.query.get(employee_id))
+
+
+class TestAssignmentHistory(TestBase):
+    """Test effective-dated assignment history."""
+
+    def setUp(self):
+        """Create two departments and start the test user in the first."""
+        super(TestAssignmentHistory, self).setUp()
+        self.it = Department(name='IT', description='IT')
+        self.hr = Department(name='HR', description='HR')
+        db.session.add_all([self.it, self.hr])
+        db.session.flush()
+        self.employee = Employee.query.filter_by(username='test_user').one()
+        self.employee.department_id = self.it.id
+        db.session.commit()
+        self.in_it = datetime.utcnow()
+
+    def test_reassignment_closes_previous_range(self):
+        """Test that as-of queries see the department at each moment."""
+        self.employee.department_id = self.hr.id
+        db.session.commit()
+
+        history = assignment_history(self.employee.id)
+        self.assertEqual([row.department_id for row in history],
+                         [None, self.it.id, self.hr.id])
+        self.assertEqual(history[1].valid_to, history[2].valid_from)
+        self.assertEqual(
+            [row['employee_id'] for row in assignments_as_of(
+                self.in_it, department_id=self.it.id)],
+            [self.employee.id])
+        self.assertEqual(headcount_as_of(datetime.utcnow())[self.hr.id], 1)
+        self.assertEqual(len(assignments_between(
+            self.in_it, datetime.utcnow(), department_id=self.it.id)), 1)
+
+    def test_one_range_per_transaction(self):
+        """Test that several flushes in a transaction leave one range."""
+        self.employee.department_id = self.hr.id
+        db.session.flush()
+        self.employee.department_id = self.it.id
+        db.session.flush()
+        self.employee.department_id = self.hr.id
+        db.session.commit()
+        self.assertEqual(len(assignment_history(self.employee.id)), 3)
+
+    def test_deactivation_ends_assignment(self):
+        """Test that deactivated employees drop out of current headcount."""
+        deactivate(self.employee)
+        db.session.commit()
+        self.assertNotIn(self.it.id, headcount_as_of(datetime.utcnow()))
+        self.assertEqual(headcount_as_of(self.in_it)[self.it.id], 1)
+
+    def test_as_of_api(self):
+        """Test the as-of API and page."""
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.get(url_for(
+            'admin.list_assignments', as_of=self.in_it.strftime('%Y-%m-%d'),
+            department_id=self.it.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['employee_id']
+                          for row in response.json['assignments']],
+                         [self.employee.id])
+        self.assertFalse(response.json['has_more'])
+
+        for limit in (0, -1):
+            response = self.client.get(url_for(
+                'admin.list_assignments', department_id=self.it.id,
+                as_of=self.in_it.strftime('%Y-%m-%d'), limit=limit))
+            self.assertEqual(len(response.json['assignments']), 1)
+            self.assertTrue(response.json['has_more'])
+
+        response = self.client.get(url_for('admin.list_assignments',
+                                           as_of='yesterday'))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(url_for('admin.org_as_of',
+                                           department_id=self.it.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'IT', response.data)
+
+
+class TestHeadcountSnapshots(TestBase):
+    """Test headcount snapshots and the dashboard trends."""
+
+    def setUp(self):
+        """Put the test user in a department."""
+        super(TestHeadcountSnapshots, self).setUp()
+        self.it = Department(name='IT', description='IT')
+        db.session.add(self.it)
+        db.session.flush()
+        Employee.query.filter_by(username='test_user').one().department = \
+            self.it
+        db.session.commit()
+        self.today = datetime.utcnow().date()
+
+    def test_snapshot_is_aggregated(self):
+        """Test that a snapshot writes one row per group, not employee."""
+        take_snapshot(self.today)
+        take_snapshot(self.today)
+        db.session.commit()
+        self.assertEqual(trend('department', self.today),
+                         [(self.it.id, [(self.today, 1)]),
+                          (None, [(self.today, 1)])])
+        self.assertEqual(trend('total', self.today),
+                         [(None, [(self.today, 2)])])
+
+    def test_downsampling(self):
+        """Test that old days become weeks and old weeks become months."""
+        self.app.config.update(HEADCOUNT_DAILY_DAYS=14,
+                               HEADCOUNT_WEEKLY_DAYS=60)
+        for days in range(120):
+            take_snapshot(self.today - timedelta(days=days))
+        downsample(self.today)
+        db.session.commit()
+
+        points = trend('total', self.today - timedelta(days=120))[0][1]
+        self.assertLess(len(points), 14 + 9 + 4 + 2)
+        # Nobody was employed before today, so only the last point counts.
+        self.assertEqual(points[-1], (self.today, 2))
+        self.assertEqual(set(headcount for day, headcount in points[:-1]),
+                         {0})
+        self.assertEqual(len(points), len(set(day for day, _ in points)))
+
+        rows = HeadcountSnapshot.query.count()
+        downsample(self.today)
+        self.assertEqual(HeadcountSnapshot.query.count(), rows)
+
+    def test_scheduled_snapshot_and_dashboard(self):
+        """Test the periodic job and the dashboard charts."""
+        self.assertEqual([job.name for job in job_queue.enqueue_scheduled()],
+                         ['snapshot_headcount'])
+        self.assertEqual(job_queue.enqueue_scheduled(), [])
+        job_queue.run_pending()
+
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.get(url_for('home.admin_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<polyline', response.data)
+        self.assertIn(b'IT', response.data)
+        # Out of range periods are clamped to one day and ten years.
+        for days in (0, -5, 10 ** 9):
+            response = self.client.get(url_for('home.admin_dashboard',
+                                               days=days))
+            self.assertEqual(response.status_code, 200)
+
+
+class TestDirectorySync(TestBase):
+    """Test syncing employees from an identity directory."""
+
+    def setUp(self):
+        """Create a scratch directory for source files."""
+        super(TestDirectorySync, self).setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def csv_source(self, rows):
+        """Write identities to a CSV export and return a source for it."""
+        path = os.path.join(self.tmp, 'identities.csv')
+        with open(path, 'w') as export:
+            export.write('email,username,first_name,last_name\n')
+            for row in rows:
+                export.write(','.join(row) + '\n')
+        return CsvSource(path)
+
+    def sqlite_source(self, count):
+        """Write count identities to a SQLite table and return a source."""
+        path = os.path.join(self.tmp, 'identities.db')
+        if os.path.exists(path):
+            os.remove(path)
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE identities (email, username, '
+                           'first_name, last_name)')
+        connection.executemany('INSERT INTO identities VALUES (?, ?, ?, ?)', [
+            ('user{}@email.com'.format(number), 'user{}'.format(number),
+             'User', str(number)) for number in range(count)])
+        connection.commit()
+        connection.close()
+        return open_source('sqlite:///' + path)
+
+    def test_sync_inserts_updates_and_skips(self):
+        """Test the changes of a first sync and that a second one is idle."""
+        source = self.csv_source([
+            ('new@email.com', 'new', 'New', 'Hire'),
+            ('Test_User@email.com', 'test_user', 'Test', 'User'),
+            ('new@email.com', 'again', 'Duplicate', 'Hire'),
+            ('', 'nobody', 'No', 'Email'),
+            ('other@email.com', 'admin', 'Taken', 'Username')])
+        counts = sync(source, chunk_size=2)
+        self.assertEqual(counts, {'inserted': 1, 'updated': 1,
+                                  'deactivated': 0, 'unchanged': 0,
+                                  'skipped': 3})
+
+        new = Employee.query.filter_by(email='new@email.com').one()
+        self.assertTrue(new.directory_managed)
+        self.assertFalse(new.verify_password(''))
+        self.assertEqual(len(assignment_history(new.id)), 1)
+        self.assertEqual(headcount_under(new), 0)
+        employee = Employee.query.filter_by(username='test_user').one()
+        self.assertEqual((employee.email, employee.first_name),
+                         ('Test_User@email.com', 'Test'))
+        self.assertTrue(employee.verify_password('test2019'))
+        self.assertEqual(
+            [(change['entity_id'], change['operation'])
+             for change in changes_since()][-2:],
+            [(employee.id, 'update'), (new.id, 'insert')])
+        self.assertFalse(Employee.query.filter_by(
+            email='other@email.com').count())
+
+        counts = sync(source)
+        self.assertEqual((counts['inserted'], counts['updated'],
+                          counts['unchanged']), (0, 0, 2))
+
+    def test_departed_employees_are_deactivated(self):
+        """Test deactivation and the guard against an emptied source."""
+        sync(self.sqlite_source(20))
+        self.assertEqual(sync(self.sqlite_source(19))['deactivated'], 1)
+        departed = Employee.query.filter_by(username='user19').one()
+        self.assertFalse(departed.is_active)
+
+        with self.assertRaises(DirectorySyncError):
+            sync(self.sqlite_source(0))
+        self.assertEqual(sync(self.sqlite_source(0), dry_run=True,
+                              force=True)['deactivated'], 19)
+        self.assertEqual(Employee.query.filter_by(is_active=True).count(),
+                         21)
+        sync(self.sqlite_source(0), force=True)
+        self.assertEqual(
+            [employee.username for employee in
+             Employee.query.filter_by(is_active=True).order_by(Employee.id)],
+            ['admin', 'test_user'])
+
+
+class TestTenancy(TestBase):
+    """Test that tenants sharing the deployment are isolated."""
+
+    def setUp(self):
+        """Create a second tenant with the same admin email."""
+        super(TestTenancy, self).setUp()
+        self.app.config['TENANT_DOMAIN'] = 'dreamteam.test'
+        self.acme = Tenant(slug='acme', name='Acme')
+        db.session.add(self.acme)
+        db.session.add(Department(name='IT', description='Ours'))
+        db.session.commit()
+        self.acme_id = self.acme.id
+        with tenant_scope(self.acme_id):
+            db.session.add_all([
+                Employee(email='admin@email.com', username='admin',
+                         password='acme2019', is_admin=True),
+                Department(name='IT', description='Theirs')])
+            db.session.commit()
+        db.session.expunge_all()
+
+    def get(self, url, host='acme.dreamteam.test'):
+        """Request a url on a tenant's host."""
+        return self.client.get(url, base_url='http://' + host)
+
+    def test_queries_are_scoped(self):
+        """Test that ORM queries only see the scoped tenant's rows."""
+        ours = Department.query.filter_by(description='Ours').one()
+        self.assertEqual(Employee.query.count(), 3)
+        # get() answers from the identity map without a query.
+        db.session.expunge_all()
+        with tenant_scope(self.acme_id):
+            self.assertEqual(Employee.query.count(), 1)
+            self.assertEqual([d.description for d in Department.query],
+                             ['Theirs'])
+            self.assertIsNone(Department.query.get(ours.id))
+
+    def test_requests_are_scoped_by_host(self):
+        """Test logins, listings and ids across tenant hosts."""
+        ours = Department.query.filter_by(description='Ours').one().id
+        db.session.expunge_all()
+        self.client.post(url_for('auth.login'), base_url='http://'
+                         'acme.dreamteam.test', data=dict(
+                             email='admin@email.com', password='admin2019'))
+        self.assertEqual(self.get(url_for('home.dashboard')).status_code,
+                         302)
+        self.client.post(url_for('auth.login'), base_url='http://'
+                         'acme.dreamteam.test', data=dict(
+                             email='admin@email.com', password='acme2019'))
+
+        response = self.get(url_for('admin.list_departments'))
+        self.assertIn(b'Theirs', response.data)
+        self.assertNotIn(b'Ours', response.data)
+        self.assertEqual(self.get(url_for('admin.edit_department',
+                                          id=ours)).status_code, 404)
+        self.assertEqual(self.get(url_for('home.homepage'),
+                                  'nope.dreamteam.test').status_code, 404)
+        # The default tenant's host does not accept the acme session.
+        self.assertEqual(self.get(url_for('admin.list_departments'),
+                                  'dreamteam.test').status_code, 302)
+
+    def test_cached_principal_stays_in_its_tenant(self):
+        """Test that the principal cache misses for another tenant."""
+        self.app.extensions['session_store'] = MemoryStore()
+        admin = Employee.query.filter_by(email='admin@email.com',
+                                         tenant_id=1).one()
+        session_store.put(admin)
+        self.assertEqual(session_store.get(admin.id).username, 'admin')
+        with tenant_scope(self.acme_id):
+            self.assertIsNone(session_store.get(admin.id))
+
+    def test_jobs_run_as_their_tenant(self):
+        """Test that snapshots are taken for every tenant separately."""
+        with tenant_scope(self.acme_id):
+            job = job_queue.enqueue('snapshot_headcount', days=1)
+            db.session.commit()
+            self.assertEqual(job.tenant_id, self.acme_id)
+        job_queue.run_pending()
+        today = datetime.utcnow().date()
+        self.assertEqual(trend('total', today), [
+            (None, [(today, 2), (today, 1)])])
+        with tenant_scope(self.acme_id):
+            self.assertEqual(trend('total', today),
+                             [(None, [(today, 1)])])
+
+
+class WebhookReceiver(ThreadingMixIn, HTTPServer):
+    """A local endpoint recording the webhook requests it receives."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.requests = []
+        self.connections = 0
+        self.status = 200
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                receiver.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                receiver.requests.append((self.headers, body))
+                self.send_response(receiver.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/hook'.format(self.server_port)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def payloads(self):
+        """Return the decoded bodies received so far."""
+        return [json.loads(body.decode('utf-8'))
+                for headers, body in self.requests]
+
+
+class TestWebhooks(TestBase):
+    """Test sending batches of changes to webhooks."""
+
+    def setUp(self):
+        """Start a local endpoint and send changes as soon as they are made."""
+        super(TestWebhooks, self).setUp()
+        self.app.config.update(WEBHOOK_BATCH_WINDOW=0, WEBHOOK_RETRY_DELAY=60,
+                               WEBHOOK_ALLOWED_NETWORKS=['127.0.0.0/8'])
+        self.receiver = WebhookReceiver()
+        self.addCleanup(self.receiver.server_close)
+        self.addCleanup(self.receiver.shutdown)
+        self.addCleanup(webhook_dispatcher.connections.close)
+        self.webhook = webhook_dispatcher.add(self.receiver.url)
+        db.session.commit()
+
+    def add_departments(self, count):
+        """Add departments in separate transactions."""
+        for number in range(count):
+            db.session.add(Department(name='Dept {}'.format(number),
+                                      description='Department'))
+            db.session.commit()
+
+    def test_changes_are_batched(self):
+        """Test that changes made since the last batch go out in one call."""
+        self.add_departments(3)
+        employee = Employee.query.filter_by(username='test_user').first()
+        employee.department_id = Department.query.first().id
+        db.session.commit()
+
+        deliveries = webhook_dispatcher.run_pending()
+        self.assertEqual(len(deliveries), 1)
+        self.assertEqual(len(self.receiver.requests), 1)
+        headers, body = self.receiver.requests[0]
+        self.assertEqual(headers['X-Webhook-Signature'],
+                         sign(self.webhook.secret, body))
+        changes = self.receiver.payloads()[0]['changes']
+        self.assertEqual([change['entity'] for change in changes],
+                         ['departments'] * 3 + ['employees'])
+        webhook = Webhook.query.get(self.webhook.id)
+        self.assertEqual(webhook.cursor, changes[-1]['seq'])
+        self.assertTrue(deliveries[0].succeeded)
+        self.assertEqual(deliveries[0].changes, 4)
+        self.assertEqual(webhook_dispatcher.run_pending(), [])
+
+    def test_failed_batch_is_retried_with_backoff(self):
+        """Test that a failed batch is sent again, whole, after a delay."""
+        self.add_departments(2)
+        self.receiver.status = 500
+        delivery = webhook_dispatcher.run_pending()[0]
+        self.assertFalse(delivery.succeeded)
+        self.assertEqual(delivery.status_code, 500)
+        webhook = Webhook.query.get(self.webhook.id)
+        self.assertEqual(webhook.failures, 1)
+        self.assertGreater(webhook.next_attempt_at, datetime.utcnow())
+        self.assertEqual(webhook_dispatcher.run_pending(), [])
+
+        webhook.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        self.receiver.status = 204
+        retried = webhook_dispatcher.run_pending()[0]
+        self.assertTrue(retried.succeeded)
+        self.assertEqual((retried.first_change_id, retried.changes),
+                         (delivery.first_change_id, 2))
+        self.assertEqual(Webhook.query.get(self.webhook.id).failures, 0)
+        self.assertEqual(WebhookDelivery.query.count(), 2)
+
+    def test_late_commits_are_delivered(self):
+        """Test that a change committed after a delivery is sent next."""
+        self.add_departments(1)
+        last = webhook_dispatcher.run_pending()[0].last_change_id
+        add_late_change(last + 10)
+        webhook_dispatcher.run_pending()
+        add_late_change(last + 5, hours=1)
+        self.assertEqual(webhook_dispatcher.run_pending()[0].last_change_id,
+                         last + 5)
+        self.assertEqual([[change['id'] for change in payload['changes']]
+                          for payload in self.receiver.payloads()],
+                         [[last], [last + 10], [last + 5]])
+
+    def test_unreachable_endpoint_is_recorded(self):
+        """Test that a connection error is recorded as a failed delivery."""
+        self.webhook.url = 'http://127.0.0.1:1/hook'
+        db.session.commit()
+        self.add_departments(1)
+        delivery = webhook_dispatcher.run_pending()[0]
+        self.assertFalse(delivery.succeeded)
+        self.assertIsNone(delivery.status_code)
+        self.assertTrue(delivery.error)
+
+    def test_connection_is_reused(self):
+        """Test that batches to one endpoint share a kept-alive connection."""
+        self.app.config['WEBHOOK_BATCH_SIZE'] = 2
+        self.add_departments(5)
+        webhook_dispatcher.run_pending()
+        webhook_dispatcher.run_pending()
+        webhook_dispatcher.run_pending()
+        self.assertEqual([len(payload['changes'])
+                          for payload in self.receiver.payloads()], [2, 2, 1])
+        self.assertEqual(self.receiver.connections, 1)
+
+    def test_entities_are_filtered(self):
+        """Test that a webhook only gets the changes it asked for."""
+        roles = webhook_dispatcher.add(self.receiver.url, ['roles'])
+        db.session.commit()
+        self.add_departments(1)
+        db.session.add(Role(name='CEO', description='Run the company'))
+        db.session.commit()
+        webhook_dispatcher.run_pending()
+        entities = sorted(
+            (payload['webhook_id'], change['entity'])
+            for payload in self.receiver.payloads()
+            for change in payload['changes'])
+        self.assertEqual(entities, [(self.webhook.id, 'departments'),
+                                    (self.webhook.id, 'roles'),
+                                    (roles.id, 'roles')])
+
+    def test_dispatch_sends_from_thread_pool(self):
+        """Test that the dispatcher sends each webhook's batch from a pool."""
+        other = webhook_dispatcher.add(self.receiver.url + '?other')
+        db.session.commit()
+        self.add_departments(3)
+        ids = sorted([self.webhook.id, other.id])
+        webhook_dispatcher.dispatch(threads=2, burst=True)
+        self.assertEqual(sorted(payload['webhook_id']
+                                for payload in self.receiver.payloads()), ids)
+
+    def test_admin_adds_webhook(self):
+        """Test that an admin can add a webhook for future changes."""
+        self.add_departments(1)
+        self.login('admin@email.com', 'admin2019')
+        self.client.post(url_for('admin.list_webhooks'), data=dict(
+            url='http://93.184.216.34/org', entities=['employees']))
+        webhook = Webhook.query.filter_by(
+            url='http://93.184.216.34/org').first()
+        self.assertEqual(webhook.entities, 'employees')
+        self.assertEqual(webhook.cursor, changes_since(0)[-1]['seq'])
+        response = self.client.get(url_for('admin.list_webhooks'))
+        self.assertIn(webhook.secret.encode('utf-8'), response.data)
+
+        response = self.client.post(url_for('admin.list_webhooks'), data=dict(
+            url='ftp://hooks.example.com/org'))
+        self.assertIn(b'Use an http or https URL', response.data)
+
+    def test_internal_addresses_are_refused(self):
+        """Test that webhooks cannot be pointed inside the network."""
+        self.app.config['WEBHOOK_ALLOWED_NETWORKS'] = []
+        self.login('admin@email.com', 'admin2019')
+        for url in ('http://127.0.0.1:8080/hook',
+                    'http://169.254.169.254/latest/meta-data',
+                    'https://10.0.0.5/hook', 'http://[::1]/hook'):
+            response = self.client.post(url_for('admin.list_webhooks'),
+                                        data=dict(url=url))
+            self.assertIn(b'not a public address', response.data)
+        self.assertEqual(Webhook.query.count(), 1)
+
+        # A host that later resolves inside the network is not sent to.
+        self.add_departments(1)
+        delivery = webhook_dispatcher.run_pending()[0]
+        self.assertFalse(delivery.succeeded)
+        self.assertIn('UnsafeURLError', delivery.error)
+        self.assertEqual(self.receiver.requests, [])
+
+
+class TestSqliteBackend(TestBase):
+    """Test running on a SQLite file instead of MySQL."""
+
+    def create_app(self):
+        """Create the app against a SQLite file in a temporary directory."""
+        app = super(TestSqliteBackend, self).create_app()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'dreamteam.db')
+        app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + self.path)
+        return app
+
+    def test_pragmas_are_applied(self):
+        """Test that connections use WAL and enforce foreign keys."""
+        pragma = lambda name: db.session.execute(  # noqa: E731
+            'PRAGMA {}'.format(name)).scalar()
+        self.assertEqual(pragma('journal_mode'), 'wal')
+        self.assertEqual(pragma('synchronous'), 1)
+        self.assertEqual(pragma('foreign_keys'), 1)
+
+    def test_connections_are_pooled(self):
+        """Test that a connection and its page cache outlive a checkout."""
+        self.assertIsInstance(db.engine.pool, QueuePool)
+        connections = []
+        for _ in range(2):
+            with db.engine.connect() as connection:
+                connections.append(connection.connection.connection)
+        self.assertIs(connections[0], connections[1])
+
+    def test_writer_waits_for_another_process(self):
+        """Test that a write waits for a lock held by another connection."""
+        other = sqlite3.connect(self.path, isolation_level=None,
+                                check_same_thread=False)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(0.5, other.execute, ('COMMIT',))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        db.session.add(Department(name='IT', description='Tech'))
+        db.session.commit()
+        self.assertEqual(Department.query.count(), 1)
+
+
+class TestHealth(TestBase):
+    """Test the health checks and warmup."""
+
+    def test_liveness(self):
+        """Test that /healthz answers without logging in."""
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 'ok')
+
+    def test_readiness_pings_database(self):
+        """Test that /readyz succeeds while the database answers."""
+        self.assertEqual(self.client.get('/readyz').status_code, 200)
+
+    def test_readiness_times_out(self):
+        """Test that a hung ping fails the probes that share it."""
+        self.app.config['HEALTH_DB_TIMEOUT'] = 0.05
+        self.app.extensions['health']['ping'] = Future()
+        for _ in range(2):
+            response = self.client.get('/readyz')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json['error'], 'database ping timed out')
+
+    def test_readiness_reports_database_errors(self):
+        """Test that a failed ping makes the worker unready."""
+        health._ping = lambda app, future: future.set_exception(
+            RuntimeError('down'))
+        self.addCleanup(delattr, health, '_ping')
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json['error'], 'RuntimeError')
+
+    def test_probes_skip_tenant_resolution(self):
+        """Test that probes by address work while tenants are resolved."""
+        self.app.config['TENANT_DOMAIN'] = 'example.com'
+        base_url = 'http://10.0.0.1/'
+        self.assertEqual(self.client.get('/', base_url=base_url).status_code,
+                         404)
+        self.assertEqual(
+            self.client.get('/healthz', base_url=base_url).status_code, 200)
+
+    def test_warm_up_fills_pool(self):
+        """Test that warming up leaves the pool full of idle connections."""
+        db.session.remove()
+        size = health.warm_up(self.app)
+        self.assertGreater(size, 0)
+        self.assertGreaterEqual(db.engine.pool.checkedin(), size)
+
+
+class TestSlowQueries(TestBase):
+    """Test the slow query log."""
+
+    def setUp(self):
+        """Record every statement, with plans, to a temporary log file."""
+        super(TestSlowQueries, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'slow.log')
+        self.app.config.update(SLOW_QUERY_THRESHOLD=0,
+                               SLOW_QUERY_EXPLAIN=True,
+                               SLOW_QUERY_LOG_FILE=self.path)
+        slow_query_log.init_app(self.app)
+
+    def tearDown(self):
+        """Stop recording before the tables are dropped."""
+        self.app.extensions.pop('slow_query_log').flush()
+        super(TestSlowQueries, self).tearDown()
+
+    def login_query(self):
+        """Return the recorded employee lookup of the login view."""
+        self.login('test_user@email.com', 'test2019')
+        slow_query_log.flush()
+        return SlowQuery.query.filter(
+            SlowQuery.endpoint == 'auth.login',
+            SlowQuery.statement.like('SELECT%FROM employees%')).first()
+
+    def test_statement_is_traced_to_its_caller(self):
+        """Test that a slow statement records its endpoint and call site."""
+        query = self.login_query()
+        self.assertIsNotNone(query)
+        self.assertTrue(query.call_site.startswith('app/auth/views.py:'))
+        self.assertNotIn('test_user@email.com', query.parameters)
+        self.assertIn('str', query.parameters)
+        self.assertTrue(query.plan)
+        with open(self.path) as log_file:
+            self.assertIn('"endpoint": "auth.login"', log_file.read())
+
+    def test_repeated_statements_are_counted(self):
+        """Test that runs of one statement share a row."""
+        count = self.login_query().count
+        self.client.get(url_for('auth.logout'))
+        self.assertGreater(self.login_query().count, count)
+
+    def test_in_lists_share_a_fingerprint(self):
+        """Test that IN lists of any length are one statement."""
+        self.assertEqual(
+            fingerprint('SELECT * FROM roles WHERE id IN (?, ?)'),
+            fingerprint('SELECT * FROM roles\nWHERE id IN (?, ?, ?, ?)'))
+        self.assertNotEqual(fingerprint('SELECT * FROM roles'),
+                            fingerprint('SELECT * FROM departments'))
+
+    def test_admin_page_lists_offenders(self):
+        """Test that admins can see the slowest statements."""
+        self.login_query()
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.get(url_for('admin.list_slow_queries'))
+        self.assertIn(b'app/auth/views.py', response.data)
+
+    def test_unscoped_statements_are_hidden_from_tenants(self):
+        """Test that statements outside a request are only logged."""
+        for _ in range(2):
+            db.session.execute('SELECT password_hash FROM employees')
+        slow_query_log.flush()
+        with open(self.path) as log_file:
+            self.assertEqual(log_file.read().count(
+                '"statement": "SELECT password_hash'), 2)
+        self.assertEqual(db.session.execute(SlowQuery.__table__.select().where(
+            SlowQuery.statement.like('SELECT password_hash%'))).fetchall(),
+            [])
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.get(url_for('admin.list_slow_queries'))
+        self.assertNotIn(b'SELECT password_hash', response.data)
+
+    def test_concurrent_first_runs_are_merged(self):
+        """Test that an entry losing the race to insert is still counted."""
+        entry = {'time': datetime.utcnow(), 'duration_ms': 7.0,
+                 'statement': 'SELECT 1', 'parameters': (),
+                 'executemany': False, 'dialect': 'sqlite',
+                 'endpoint': None, 'call_site': None, 'tenant_id': 1}
+        table = SlowQuery.__table__
+        raced = []
+
+        def insert_first(conn, clauseelement, multiparams, params, result):
+            # Another worker inserts the row just after it was looked up.
+            if not raced and getattr(clauseelement, 'froms', None) == [table]:
+                raced.append(True)
+                conn.execute(table.insert().values(
+                    tenant_id=1, digest=fingerprint('SELECT 1'),
+                    statement='SELECT 1', count=1, total_ms=5.0, max_ms=5.0))
+
+        event.listen(db.engine, 'after_execute', insert_first)
+        self.addCleanup(event.remove, db.engine, 'after_execute',
+                        insert_first)
+        self.app.extensions['slow_query_log'].write(entry)
+        self.assertTrue(raced)
+        query = SlowQuery.query.filter_by(statement='SELECT 1').one()
+        self.assertEqual((query.count, query.max_ms), (2, 7.0))
+
+
+class TestBackup(TestBase):
+    """Test backing up and restoring the org data."""
+
+    def setUp(self):
+        """Give the employees a department, role and manager."""
+        super(TestBackup, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'backup.ndjson.gz')
+        department = Department(name='IT', description='The IT Department')
+        role = Role(name='Engineer', description='Builds things')
+        db.session.add_all([department, role])
+        db.session.flush()
+        admin = Employee.query.filter_by(username='admin').one()
+        employee = Employee.query.filter_by(username='test_user').one()
+        employee.department_id = department.id
+        employee.role_id = role.id
+        db.session.commit()
+        # The manager's id is higher than their report's.
+        set_manager(admin, employee)
+        db.session.commit()
+
+    def test_round_trip(self):
+        """Test that a replacing restore brings back the backed up rows."""
+        history = sorted(tuple(row) for row in db.session.execute(
+            assignments.select()))
+        self.assertTrue(any(row.valid_to != END_OF_TIME for row in
+                            db.session.execute(assignments.select())))
+        counts = backup.dump(self.path, chunk_size=1)
+        self.assertEqual(counts, {'tenants': 1, 'departments': 1,
+                                  'roles': 1, 'employees': 2,
+                                  'employees_archive': 0,
+                                  'assignment_history': len(history)})
+        Employee.query.filter_by(username='admin').one().first_name = 'Gone'
+        db.session.add(Employee(email='new@email.com', username='new'))
+        db.session.commit()
+
+        counts = backup.restore(self.path, replace=True, chunk_size=1)
+        self.assertEqual(counts['employees'], 2)
+        self.assertEqual(Employee.query.count(), 2)
+        admin = Employee.query.filter_by(username='admin').one()
+        self.assertIsNone(admin.first_name)
+        self.assertEqual(admin.manager.username, 'test_user')
+        self.assertEqual(admin.manager.department.name, 'IT')
+        self.assertEqual(headcount_under(admin.manager), 1)
+        self.assertEqual(len(assignments_as_of(datetime.utcnow())), 2)
+        # Closed intervals are restored too, not just current assignments.
+        self.assertEqual(sorted(tuple(row) for row in db.session.execute(
+            assignments.select())), history)
+
+    def test_replace_restores_the_archive(self):
+        """Test that employees archived since the backup are dropped."""
+        backup.dump(self.path)
+        employee = Employee(email='gone@email.com', username='gone')
+        db.session.add(employee)
+        db.session.flush()
+        deactivate(employee)
+        db.session.commit()
+        archive_inactive(datetime.utcnow() + timedelta(seconds=1))
+        self.assertTrue(email_taken('gone@email.com'))
+
+        backup.restore(self.path, replace=True)
+        self.assertEqual(ArchivedEmployee.query.count(), 0)
+        self.assertFalse(email_taken('gone@email.com'))
+
+    def test_replace_signs_everyone_out(self):
+        """Test that sessions and tokens from before a replace are revoked."""
+        self.login('test_user@email.com', 'test2019')
+        token = self.client.post(url_for('auth.issue_token'), json={
+            'email': 'test_user@email.com',
+            'password': 'test2019'}).json['access_token']
+        self.assertEqual(self.client.get(
+            url_for('home.dashboard')).status_code, 200)
+        backup.dump(self.path)
+
+        backup.restore(self.path, replace=True)
+        self.assertEqual(self.client.get(
+            url_for('home.dashboard')).status_code, 302)
+        self.assertEqual(self.client.get(url_for('home.dashboard'), headers={
+            'Authorization': 'Bearer ' + token}).status_code, 302)
+        self.login('test_user@email.com', 'test2019')
+        self.assertEqual(self.client.get(
+            url_for('home.dashboard')).status_code, 200)
+
+    def test_version_1_backups_open_current_assignments(self):
+        """Test that a backup without history still restores one."""
+        backup.dump(self.path)
+        with gzip.open(self.path, 'rt') as original:
+            records = [json.loads(line) for line in original]
+        records[0]['version'] = 1
+        # Drop the history table, from its column line to its end line.
+        first, last = [index for index, record in enumerate(records)
+                       if isinstance(record, dict) and 'assignment_history'
+                       in (record.get('table'), record.get('end'))]
+        with gzip.open(self.path, 'wt') as older:
+            older.writelines(json.dumps(record) + '\n' for record
+                             in records[:first] + records[last + 1:])
+        backup.restore(self.path, replace=True)
+        self.assertEqual(len(assignments_as_of(datetime.utcnow())), 2)
+
+    def test_restore_into_an_empty_database(self):
+        """Test that restored employees can log in."""
+        backup.dump(self.path)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        backup.restore(self.path)
+        response = self.login('test_user@email.com', 'test2019')
+        self.assertEqual(response.status_code, 302)
+
+    def test_restore_refuses_existing_rows(self):
+        """Test that a restore only overwrites rows when asked to."""
+        backup.dump(self.path)
+        with self.assertRaises(backup.BackupError):
+            backup.restore(self.path)
+
+    def test_truncated_backup_changes_nothing(self):
+        """Test that a backup cut short is rolled back."""
+        backup.dump(self.path)
+        with gzip.open(self.path, 'rt') as original:
+            lines = original.readlines()
+        with gzip.open(self.path, 'wt') as truncated:
+            truncated.writelines(lines[:-3])
+        with self.assertRaises(backup.BackupError):
+            backup.restore(self.path, replace=True)
+        self.assertEqual(Employee.query.count(), 2)
+
+    def test_newer_versions_are_refused(self):
+        """Test that a backup from a later release is not misread."""
+        with gzip.open(self.path, 'wt') as newer:
+            newer.write(json.dumps({'format': backup.FORMAT,
+                                    'version': backup.VERSION + 1}) + '\n')
+        with self.assertRaises(backup.BackupError):
+            backup.restore(self.path, replace=True)
+
+    def test_malformed_lines_are_refused(self):
+        """Test that a line that is neither a row nor a table is an error."""
+        backup.dump(self.path)
+        with gzip.open(self.path, 'rt') as original:
+            lines = original.readlines()
+        for line in ('"table"\n', '42\n', 'null\n'):
+            with gzip.open(self.path, 'wt') as malformed:
+                malformed.writelines(lines[:2] + [line] + lines[2:])
+            with self.assertRaises(backup.BackupError):
+                backup.restore(self.path, replace=True)
+        self.assertEqual(Employee.query.count(), 2)
+
+
+class TestAccessTokens(TestBase):
+    """Test the bearer tokens of API clients."""
+
+    def token(self, email='test_user@email.com', password='test2019'):
+        """Return a new token for an employee."""
+        response = self.client.post(url_for('auth.issue_token'), json={
+            'email': email, 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.json['access_token']
+
+    def get(self, endpoint, token):
+        """Request a page with a bearer token."""
+        return self.client.get(url_for(endpoint), headers={
+            'Authorization': 'Bearer ' + token})
+
+    def test_token_authenticates_without_reading_employees(self):
+        """Test that a token is checked without an employee lookup."""
+        token = self.token()
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        record)
+        self.assertEqual(self.get('home.dashboard', token).status_code, 200)
+        self.assertFalse([statement for statement in statements
+                          if 'FROM employees' in statement])
+
+    def test_wrong_password_gets_no_token(self):
+        """Test that a token needs the employee's password."""
+        response = self.client.post(url_for('auth.issue_token'), json={
+            'email': 'test_user@email.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        for body in ({}, ['test_user@email.com', 'test2019'],
+                     {'email': ['test_user@email.com'], 'password': 'x'},
+                     {'email': 'test_user@email.com', 'password': 2019}):
+            response = self.client.post(url_for('auth.issue_token'),
+                                        json=body)
+            self.assertEqual(response.status_code, 400)
+
+    def test_admin_claim(self):
+        """Test that only an admin's token opens admin pages."""
+        self.assertEqual(self.get('home.admin_dashboard',
+                                  self.token()).status_code, 403)
+        admin = self.token('admin@email.com', 'admin2019')
+        self.assertEqual(self.get('home.admin_dashboard',
+                                  admin).status_code, 200)
+
+    def test_expired_and_tampered_tokens_are_rejected(self):
+        """Test that only unexpired tokens signed by the app are accepted."""
+        token = self.token()
+        self.assertEqual(self.get('home.dashboard',
+                                  token[:-2] + 'xx').status_code, 302)
+        self.app.config['ACCESS_TOKEN_TTL'] = -1
+        self.assertEqual(self.get('home.dashboard', token).status_code, 302)
+
+    def test_revoked_token_is_rejected(self):
+        """Test revoking the token a request is made with."""
+        token = self.token()
+        response = self.client.post(url_for('auth.revoke_token'), headers={
+            'Authorization': 'Bearer ' + token})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get('home.dashboard', token).status_code, 302)
+        self.assertEqual(self.get('home.dashboard',
+                                  self.token()).status_code, 200)
+
+    def test_deactivation_revokes_tokens(self):
+        """Test that a deactivated employee's tokens stop working."""
+        token = self.token()
+        employee = Employee.query.filter_by(username='test_user').one()
+        employee.is_active = False
+        db.session.commit()
+        self.assertEqual(self.get('home.dashboard', token).status_code, 302)
+
+    def test_revocations_are_reloaded_periodically(self):
+        """Test that revocations from other workers apply after a refresh."""
+        token = self.token()
+        self.assertEqual(self.get('home.dashboard', token).status_code, 200)
+        db.session.add(RevokedToken(
+            jti=access_tokens.claims(token)['jti'],
+            expires_at=datetime.utcnow() + timedelta(minutes=15)))
+        db.session.commit()
+        self.assertEqual(self.get('home.dashboard', token).status_code, 200)
+        self.app.extensions['access_tokens'].next_refresh = 0
+        self.assertEqual(self.get('home.dashboard', token).status_code, 302)
+
+
+class TestBatch(TestBase):
+    """Test applying many operations with one request."""
+
+    def setUp(self):
+        """Add a department and log in as the admin."""
+        super(TestBatch, self).setUp()
+        department = Department(name='IT', description='The IT Department')
+        db.session.add(department)
+        db.session.commit()
+        self.department_id = department.id
+        self.user_id = Employee.query.filter_by(
+            username='test_user').one().id
+        self.login('admin@email.com', 'admin2019')
+
+    def batch(self, *operations):
+        """Post operations to the batch endpoint."""
+        return self.client.post(url_for('admin.batch'),
+                                json={'operations': list(operations)})
+
+    def test_operations_refer_to_earlier_creates(self):
+        """Test creating a team and assigning people to it in one batch."""
+        response = self.batch(
+            {'op': 'create', 'entity': 'departments', 'ref': 'ops',
+             'values': {'name': 'Operations'}},
+            {'op': 'create', 'entity': 'roles', 'ref': 'lead',
+             'values': {'name': 'Lead', 'description': 'Leads'}},
+            {'op': 'create', 'entity': 'employees', 'ref': 'boss',
+             'values': {'email': 'boss@email.com', 'username': 'boss',
+                        'password': 'boss2019',
+                        'department_id': {'ref': 'ops'},
+                        'role_id': {'ref': 'lead'}}},
+            {'op': 'assign', 'entity': 'employees', 'id': self.user_id,
+             'values': {'department_id': {'ref': 'ops'},
+                        'manager_id': {'ref': 'boss'}}},
+            {'op': 'update', 'entity': 'departments',
+             'id': self.department_id, 'values': {'description': 'Tech'}})
+        self.assertEqual(response.status_code, 200)
+        results = response.json['results']
+        self.assertEqual([result['status'] for result in results],
+                         ['created', 'created', 'created', 'assigned',
+                          'updated'])
+        boss = Employee.query.get(results[2]['id'])
+        self.assertEqual(boss.department.name, 'Operations')
+        self.assertEqual(boss.role.name, 'Lead')
+        user = Employee.query.get(self.user_id)
+        self.assertEqual(user.manager_id, boss.id)
+        self.assertEqual(headcount_under(boss), 1)
+        self.assertEqual(Department.query.get(self.department_id).description,
+                         'Tech')
+
+    def test_failed_operation_rolls_back_the_batch(self):
+        """Test that nothing is written if any operation fails."""
+        response = self.batch(
+            {'op': 'create', 'entity': 'roles', 'values': {'name': 'Lead'}},
+            {'op': 'assign', 'entity': 'employees', 'id': 9999,
+             'values': {'role_id': None}})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json['index'], 1)
+        self.assertEqual(Role.query.count(), 0)
+
+    def test_invalid_operations_are_rejected(self):
+        """Test the checks made before anything is written."""
+        for operations in (
+                [{'op': 'create', 'entity': 'departments',
+                  'values': {'name': 'IT'}}],
+                [{'op': 'create', 'entity': 'roles',
+                  'values': {'name': 'Lead', 'is_admin': True}}],
+                [{'op': 'drop', 'entity': 'roles', 'id': 1}],
+                [{'op': 'assign', 'entity': 'employees', 'id': self.user_id,
+                  'values': {'role_id': {'ref': 'missing'}}}],
+                [{'op': 'create', 'entity': ['roles']}],
+                [{'op': 'delete', 'entity': 'roles', 'id': {'ref': [1]}}]):
+            response = self.batch(*operations)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(response.json['index'], 0)
+
+    def test_reporting_cycles_are_refused(self):
+        """Test that a batch cannot make someone their own manager."""
+        response = self.batch(
+            {'op': 'create', 'entity': 'employees', 'ref': 'new',
+             'values': {'email': 'new@email.com', 'username': 'new',
+                        'manager_id': self.user_id}},
+            {'op': 'assign', 'entity': 'employees', 'id': self.user_id,
+             'values': {'manager_id': {'ref': 'new'}}})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json['index'], 1)
+        self.assertIsNone(Employee.query.filter_by(username='new').first())
+
+    def test_assignments_are_written_together(self):
+        """Test that many assignments share their UPDATE statements."""
+        employees = [Employee(email='user{}@email.com'.format(number),
+                              username='user{}'.format(number))
+                     for number in range(20)]
+        db.session.add_all(employees)
+        db.session.commit()
+        ids = [employee.id for employee in employees]
+        updates = []
+
+        def record(conn, cursor, statement, *args):
+            if statement.startswith('UPDATE employees'):
+                updates.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute',
+                        record)
+        response = self.batch(*[
+            {'op': 'assign', 'entity': 'employees', 'id': employee_id,
+             'values': {'department_id': self.department_id}}
+            for employee_id in ids])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Department.query.get(
+            self.department_id).employees.count(), 20)
+
+    def test_delete_deactivates_employees(self):
+        """Test deleting a department and an employee."""
+        response = self.batch(
+            {'op': 'delete', 'entity': 'employees', 'id': self.user_id},
+            {'op': 'delete', 'entity': 'departments',
+             'id': self.department_id})
+        self.assertEqual([result['status']
+                          for result in response.json['results']],
+                         ['deactivated', 'deleted'])
+        self.assertFalse(Employee.query.get(self.user_id).is_active)
+        self.assertIsNone(Department.query.get(self.department_id))
+
+    def test_inactive_employees_are_refused(self):
+        """Test that inactive employees cannot manage or be deactivated."""
+        departed = Employee(email='gone@email.com', username='gone')
+        db.session.add(departed)
+        db.session.flush()
+        deactivate(departed)
+        db.session.commit()
+        entries = AuditEntry.query.count()
+        for operations in (
+                [{'op': 'assign', 'entity': 'employees', 'id': self.user_id,
+                  'values': {'manager_id': departed.id}}],
+                [{'op': 'delete', 'entity': 'employees', 'id': departed.id}],
+                [{'op': 'delete', 'entity': 'employees', 'id': self.user_id},
+                 {'op': 'delete', 'entity': 'employees', 'id': self.user_id}]):
+            response = self.batch(*operations)
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(response.json['index'], len(operations) - 1)
+        self.assertIsNone(Employee.query.get(self.user_id).manager_id)
+        self.assertTrue(Employee.query.get(self.user_id).is_active)
+        self.assertEqual(AuditEntry.query.count(), entries)
+
+    def test_required_fields_cannot_be_cleared(self):
+        """Test that an update cannot null a field a create requires."""
+        for entity, target, field in (
+                ('departments', self.department_id, 'name'),
+                ('employees', self.user_id, 'email'),
+                ('employees', self.user_id, 'username')):
+            for value in (None, ''):
+                response = self.batch({'op': 'update', 'entity': entity,
+                                       'id': target,
+                                       'values': {field: value}})
+                self.assertEqual(response.status_code, 422)
+                self.assertEqual(response.json['index'], 0)
+        self.assertEqual(Department.query.get(self.department_id).name, 'IT')
+        response = self.batch({'op': 'update', 'entity': 'departments',
+                               'id': self.department_id,
+                               'values': {'description': None}})
+        self.assertEqual(response.status_code, 200)
+
+    def test_non_admins_cannot_batch(self):
+        """Test that only admins may use the batch endpoint."""
+        self.client.get(url_for('auth.logout'))
+        self.login('test_user@email.com', 'test2019')
+        response = self.batch({'op': 'create', 'entity': 'roles',
+                               'values': {'name': 'Lead'}})
+        self.assertEqual(response.status_code, 403)
+
+
+class TestBakedQueries(TestBase):
+    """Test the baked employee lookups."""
+
+    def test_lookups(self):
+        """Test that the baked lookups find active employees only."""
+        employee = Employee.query.filter_by(username='test_user').one()
+        self.assertIs(active_employee(employee.id), employee)
+        self.assertIs(active_employee_by_email('test_user@email.com'),
+                      employee)
+        self.assertTrue(email_taken('test_user@email.com'))
+        self.assertTrue(username_taken('admin'))
+        self.assertFalse(username_taken('nobody'))
+        deactivate(employee)
+        db.session.commit()
+        self.assertIsNone(active_employee(employee.id))
+        self.assertIsNone(active_employee_by_email('test_user@email.com'))
+        self.assertTrue(email_taken('test_user@email.com'))
+
+    def test_statements_are_cached(self):
+        """Test that repeated lookups reuse their cached statements."""
+        active_employee_by_email('nobody@email.com')
+        email_taken('nobody@email.com')
+        size = len(bakery.cache)
+        for email in ('test_user@email.com', 'admin@email.com'):
+            active_employee_by_email(email)
+            email_taken(email)
+        self.assertEqual(len(bakery.cache), size)
+
+    def test_cached_statements_are_tenant_scoped(self):
+        """Test that one cached statement serves each tenant its own rows."""
+        employee_id = Employee.query.filter_by(username='admin').one().id
+        self.assertIsNotNone(active_employee(employee_id))
+        tenant = Tenant(slug='acme', name='Acme')
+        db.session.add(tenant)
+        db.session.commit()
+        with tenant_scope(tenant.id):
+            self.assertIsNone(active_employee(employee_id))
+            self.assertIsNone(active_employee_by_email('admin@email.com'))
+            self.assertFalse(email_taken('admin@email.com'))
+            self.assertFalse(username_taken('admin'))
+
+
+class TestAssets(TestBase):
+    """Test the static asset pipeline."""
+
+    def setUp(self):
+        """Build a copy of the static folder."""
+        super(TestAssets, self).setUp()
+        self.static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static)
+        shutil.copytree(self.app.static_folder,
+                        os.path.join(self.static, 'static'),
+                        ignore=shutil.ignore_patterns('dist'))
+        self.static = os.path.join(self.static, 'static')
+        self.manifest = build(self.static)
+        self.app.extensions['assets'].update(
+            dist=os.path.join(self.static, 'dist'), manifest=self.manifest)
+
+    def test_build_fingerprints_and_rewrites_css(self):
+        """Test that stylesheets point at hashed image names."""
+        css_path = self.manifest['css/style.css']
+        self.assertRegex(css_path, r'^css/style\.[0-9a-f]{10}\.css$')
+        with open(os.path.join(self.static, 'dist', css_path)) as css:
+            css = css.read()
+        self.assertIn(os.path.basename(self.manifest['img/intro-bg.jpg']),
+                      css)
+        self.assertIn(os.path.basename(self.manifest['img/intro-bg.webp']),
+                      css)
+
+    def test_precompressed_asset_is_served(self):
+        """Test that gzip variants are served with immutable caching."""
+        url = url_for('assets', filename=self.manifest['css/style.css'])
+        response = self.client.get(url,
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.mimetype, 'text/css')
+
+        response = self.client.get(url)
+        self.assertNotIn('Content-Encoding', response.headers)
+        response.close()
+
+    def test_pages_use_hashed_urls(self):
+        """Test that templates link to the built stylesheet."""
+        response = self.client.get(url_for('home.homepage'))
+        self.assertIn(self.manifest['css/style.css'].encode(),
+                      response.data)
+
+    def test_cdn_fallback_keeps_integrity(self):
+        """Test that jQuery from the CDN is checked against its hash."""
+        response = self.client.get(url_for('home.homepage'))
+        self.assertIn(b'integrity="sha256-FgpCb/KJQlLNfOu91ta32o/NMZxltwRo8Qt'
+                      b'mkMRdAu8=" crossorigin="anonymous"', response.data)
+
+
+class TestListings(TestBase):
+    """Test the streamed listing pages."""
+
+    def setUp(self):
+        """Log in as the admin and assign the test user."""
+        super(TestListings, self).setUp()
+        department = Department(name='IT', description='The IT Department')
+        employee = Employee.query.filter_by(username='test_user').first()
+        employee.first_name, employee.last_name = 'Test', 'User'
+        employee.department = department
+        db.session.commit()
+        self.employee_id = employee.id
+        self.login('admin@email.com', 'admin2019')
+
+    def test_employees_are_streamed(self):
+        """Test that the employee listing is streamed with row links."""
+        response = self.client.get(url_for('admin.list_employees'))
+        self.assertTrue(response.is_streamed)
+        self.assertIn(b'Test User', response.data)
+        self.assertIn(url_for('admin.assign_employee',
+                              id=self.employee_id).encode(), response.data)
+
+    def test_department_counts(self):
+        """Test that departments show their employee counts."""
+        db.session.add(Department(name='HR', description='People'))
+        db.session.commit()
+        response = self.client.get(url_for('admin.list_departments'))
+        self.assertRegex(response.data.decode(), r'IT </td>\s*<td> The IT '
+                         r'Department </td>\s*<td> 1 </td>')
+        self.assertRegex(response.data.decode(), r'People </td>\s*<td> 0 ')
+
+    def test_department_members_are_paged(self):
+        """Test the department page and API page through members by id."""
+        department = Department.query.filter_by(name='IT').one()
+        db.session.add_all([
+            Employee(username='member{}'.format(number),
+                     email='member{}@email.com'.format(number),
+                     first_name='Member', last_name=str(number),
+                     department=department) for number in range(5)])
+        db.session.add(Employee(username='gone', email='gone@email.com',
+                                department=department, is_active=False))
+        db.session.commit()
+        url = url_for('admin.list_department_employees', id=department.id)
+
+        first = self.client.get(url, query_string={'limit': 4}).json
+        self.assertEqual(first['employee_count'], 6)
+        self.assertTrue(first['has_more'])
+        second = self.client.get(url, query_string={
+            'limit': 4, 'after': first['cursor']}).json
+        self.assertFalse(second['has_more'])
+        self.assertEqual(
+            [e['username'] for e in first['employees'] + second['employees']],
+            ['test_user'] + ['member{}'.format(n) for n in range(5)])
+        for limit in (0, -1):
+            page = self.client.get(url, query_string={'limit': limit}).json
+            self.assertEqual(len(page['employees']), 1)
+            self.assertTrue(page['has_more'])
+
+        response = self.client.get(url_for('admin.department_detail',
+                                           id=department.id))
+        self.assertIn(b'6 employees', response.data)
+        self.assertIn(b'Member 4', response.data)
+        self.assertNotIn(b'Next Page', response.data)
+        self.assertEqual(self.client.get(url_for(
+            'admin.list_role_employees', id=999)).status_code, 404)
+
+    def test_empty_listing(self):
+        """Test that an empty listing renders its placeholder."""
+        response = self.client.get(url_for('admin.list_roles'))
+        self.assertIn(b'No roles have been added.', response.data)
+
+    def test_flashed_messages_are_consumed(self):
+        """Test that a flashed message is shown once."""
+        self.client.post(url_for('admin.add_role'),
+                         data=dict(name='CEO', description='Boss'))
+        response = self.client.get(url_for('admin.list_roles'))
+        self.assertIn(b'successfully added a new role', response.data)
+        response = self.client.get(url_for('admin.list_roles'))
+        self.assertNotIn(b'successfully added a new role', response.data)
+
+
+class TestTemplates(TestBase):
+    """Test template caching and warmup."""
+
+    def test_warmup_fills_bytecode_cache(self):
+        """Test that warming up writes bytecode for every template."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.app.config.update(JINJA_BYTECODE_CACHE_DIR=cache_dir,
+                               TEMPLATE_WARMUP=True)
+        self.app.jinja_env.cache.clear()
+        init_templates(self.app)
+
+        names = warm_templates(self.app)
+        self.assertIn('admin/employees/employees.html', names)
+        self.assertIn('bootstrap/wtf.html', names)
+        self.assertEqual(len(os.listdir(cache_dir)), len(names))
+
+    def test_shared_cache_directory_is_refused(self):
+        """Test that bytecode is not read from a directory others can write."""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        os.chmod(cache_dir, 0o777)
+        self.app.config['JINJA_BYTECODE_CACHE_DIR'] = cache_dir
+        with self.assertRaises(ValueError):
+            init_templates(self.app)
+
+    def test_relative_cache_directory_is_private(self):
+        """Test that a relative cache directory is made in the instance."""
+        instance = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, instance)
+        self.app.instance_path = instance
+        self.app.config['JINJA_BYTECODE_CACHE_DIR'] = 'jinja-cache'
+        init_templates(self.app)
+        mode = os.stat(os.path.join(instance, 'jinja-cache')).st_mode
+        self.assertEqual(mode & 0o077, 0)
+
+
+class TestJobs(TestBase):
+    """Test the background job queue."""
+
+    def setUp(self):
+        """Register tasks used by the tests."""
+        super(TestJobs, self).setUp()
+        self.app.config['JOB_RETRY_DELAY'] = 0
+        self.calls = []
+
+        @job_queue.task('test_flaky', max_attempts=2)
+        def flaky(job):
+            self.calls.append('flaky')
+            raise RuntimeError('boom')
+
+        @job_queue.task('test_cancelled')
+        def cancelled(job):
+            job_queue.cancel(Job.query.get(job.job_id))
+            job.progress(1, 2)
+            self.calls.append('not reached')
+
+        self.addCleanup(job_queue.tasks.pop, 'test_flaky')
+        self.addCleanup(job_queue.tasks.pop, 'test_cancelled')
+
+    def test_reassign_department(self):
+        """Test that a job moves employees and records its progress."""
+        source = Department(name='Old', description='Old')
+        target = Department(name='New', description='New')
+        db.session.add_all([source, target])
+        db.session.flush()
+        for employee in Employee.query.all():
+            employee.department_id = source.id
+        job = job_queue.enqueue('reassign_department', from_id=source.id,
+                                to_id=target.id)
+        db.session.commit()
+
+        self.assertEqual(job_queue.run_pending(), 1)
+        job = Job.query.get(job.id)
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual((job.progress, job.total), (2, 2))
+        self.assertEqual(json.loads(job.result), {'moved': 2})
+        self.assertEqual(target.employees.count(), 2)
+
+    def test_failed_job_is_retried(self):
+        """Test that a failing job is retried, then marked failed."""
+        job = job_queue.enqueue('test_flaky')
+        db.session.commit()
+
+        self.assertEqual(job_queue.run_pending(), 2)
+        job = Job.query.get(job.id)
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('RuntimeError: boom', job.error)
+
+        self.assertTrue(job_queue.retry(job))
+        self.assertEqual(Job.query.get(job.id).status, 'queued')
+
+    def test_cancellation(self):
+        """Test cancelling queued and running jobs."""
+        queued = job_queue.enqueue('test_flaky')
+        running = job_queue.enqueue('test_cancelled')
+        db.session.commit()
+        self.assertTrue(job_queue.cancel(queued))
+
+        self.assertEqual(job_queue.run_pending(), 1)
+        self.assertEqual(Job.query.get(queued.id).status, 'cancelled')
+        self.assertEqual(Job.query.get(running.id).status, 'cancelled')
+        self.assertEqual(self.calls, [])
+        self.assertFalse(job_queue.cancel(queued))
+
+    def test_stale_jobs_are_requeued(self):
+        """Test that a job whose worker died is queued again."""
+        self.app.config['JOB_STALE_AFTER'] = 0
+        job = job_queue.enqueue('rebuild_org_chart')
+        db.session.commit()
+        job_queue.claim('dead-worker')
+
+        self.assertEqual(job_queue.requeue_stale(), 1)
+        self.assertEqual(job_queue.run_pending(), 1)
+        self.assertEqual(Job.query.get(job.id).status, 'succeeded')
+
+    def test_job_killing_its_worker_runs_out_of_attempts(self):
+        """Test that requeues after crashes count against max attempts."""
+        self.app.config['JOB_STALE_AFTER'] = 0
+        job = job_queue.enqueue('test_flaky')
+        db.session.commit()
+        job_queue.claim('dead-worker')
+        self.assertEqual(job_queue.requeue_stale(), 1)
+        job_queue.claim('dead-worker')
+        self.assertEqual(job_queue.requeue_stale(), 0)
+        job = Job.query.get(job.id)
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(job_queue.run_pending(), 0)
+
+    def test_periodic_tasks_are_queued_once(self):
+        """Test that workers checking the schedule together queue once."""
+        names = [job.name for job in job_queue.enqueue_scheduled()]
+        self.assertIn('snapshot_headcount', names)
+        self.assertEqual(job_queue.enqueue_scheduled(), [])
+        self.assertEqual(Job.query.filter_by(
+            name='snapshot_headcount').count(), 1)
+
+        JobSchedule.query.filter_by(name='snapshot_headcount').update(
+            {JobSchedule.next_run_at: datetime.utcnow() - timedelta(hours=1)})
+        db.session.commit()
+        self.assertEqual(len(job_queue.enqueue_scheduled()), 1)
+        self.assertEqual(job_queue.enqueue_scheduled(), [])
+
+    def test_admin_views(self):
+        """Test queueing a job from the jobs page and polling it."""
+        self.login('admin@email.com', 'admin2019')
+        response = self.client.post(url_for('admin.rebuild_org_chart'))
+        self.assertRedirects(response, url_for('admin.list_jobs'))
+        job = Job.query.one()
+
+        response = self.client.get(url_for('admin.list_jobs'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'rebuild_org_chart', response.data)
+
+        job_queue.run_pending()
+        response = self.client.get(url_for('admin.job_status', id=job.id))
+        self.assertEqual(response.json['status'], 'succeeded')
+        self.assertEqual(response.json['result'], {'links': 2})
+
+    def test_non_admin_cannot_see_jobs(self):
+        """Test that non-admin users cannot access the jobs page."""
+        self.login('test_user@email.com', 'test2019')
+        response = self.client.get(url_for('admin.list_jobs'))
+        self.assertEqual(response.status_code, 403)
+
+
 if __name__ == '__main__':
     unittest.main()